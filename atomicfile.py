@@ -0,0 +1,24 @@
+"""atomicfile.py: Replaces files whole so a crash can't leave them truncated."""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+from contextlib import contextmanager
+import os
+
+
+@contextmanager
+def atomic_write(path):
+    """
+    Opens a temporary file next to a path for writing and renames it over
+    the path once the block completes. The path is left untouched if the
+    block raises.
+    :param path: The path of the file to replace
+    :return: A context manager giving the open file
+    """
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as f:
+        yield f
+    os.rename(temporary, path)
@@ -0,0 +1,204 @@
+"""audit.py: Records what a run deleted and what it failed to delete.
+
+Deleted object counts only say what was queued. Stores record every object
+they failed to delete here and the run can be verified afterwards, either by
+listing every container again or by checking a uniform sample of the listed
+objects, which bounds how many were left behind at a fraction of the cost.
+"""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+import math
+import random
+import threading
+import time
+
+# The most failed objects to list in a report. All of them are counted.
+MAX_FAILURES_REPORTED = 10000
+
+# The z score of the confidence bounds of sampled verification (95%)
+CONFIDENCE_Z = 1.96
+
+
+def upper_bound(survivors, samples, z=CONFIDENCE_Z):
+    """
+    Returns the upper Wilson score bound of the fraction of objects left
+    behind
+    :param survivors: The number of sampled objects that still exist
+    :param samples: The number of objects sampled
+    :param z: The z score of the confidence level
+    :return: A fraction between 0 and 1
+    """
+    if samples == 0:
+        return 1.0
+    p = float(survivors) / samples
+    z2 = z * z
+    return min(1.0, (p + z2 / (2 * samples) + z * math.sqrt(
+        p * (1 - p) / samples + z2 / (4 * samples * samples))) /
+        (1 + z2 / samples))
+
+
+class Reservoir:
+    """A uniform random sample of a stream of unknown length. Items are
+    skipped over in geometrically distributed jumps (Algorithm L) so most of
+    the stream costs nothing."""
+
+    def __init__(self, size, rng=None):
+        """
+        Initializes a reservoir
+        :param size: The most items to keep
+        :param rng: A random.Random to use
+        :return: None
+        """
+        self.size = size
+        self.items = list()
+        self.seen = 0
+        self.rng = rng or random.Random()
+        self.lock = threading.Lock()
+        self.weight = math.exp(math.log(self.uniform()) / size)
+        self.next = size + self.skip()
+
+    def uniform(self):
+        """
+        Returns a random number in (0, 1)
+        :return: A float
+        """
+        value = 0.0
+        while value == 0.0:
+            value = self.rng.random()
+        return value
+
+    def skip(self):
+        """
+        Returns how many items to pass over before the next is kept
+        :return: An int
+        """
+        return int(math.floor(math.log(self.uniform()) /
+                              math.log(1 - self.weight)))
+
+    def add(self, container, objects):
+        """
+        Offers a page of objects to the sample
+        :param container: The name of their container
+        :param objects: A list of object names
+        :return: None
+        """
+        with self.lock:
+            start = self.seen
+            self.seen += len(objects)
+
+            index = 0
+            while len(self.items) < self.size and index < len(objects):
+                self.items.append((container, objects[index]))
+                index += 1
+
+            while self.next < self.seen:
+                self.items[self.rng.randrange(self.size)] = \
+                    (container, objects[self.next - start])
+                self.weight *= math.exp(math.log(self.uniform()) / self.size)
+                self.next += self.skip() + 1
+
+
+class ContainerAudit:
+    """What a run did to a single container"""
+
+    __slots__ = ('listed', 'failed', 'started', 'finished', 'bytes',
+                 'deleted', 'remaining')
+
+    def __init__(self):
+        self.listed = 0
+        self.failed = 0
+        self.started = None
+        self.finished = None
+        self.bytes = None
+        self.deleted = False
+        self.remaining = None
+
+    def report(self):
+        """
+        Builds the report of the container
+        :return: A dict
+        """
+        seconds = None
+        if self.started is not None and self.finished is not None:
+            seconds = self.finished - self.started
+        return dict(listed=self.listed, failed=self.failed, bytes=self.bytes,
+                    listing_seconds=seconds,
+                    objects_per_second=self.listed / seconds
+                    if seconds else None,
+                    container_deleted=self.deleted,
+                    remaining=self.remaining)
+
+
+class Audit:
+    """A thread safe record of a run"""
+
+    def __init__(self, samples=0):
+        """
+        Initializes an audit
+        :param samples: The number of listed objects to sample for
+         verification. 0 to sample none.
+        :return: None
+        """
+        self.lock = threading.Lock()
+        self.containers = dict()
+        self.failed = 0
+        self.failures = list()
+        self.sample = Reservoir(samples) if samples > 0 else None
+
+    def container(self, name):
+        """
+        Returns the record of a container, creating it if needed
+        :param name: The name of the container
+        :return: A ContainerAudit
+        """
+        with self.lock:
+            if name not in self.containers:
+                self.containers[name] = ContainerAudit()
+            return self.containers[name]
+
+    def listed(self, container, objects):
+        """
+        Records a page of objects listed for deletion
+        :param container: The name of the container
+        :param objects: A list of object names
+        :return: None
+        """
+        record = self.container(container)
+        now = time.time()
+        if record.started is None:
+            record.started = now
+        record.finished = now
+        record.listed += len(objects)
+        if self.sample is not None:
+            self.sample.add(container, objects)
+
+    def record_failure(self, container, object_, error):
+        """
+        Records an object that couldn't be deleted
+        :param container: The name of the container
+        :param object_: The name of the object
+        :param error: What went wrong
+        :return: None
+        """
+        record = self.container(container)
+        with self.lock:
+            record.failed += 1
+            self.failed += 1
+            if len(self.failures) < MAX_FAILURES_REPORTED:
+                self.failures.append(dict(container=container,
+                                          object=object_, error=str(error)))
+
+    def report(self):
+        """
+        Builds the per container part of the report
+        :return: A tuple containing a dict of container reports and a list
+         of failures
+        """
+        with self.lock:
+            containers = dict((name, record.report())
+                              for name, record in self.containers.items())
+            return containers, list(self.failures)
@@ -0,0 +1,363 @@
+"""fakestore.py: An in-memory ObjectStore for benchmarks and load simulation.
+
+The store keeps every container in memory and injects configurable latency,
+throttling and errors into its list and delete calls. It behaves like the
+real stores as far as ThreadedDeleter can tell: objects are listed page by
+page with a marker, deletes are buffered per thread and flushed in bulk, and
+failed requests are reported and skipped.
+"""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+import math
+import random
+import threading
+import time
+from containercache import ContainerInfo
+from objectstore import ObjectStore
+from threadeddeleter import ThreadedDeleter
+
+
+class Latency:
+    """A latency distribution for simulated requests"""
+
+    def __init__(self, kind='constant', value=0.0, spread=0.0, per_item=0.0,
+                 scale=1.0):
+        """
+        Initializes a latency distribution
+        :param kind: constant, uniform or lognormal
+        :param value: The constant latency, the lower bound of a uniform
+         distribution or the median of a lognormal distribution in seconds
+        :param spread: The upper bound of a uniform distribution or the sigma
+         of a lognormal distribution
+        :param per_item: Seconds added for every object in a request
+        :param scale: A factor to apply to every latency
+        :return: None
+        """
+        if kind not in ['constant', 'uniform', 'lognormal']:
+            raise Exception('Unknown latency distribution: {}'.format(kind))
+
+        self.kind = kind
+        self.value = value
+        self.spread = spread
+        self.per_item = per_item
+        self.scale = scale
+
+    def sample(self, rng, items=1):
+        """
+        Samples a latency
+        :param rng: The random number generator to use
+        :param items: The number of objects in the request
+        :return: The latency in seconds
+        """
+        if self.kind == 'uniform':
+            latency = rng.uniform(self.value, self.spread)
+        elif self.kind == 'lognormal':
+            latency = self.value * math.exp(rng.gauss(0, self.spread))
+        else:
+            latency = self.value
+
+        return (latency + self.per_item * items) * self.scale
+
+
+class SimulatedError(Exception):
+    """Raised for injected request failures"""
+
+
+class Container:
+    """The objects of a single simulated container"""
+
+    def __init__(self, name, objects, versions=1):
+        """
+        Initializes a container. Object names are generated from their index
+        so large containers stay cheap to hold in memory.
+        :param name: The name of the container
+        :param objects: The number of keys in the container
+        :param versions: The number of versions of every key
+        :return: None
+        """
+        self.name = name
+        self.versions = versions
+        self.size = objects * versions
+        self.deleted = bytearray(self.size)
+        self.remaining = self.size
+
+    def name_of(self, index):
+        """
+        Returns the name of an object
+        :param index: The index of the object
+        :return: The name of the object
+        """
+        if self.versions == 1:
+            return 'obj-{:010d}'.format(index)
+        return 'obj-{:010d}.v{}'.format(index // self.versions,
+                                        index % self.versions)
+
+    def index_of(self, name):
+        """
+        Returns the index of an object
+        :param name: The name of the object
+        :return: The index of the object
+        """
+        if self.versions == 1:
+            return int(name[4:])
+        key, version = name[4:].split('.v')
+        return int(key) * self.versions + int(version)
+
+
+class Store(ObjectStore):
+    """An in-memory ObjectStore with injected latency and failures"""
+
+    # Whether object_exists can check single objects
+    can_check_objects = True
+
+    def __init__(self, containers, list_latency=None, delete_latency=None,
+                 error_rate=0.0, throttle_rate=0, bulk_size=100,
+                 page_size=10000, seed=0):
+        """
+        Initializes the store
+        :param containers: A list of Container objects
+        :param list_latency: The Latency of listing requests
+        :param delete_latency: The Latency of delete requests
+        :param error_rate: The fraction of requests that fail
+        :param throttle_rate: The most requests per second before requests
+         are throttled. 0 disables throttling.
+        :param bulk_size: Maximum objects to delete per request
+        :param page_size: The page size for retrieving objects
+        :param seed: The seed for the random number generator
+        :return: None
+        """
+        self.containers = dict((container.name, container)
+                               for container in containers)
+        self.list_latency = list_latency or Latency()
+        self.delete_latency = delete_latency or Latency()
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.bulk_size = bulk_size
+        self.page_size = page_size
+
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.marker = dict()
+        self.window = 0
+        self.window_requests = 0
+
+        # Counters
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self.deleted = 0
+
+    def request(self, latency, items=1):
+        """
+        Simulates a request: waits out its latency and injects failures
+        :param latency: The Latency of the request
+        :param items: The number of objects in the request
+        :return: None
+        :throws: SimulatedError if the request failed or was throttled
+        """
+        with self.lock:
+            self.requests += 1
+            delay = latency.sample(self.rng, items)
+            failed = self.rng.random() < self.error_rate
+
+            throttled = False
+            if self.throttle_rate > 0:
+                window = int(time.time())
+                if window != self.window:
+                    self.window = window
+                    self.window_requests = 0
+                self.window_requests += 1
+                throttled = self.window_requests > self.throttle_rate
+
+            if throttled:
+                self.throttled += 1
+            elif failed:
+                self.errors += 1
+
+        time.sleep(delay)
+        if throttled:
+            raise SimulatedError('503 Slow Down')
+        if failed:
+            raise SimulatedError('500 Internal Error')
+
+    def remaining(self):
+        """
+        Returns the number of objects that haven't been deleted
+        :return: The number of objects
+        """
+        return sum(container.remaining
+                   for container in self.containers.values())
+
+    def login(self):
+        """
+        Pretends to log in
+        :return: True
+        """
+        return True
+
+    def list_containers(self, prefixes, retry=2):
+        """
+        Lists containers beginning with any of the provided prefixes
+        :param prefixes: The (list of) prefixes to get containers for
+        :param retry: The number of retries to use
+        :return: A list of containers or False on error
+        """
+        if len(prefixes) == 0:
+            prefixes = ['']
+
+        return sorted(name for name in self.containers
+                      if any(name.startswith(prefix) for prefix in prefixes))
+
+    def fetch_container_info(self, container):
+        """
+        Fetches the object count of a container
+        :param container: The name of the container
+        :return: A ContainerInfo
+        """
+        self.request(self.list_latency)
+        return ContainerInfo(container,
+                             object_count=self.containers[container].remaining)
+
+    def list_objects(self, container_name, retry=2):
+        """
+        Lists objects in a given container
+        :param container_name: The name of the container to get objects from
+        :param retry: The number of retries to use
+        :return: A list of objects or False on error
+        """
+        try:
+            self.request(self.list_latency)
+        except SimulatedError as e:
+            if retry == 0:
+                ThreadedDeleter.output('List objects failed: {}'.format(e))
+                return False
+            return self.list_objects(container_name, retry - 1)
+
+        container = self.containers[container_name]
+        index = self.marker.get(container_name, -1) + 1
+        objects = list()
+        while index < container.size and len(objects) < self.page_size:
+            if not container.deleted[index]:
+                objects.append(container.name_of(index))
+            index += 1
+
+        if len(objects) > 0:
+            self.marker[container_name] = container.index_of(objects[-1])
+        else:
+            self.marker.pop(container_name, None)
+        return objects
+
+    def object_exists(self, container, object_):
+        """
+        Checks whether an object still exists. This is free of latency.
+        :param container: The name of the container
+        :param object_: The name of the object
+        :return: True if it exists
+        """
+        container = self.containers[container]
+        return not container.deleted[container.index_of(object_)]
+
+    def start_listing(self, container, start_after=None,
+                      modified_since=None):
+        """
+        Starts the next listing of a container after a key. Simulated objects
+        have no modification times so modified_since is ignored.
+        :param container: The name of the container
+        :param start_after: The key to start listing after or None
+        :param modified_since: Ignored
+        :return: None
+        """
+        if start_after is not None:
+            self.marker[container] = \
+                self.containers[container].index_of(start_after)
+
+    def delete_objects_bulk(self, local):
+        """
+        Deletes all buffered objects of a thread
+        :param local: The Local object
+        :return: None
+        """
+        with self.stage(local, 'bulk_flush'):
+            for container_name, objects in local.data.items():
+                try:
+                    self.request(self.delete_latency, len(objects))
+                except SimulatedError as e:
+                    for object_ in objects:
+                        self.delete_failed(local, container_name, object_, e)
+                    continue
+
+                container = self.containers[container_name]
+                with self.lock:
+                    for object_ in objects:
+                        index = container.index_of(object_)
+                        if not container.deleted[index]:
+                            container.deleted[index] = 1
+                            container.remaining -= 1
+                            self.deleted += 1
+        local.size = 0
+        local.data = dict()
+
+    def delete_object(self, container, object_, local):
+        """
+        Deletes an object from a given container
+        :param container: The name of the container to get objects from
+        :param object_: The name of the object to delete
+        :param local: A Local class object for storing thread-specific
+         variables in.
+        :return: None
+        """
+        if container not in local.data:
+            local.data[container] = list()
+        local.data[container].append(object_)
+        local.size += 1
+        if local.size >= max(1, self.bulk_size):
+            self.delete_objects_bulk(local)
+
+    def init_thread(self, local):
+        """
+        Initialize the thread-specific data list
+        :param local: The Local object
+        :return: None
+        """
+        local.data = dict()
+        local.size = 0
+
+    def take_buffered(self, local):
+        """
+        Removes and returns the objects a thread buffered but hasn't deleted
+        :param local: The Local object
+        :return: A list of container, object tuples
+        """
+        buffered = [(container, object_)
+                    for container, objects in local.data.items()
+                    for object_ in objects]
+        local.data = dict()
+        local.size = 0
+        return buffered
+
+    def cleanup_thread(self, local):
+        """
+        Flushes any remaining buffered objects
+        :param local: The Local object
+        :return: None
+        """
+        self.delete_objects_bulk(local)
+
+    def delete_container(self, container, retry=2):
+        """
+        Deletes a container. Objects that are left over are reported rather
+        than failing the run so the benchmark can count them.
+        :param container: The name of the container to delete
+        :param retry: The number of retries to use
+        :return: True
+        """
+        if self.containers[container].remaining > 0:
+            ThreadedDeleter.output('Delete container failed: {} objects'
+                                   ' remain.'.format(
+                                       self.containers[container].remaining))
+        self.forget_container(container)
+        return True
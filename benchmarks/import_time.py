@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""import_time.py: Measures the start up cost of loading each store.
+
+Every store is loaded in a fresh interpreter, exactly like a CLI invocation
+would. The time spent importing the deleter and the store is reported along
+with any modules belonging to other stores that were dragged in. Loading a
+store must never import another store or its SDK.
+
+Usage: python benchmarks/import_time.py [store ...]
+"""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+import json
+import os
+import subprocess
+import sys
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+# Modules that identify each bundled store and its SDK
+STORE_MODULES = {
+    'cloudfiles': ['stores.cloudfiles', 'pyrax'],
+    'fanout': ['stores.fanout'],
+    's3': ['stores.s3', 'boto3', 'botocore'],
+    's3compat': ['stores.s3compat', 'stores.s3', 'boto3', 'botocore'],
+    'swift': ['stores.swift', 'swiftclient'],
+}
+
+SNIPPET = '''
+import json, sys, time
+start = time.time()
+import delete, stores
+store = stores.load_store(sys.argv[1])
+elapsed = time.time() - start
+print(json.dumps(dict(elapsed=elapsed, modules=sorted(sys.modules))))
+'''
+
+
+def matches(module, prefixes):
+    """
+    Checks whether a module is any of the given modules or their submodules
+    :param module: The name of the module
+    :param prefixes: A list of module names
+    :return: True or False
+    """
+    for prefix in prefixes:
+        if module == prefix or module.startswith(prefix + '.'):
+            return True
+    return False
+
+
+def measure(name, runs=5):
+    """
+    Loads a store in a fresh interpreter several times
+    :param name: The name of the store to load
+    :param runs: The number of interpreters to start
+    :return: A tuple of the best time in seconds and the loaded modules
+    """
+    best = None
+    modules = []
+    for run in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, '-c', SNIPPET, name], cwd=root)
+        result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+        if best is None or result['elapsed'] < best:
+            best = result['elapsed']
+        modules = result['modules']
+    return best, modules
+
+
+def main(argv):
+    """
+    Main
+    :param argv: A list of stores to measure. Defaults to all stores.
+    :return: The code to exit with
+    """
+    sys.path.insert(0, root)
+    import stores
+
+    names = argv or stores.available_stores()
+    code = 0
+    for name in names:
+        elapsed, modules = measure(name)
+        own = STORE_MODULES.get(name, [])
+        foreign = set()
+        for other, prefixes in STORE_MODULES.items():
+            if other == name:
+                continue
+            for module in modules:
+                if matches(module, prefixes) and not matches(module, own):
+                    foreign.add(module)
+
+        print('{name:<12} {ms:8.2f} ms  {count:5d} modules'.format(
+            name=name, ms=elapsed * 1000, count=len(modules)))
+        if len(foreign) > 0:
+            print('  Imported modules of other stores: {}'.format(
+                ', '.join(sorted(foreign))))
+            code = 1
+
+    return code
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+"""run.py: Benchmarks deletion engines against simulated object stores.
+
+Every combination of scenario, engine and tuning option is run in a fresh
+interpreter so CPU time and peak RSS aren't polluted by earlier runs. Results
+are reproducible for a given seed.
+
+Usage examples:
+    python benchmarks/run.py
+    python benchmarks/run.py --scenario one_giant --max-threads 16 64 \\
+        --bulk-size 100 1000 --latency-scale 0.1
+"""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+import argparse
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+# Deletion engines that can be compared, as module:class strings
+ENGINES = {
+    'threaded': 'threadeddeleter:ThreadedDeleter',
+}
+
+
+def settings(options):
+    """
+    Builds the deleter settings of a single benchmark run
+    :param options: A dict of the benchmark options
+    :return: A Settings object
+    """
+    from settings import Settings
+
+    return Settings(max_threads=options['max_threads'],
+                    list_threads=options['list_threads'],
+                    list_prefetch=options['list_prefetch'],
+                    queue_size=options['queue_size'],
+                    memory_budget=options['memory_budget'], verbose=False,
+                    profile=options['profile'])
+
+
+def run_once(options):
+    """
+    Runs a single benchmark in this process
+    :param options: A dict of the benchmark options
+    :return: A dict of results
+    """
+    import importlib
+    from benchmarks.fakestore import Store
+    from memory import peak_rss
+    from benchmarks.scenarios import SCENARIOS
+
+    module, attribute = ENGINES[options['engine']].split(':')
+    engine = getattr(importlib.import_module(module), attribute)
+
+    store = Store(bulk_size=options['bulk_size'],
+                  page_size=options['page_size'], seed=options['seed'],
+                  **SCENARIOS[options['scenario']](options['scale'],
+                                                   options['latency_scale']))
+    total = store.remaining()
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = usage.ru_utime + usage.ru_stime
+    start = time.time()
+
+    deleter = engine(store, settings(options))
+    with deleter:
+        deleter.delete([])
+
+    elapsed = time.time() - start
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+
+    return dict(objects=total, deleted=store.deleted,
+                remaining=store.remaining(), seconds=elapsed,
+                objects_per_second=store.deleted / elapsed if elapsed else 0,
+                cpu_seconds=usage.ru_utime + usage.ru_stime - cpu,
+                peak_rss=peak_rss(), requests=store.requests,
+                errors=store.errors, throttled=store.throttled,
+                profile=deleter.profiler.report())
+
+
+def run_child(options):
+    """
+    Runs a single benchmark in a fresh interpreter
+    :param options: A dict of the benchmark options
+    :return: A dict of results
+    """
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), '--child',
+         json.dumps(options)], cwd=root)
+
+    # The deleter prints progress. Our results are on the last line.
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def main(argv):
+    """
+    Main
+    :param argv: a list of arguments
+    :return: The code to exit with
+    """
+    sys.path.insert(0, root)
+    from benchmarks.scenarios import SCENARIOS
+
+    if len(argv) == 2 and argv[0] == '--child':
+        print(json.dumps(run_once(json.loads(argv[1]))))
+        return 0
+
+    parser = argparse.ArgumentParser(description='Benchmarks deletion '
+                                                 'engines against simulated '
+                                                 'object stores.')
+    parser.add_argument('--scenario', nargs='+', choices=sorted(SCENARIOS),
+                        default=sorted(SCENARIOS))
+    parser.add_argument('--engine', nargs='+', choices=sorted(ENGINES),
+                        default=['threaded'])
+    parser.add_argument('--max-threads', nargs='+', type=int, default=[64])
+    parser.add_argument('--list-threads', nargs='+', type=int, default=[4])
+    parser.add_argument('--list-prefetch', nargs='+', type=int, default=[1],
+                        help='Pages to list ahead. 0 for none.')
+    parser.add_argument('--queue-size', nargs='+', type=int, default=[25000])
+    parser.add_argument('--memory-budget', nargs='+', type=int, default=[0],
+                        help='Bytes to bound the queue by. 0 for none.')
+    parser.add_argument('--bulk-size', nargs='+', type=int, default=[100])
+    parser.add_argument('--page-size', nargs='+', type=int, default=[10000])
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Multiplies the number of objects')
+    parser.add_argument('--latency-scale', type=float, default=1.0,
+                        help='Multiplies every simulated latency')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--profile', action='store_true',
+                        help='Print the per-stage profile of every run')
+    parser.add_argument('--json', action='store_true',
+                        help='Print results as JSON lines')
+    args = parser.parse_args(argv)
+
+    header = '{:<11} {:<9} {:>7} {:>7} {:>8} {:>6} {:>5} {:>6} {:>9} {:>8}' \
+             ' {:>7} {:>7} {:>8}'.format('scenario', 'engine', 'threads',
+                                         'listers', 'prefetch', 'queue',
+                                         'bulk', 'page', 'objects/s',
+                                         'seconds', 'cpu', 'rss MB', 'left')
+    if not args.json:
+        print(header)
+
+    for scenario, engine, max_threads, list_threads, list_prefetch, \
+            queue_size, memory_budget, bulk_size, page_size, repeat in \
+            itertools.product(args.scenario, args.engine, args.max_threads,
+                              args.list_threads, args.list_prefetch,
+                              args.queue_size, args.memory_budget,
+                              args.bulk_size, args.page_size,
+                              range(args.repeat)):
+        options = dict(scenario=scenario, engine=engine,
+                       max_threads=max_threads, list_threads=list_threads,
+                       list_prefetch=list_prefetch, queue_size=queue_size,
+                       memory_budget=memory_budget,
+                       bulk_size=bulk_size, page_size=page_size,
+                       scale=args.scale, latency_scale=args.latency_scale,
+                       seed=args.seed + repeat, profile=args.profile)
+        result = run_child(options)
+
+        if args.json:
+            result.update(options)
+            print(json.dumps(result, sort_keys=True))
+        else:
+            print('{:<11} {:<9} {:>7} {:>7} {:>8} {:>6} {:>5} {:>6} {:>9.0f}'
+                  ' {:>8.2f} {:>7.2f} {:>7.1f} {:>8}'.format(
+                      scenario, engine, max_threads, list_threads,
+                      list_prefetch, queue_size, bulk_size, page_size,
+                      result['objects_per_second'],
+                      result['seconds'], result['cpu_seconds'],
+                      result['peak_rss'] / 1048576.0, result['remaining']))
+            if args.profile:
+                print(result['profile'])
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
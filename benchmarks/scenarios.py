@@ -0,0 +1,87 @@
+"""scenarios.py: Scripted workloads for the benchmark runner.
+
+Every scenario is a function taking a scale factor and a latency scale and
+returning the keyword arguments for a fakestore.Store, less the bulk and page
+sizes which come from the configuration under test.
+"""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+from benchmarks.fakestore import Container, Latency
+
+
+def latencies(scale):
+    """
+    Returns typical list and delete latencies of a cloud object store
+    :param scale: A factor to apply to every latency
+    :return: A tuple containing the list and delete Latency
+    """
+    return (Latency('lognormal', 0.08, 0.5, scale=scale),
+            Latency('lognormal', 0.03, 0.6, per_item=0.0002, scale=scale))
+
+
+def many_small(scale, latency_scale):
+    """
+    Many small containers
+    """
+    list_latency, delete_latency = latencies(latency_scale)
+    return dict(containers=[Container('small-{:05d}'.format(index),
+                                      int(200 * scale))
+                            for index in range(100)],
+                list_latency=list_latency, delete_latency=delete_latency)
+
+
+def one_giant(scale, latency_scale):
+    """
+    A single giant container
+    """
+    list_latency, delete_latency = latencies(latency_scale)
+    return dict(containers=[Container('giant', int(100000 * scale))],
+                list_latency=list_latency, delete_latency=delete_latency)
+
+
+def versioned(scale, latency_scale):
+    """
+    Versioned buckets where every key has several versions to delete
+    """
+    list_latency, delete_latency = latencies(latency_scale)
+    return dict(containers=[Container('versioned-{:02d}'.format(index),
+                                      int(1000 * scale), versions=5)
+                            for index in range(20)],
+                list_latency=list_latency, delete_latency=delete_latency)
+
+
+def high_error(scale, latency_scale):
+    """
+    A flaky store that fails 5% of requests and throttles bursts
+    """
+    list_latency, delete_latency = latencies(latency_scale)
+    return dict(containers=[Container('flaky-{:02d}'.format(index),
+                                      int(10000 * scale))
+                            for index in range(10)],
+                list_latency=list_latency, delete_latency=delete_latency,
+                error_rate=0.05, throttle_rate=200)
+
+
+def skewed(scale, latency_scale):
+    """
+    Many small containers and one giant container that is listed last
+    """
+    list_latency, delete_latency = latencies(latency_scale)
+    containers = [Container('small-{:03d}'.format(index), int(500 * scale))
+                  for index in range(40)]
+    containers.append(Container('zz-giant', int(50000 * scale)))
+    return dict(containers=containers, list_latency=list_latency,
+                delete_latency=delete_latency)
+
+
+SCENARIOS = {
+    'many_small': many_small,
+    'one_giant': one_giant,
+    'versioned': versioned,
+    'high_error': high_error,
+    'skewed': skewed,
+}
@@ -0,0 +1,130 @@
+"""containercache.py: A bounded cache of container handles and metadata."""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+from collections import OrderedDict
+import threading
+
+
+class ContainerInfo:
+    """The handle and metadata of a container. Anything a store can't tell
+    cheaply is None."""
+
+    __slots__ = ('name', 'handle', 'object_count', 'bytes', 'region',
+                 'endpoint')
+
+    def __init__(self, name, handle=None, object_count=None, bytes=None,
+                 region=None, endpoint=None):
+        """
+        Initializes container info
+        :param name: The name of the container
+        :param handle: A store specific handle to reuse for requests
+        :param object_count: The number of objects in the container
+        :param bytes: The bytes used by the container
+        :param region: The region the container lives in
+        :param endpoint: The endpoint serving the container
+        :return: None
+        """
+        self.name = name
+        self.handle = handle
+        self.object_count = object_count
+        self.bytes = bytes
+        self.region = region
+        self.endpoint = endpoint
+
+
+class ContainerCache:
+    """A thread safe, least recently used cache of ContainerInfo objects"""
+
+    def __init__(self, max_size=10000):
+        """
+        Initializes a cache
+        :param max_size: The most containers to hold
+        :return: None
+        """
+        self.max_size = max(1, max_size)
+        self.lock = threading.Lock()
+        self.items = OrderedDict()
+
+    def get(self, name):
+        """
+        Returns cached container info
+        :param name: The name of the container
+        :return: A ContainerInfo or None if it isn't cached
+        """
+        with self.lock:
+            info = self.items.pop(name, None)
+            if info is not None:
+                # Most recently used go last
+                self.items[name] = info
+            return info
+
+    def put(self, info):
+        """
+        Caches container info, evicting the least recently used if full
+        :param info: The ContainerInfo
+        :return: None
+        """
+        with self.lock:
+            self.items.pop(info.name, None)
+            self.items[info.name] = info
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def pop(self, name):
+        """
+        Removes a container from the cache, such as once it's deleted
+        :param name: The name of the container
+        :return: None
+        """
+        with self.lock:
+            self.items.pop(name, None)
+
+    def load(self, name, loader):
+        """
+        Returns cached container info, loading it on a miss
+        :param name: The name of the container
+        :param loader: A function taking a container name and returning its
+         ContainerInfo
+        :return: A ContainerInfo
+        """
+        info = self.get(name)
+        if info is None:
+            info = loader(name)
+            self.put(info)
+        return info
+
+    def prefetch(self, names, loader, workers):
+        """
+        Loads the info of many containers in parallel. Containers that fail
+        to load are cached without metadata so they aren't retried.
+        :param names: A list of container names
+        :param loader: A function taking a container name and returning its
+         ContainerInfo
+        :param workers: The most requests to make at once
+        :return: A list of error messages
+        """
+        # Containers beyond our size would only evict each other
+        names = [name for name in names[:self.max_size]
+                 if self.get(name) is None]
+        if len(names) == 0:
+            return list()
+
+        def fetch(name):
+            try:
+                return loader(name), None
+            except Exception as e:
+                return ContainerInfo(name), str(e)
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        errors = list()
+        with ThreadPoolExecutor(max(1, min(workers, len(names)))) as executor:
+            for info, error in executor.map(fetch, names):
+                self.put(info)
+                if error is not None:
+                    errors.append(error)
+        return errors
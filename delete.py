@@ -16,27 +16,20 @@ __copyright__ = "Copyright 2015, Chelsea Urquhart"
 __license__ = "GPL"
 __email__ = "me@chelseau.com"
 
-from threadeddeleter import ThreadedDeleter
-from objectstore import ObjectStore
+from settings import Settings
+from threadeddeleter import DeleteError, ThreadedDeleter
+import argparse
 import ast
-import imp
 try:
     from configparser import ConfigParser
 except ImportError:
     from ConfigParser import ConfigParser
 import os
 import re
+import stores
 import sys
 
 
-# Configuration defaults
-class Settings:
-    store = ''
-    prefixes = list()
-    verbose = True
-    max_threads = 64
-    queue_size = 25000
-
 pwd = os.path.abspath(os.path.dirname(__file__))
 
 
@@ -48,16 +41,35 @@ def main(argv):
     """
     global pwd
 
+    # Parse arguments
+    arguments = argparse.ArgumentParser(
+        description='A lightweight, extremely fast deleter for various'
+                    ' object stores.')
+    arguments.add_argument('config', nargs='?',
+                           help='The config file to use. Defaults to app.ini'
+                                ' and ~/.objectdeleter.ini')
+    arguments.add_argument('--profile', action='store_true',
+                           help='Record per-stage timings and print a report'
+                                ' at exit')
+    arguments.add_argument('--profile-output',
+                           help='Write the profile report to this file')
+    arguments.add_argument('--profile-sampler', choices=['cprofile', 'yappi'],
+                           help='Also capture cProfile or yappi output across'
+                                ' all threads')
+    args = arguments.parse_args(argv)
+
+    settings = Settings()
+
     # Load config
     parser = ConfigParser()
-    if len(argv) == 0:
+    if args.config is None:
         parser.read([os.path.join(pwd, 'app.ini'),
                      os.path.expanduser('~/.objectdeleter.ini')])
     else:
-        if not os.path.exists(argv[0]):
-            print('File not found: {}'.format(argv[0]))
+        if not os.path.exists(args.config):
+            print('File not found: {}'.format(args.config))
             return 1
-        parser.read(argv[0])
+        parser.read(args.config)
 
     if not parser.has_section('deleter'):
         print('Invalid config file. By default app.ini and'
@@ -67,7 +79,7 @@ def main(argv):
 
     # Process config
     for key in dict(parser.items('deleter')):
-        if hasattr(Settings, key):
+        if hasattr(Settings, key) and not callable(getattr(Settings, key)):
             default = getattr(Settings, key)
 
             value = parser.get('deleter', key)
@@ -98,54 +110,64 @@ def main(argv):
                     return 1
 
             # Override default option
-            setattr(Settings, key, value)
+            setattr(settings, key, value)
+
+    # Command line options override the config
+    if args.profile or args.profile_output or args.profile_sampler:
+        settings.profile = True
+    if args.profile_output:
+        settings.profile_output = args.profile_output
+    if args.profile_sampler:
+        settings.profile_sampler = args.profile_sampler
 
     # Validate options
 
     # Validate store. This is just responsible for making sure arbitrary data
     # can't be injected here. Actually loading will happen later.
-    Settings.store = re.sub(r'[^\w\s\d]', '', Settings.store)
-    if len(Settings.store) == 0:
+    settings.store = re.sub(r'[^\w\s\d]', '', settings.store)
+    if len(settings.store) == 0:
         print("Object store module not specified. Ending script execution.")
         return 1
 
-    if Settings.max_threads <= 0:
-        print("Maximum threads is too low. It must be at least 1."
-              " Ending script execution.")
-        return 1
-
-    if Settings.queue_size < 1:
-        print("Maximum queue size is too low. It must be at least 1."
-              " Ending script execution.")
+    try:
+        settings.validate()
+    except ValueError as e:
+        print("{err} Ending script execution.".format(err=str(e)))
         return 1
 
     try:
-        module = imp.load_source('store',
-                                 os.path.join(pwd, 'stores',
-                                              str(Settings.store).lower()) +
-                                 '.py')
-        if not hasattr(module, 'Store') or not issubclass(module.Store,
-                                                          ObjectStore):
-            raise ImportError("Malformed object store module")
+        store_class = stores.load_store(settings.store)
     except ImportError as e:
         print("Failed to load {store} store: {err}. Ending script execution."
-              .format(store=str(Settings.store).lower(), err=str(e)))
+              .format(store=str(settings.store).lower(), err=str(e)))
         return 1
 
     # Initialize object store
     try:
-        store = module.Store(parser)
+        store = store_class(parser)
     except Exception as e:
         print(str(e))
         return 1
 
     # Initialize threaded deleter
-    deleter = ThreadedDeleter(store, Settings)
+    deleter = ThreadedDeleter(store, settings)
 
-    with deleter:
-        deleter.delete(Settings.prefixes)
+    try:
+        with deleter:
+            deleter.delete(settings.prefixes)
+    except DeleteError as e:
+        print(str(e))
+        return 1
 
     return 0
 
-if __name__ == '__main__':
+
+def run():
+    """
+    Console script entry point
+    :return: None
+    """
     sys.exit(main(sys.argv[1:]))
+
+if __name__ == '__main__':
+    run()
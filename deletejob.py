@@ -0,0 +1,201 @@
+"""deletejob.py: A library API for running deletions inside other programs.
+
+A DeleteJob runs a single deletion on a thread of its own and reports back
+through callbacks and a future. Nothing is global: every job has its own
+settings, threads and queue, signal handlers are left alone and failures are
+raised rather than exiting the process. Several jobs can run at once and a
+long lived service can hand the same logged in store to job after job to
+reuse its connections:
+
+    store = stores.load_store('s3')(parser)
+    job = DeleteJob(store, prefixes=['tmp-'], max_threads=32,
+                    on_progress=lambda job, progress: log(progress))
+    future = job.start()
+    ...
+    job.cancel()
+    result = future.result()
+"""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+from concurrent.futures import Future
+import copy
+from settings import Settings
+import threading
+from threadeddeleter import DeleteError, ThreadedDeleter
+
+
+class CancelToken:
+    """Cancels every job it's handed to. Cancelling stops listing and lets
+    each job drain its queue for up to drain_timeout seconds."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cancelled = False
+        self.callbacks = list()
+
+    def cancel(self):
+        """
+        Cancels every job using this token
+        :return: None
+        """
+        with self.lock:
+            self.cancelled = True
+            callbacks = list(self.callbacks)
+        for callback in callbacks:
+            callback()
+
+    def register(self, callback):
+        """
+        Registers a function to call on cancellation. It's called straight
+        away if we're already cancelled.
+        :param callback: A function taking no arguments
+        :return: None
+        """
+        with self.lock:
+            self.callbacks.append(callback)
+            cancelled = self.cancelled
+        if cancelled:
+            callback()
+
+    def unregister(self, callback):
+        """
+        Unregisters a function
+        :param callback: The function that was registered
+        :return: None
+        """
+        with self.lock:
+            if callback in self.callbacks:
+                self.callbacks.remove(callback)
+
+
+class DeleteJob:
+    """A single deletion run that can be embedded in other programs"""
+
+    def __init__(self, store, settings=None, prefixes=None, on_progress=None,
+                 on_error=None, cancel_token=None, **kwargs):
+        """
+        Initializes a job
+        :param store: An ObjectStore instance. Stores that are already logged
+         in aren't logged in again.
+        :param settings: A Settings object. It's copied, so the caller's
+         object is left alone. Defaults to the default settings, quietly.
+        :param prefixes: The container prefixes to delete. Defaults to the
+         prefixes of the settings.
+        :param on_progress: A function called with the job and a progress dict
+         whenever a container is listed or deleted
+        :param on_error: A function called with the job and the exception if
+         the job fails
+        :param cancel_token: A CancelToken to cancel the job with. Defaults to
+         a token of its own.
+        :param kwargs: Settings to override
+        :return: None
+        :throws: TypeError for unknown settings, ValueError for invalid ones
+        """
+        if settings is None:
+            settings = Settings(verbose=False)
+        else:
+            settings = copy.copy(settings)
+            settings.prefixes = list(settings.prefixes)
+        for key, value in kwargs.items():
+            if not hasattr(Settings, key):
+                raise TypeError('Unknown setting: {}'.format(key))
+            setattr(settings, key, value)
+        # Jobs don't run on the main thread and mustn't take over the
+        # signal handlers of the program they're embedded in
+        settings.handle_signals = False
+        settings.validate()
+
+        self.store = store
+        self.settings = settings
+        self.prefixes = list(settings.prefixes if prefixes is None
+                             else prefixes)
+        self.on_progress = on_progress
+        self.on_error = on_error
+        self.cancel_token = cancel_token or CancelToken()
+        self.deleter = None
+        self.future = None
+        self.lock = threading.Lock()
+
+    def progress(self):
+        """
+        Returns the progress of the job
+        :return: A progress dict or None if the job hasn't started
+        """
+        if self.deleter is None:
+            return None
+        return self.deleter.progress()
+
+    def report(self):
+        """
+        Returns the audit report of the job, with the objects that couldn't
+        be deleted and the results of verification
+        :return: A dict or None if the job hasn't started
+        """
+        if self.deleter is None:
+            return None
+        return self.deleter.audit_report()
+
+    def cancel(self):
+        """
+        Cancels the job. Listing stops and the queue drains for up to
+        drain_timeout seconds. Anything left is checkpointed if a checkpoint
+        file is set.
+        :return: None
+        """
+        self.cancel_token.cancel()
+
+    def start(self):
+        """
+        Starts the job on a thread of its own
+        :return: A Future resolving to the final progress dict
+        :throws: DeleteError if the job was already started
+        """
+        with self.lock:
+            if self.future is not None:
+                raise DeleteError('Job already started')
+            self.future = Future()
+            self.future.set_running_or_notify_cancel()
+
+        thread = threading.Thread(target=self.execute, name='DeleteJob')
+        thread.daemon = True
+        thread.start()
+        return self.future
+
+    def run(self):
+        """
+        Starts the job and waits for it to finish
+        :return: The final progress dict
+        :throws: DeleteError if the job failed
+        """
+        return self.start().result()
+
+    def execute(self):
+        """
+        Runs the job and resolves its future
+        :return: None
+        """
+        on_progress = None
+        if self.on_progress is not None:
+            def on_progress(progress):
+                self.on_progress(self, progress)
+
+        self.deleter = ThreadedDeleter(self.store, self.settings, on_progress)
+        self.cancel_token.register(self.deleter.stop)
+        try:
+            with self.deleter:
+                result = self.deleter.delete(self.prefixes)
+        except Exception as e:
+            # Listing starts over on the next run using this store
+            self.deleter.reset_listing()
+            if self.on_error is not None:
+                self.on_error(self, e)
+            self.future.set_exception(e)
+            return
+        finally:
+            self.cancel_token.unregister(self.deleter.stop)
+
+        self.future.set_result(result)
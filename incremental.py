@@ -0,0 +1,94 @@
+"""incremental.py: Remembers what earlier runs deleted from each container.
+
+Nightly runs over the same prefixes mostly find containers that the last run
+emptied. The state file records, for every container, when the last complete
+run started and the highest key it listed. Later runs only delete objects
+modified since then, and can start listing after that key, which skips
+everything older when keys are written in ascending order (e.g. date prefixed
+logs).
+"""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+from atomicfile import atomic_write
+import calendar
+import datetime
+import json
+import os
+import time
+
+# Seconds to allow for the clocks of the store and this host disagreeing.
+# Objects modified this long before the last run are deleted again.
+CLOCK_SKEW = 300
+
+
+def timestamp(value):
+    """
+    Converts a modification time as returned by a store to seconds since the
+    epoch
+    :param value: A datetime, or an ISO 8601 string in UTC such as
+     2015-06-01T12:00:00.000000
+    :return: The number of seconds
+    """
+    if isinstance(value, datetime.datetime):
+        # Naive datetimes are UTC
+        return calendar.timegm(value.utctimetuple()) + \
+            value.microsecond / 1000000.0
+    return calendar.timegm(time.strptime(value[:19], '%Y-%m-%dT%H:%M:%S'))
+
+
+class IncrementalState:
+    """The per container state of incremental runs, kept in a JSON file"""
+
+    def __init__(self, path):
+        """
+        Loads the state file, if there is one
+        :param path: The path of the state file
+        :return: None
+        """
+        self.path = path
+        self.containers = dict()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.containers = json.load(f).get('containers', dict())
+
+    def marker(self, container):
+        """
+        Returns the highest key listed by the last complete run
+        :param container: The name of the container
+        :return: The key or None
+        """
+        return self.containers.get(container, dict()).get('marker')
+
+    def modified_since(self, container):
+        """
+        Returns the oldest modification time worth deleting
+        :param container: The name of the container
+        :return: Seconds since the epoch or None to delete everything
+        """
+        last_run = self.containers.get(container, dict()).get('last_run')
+        if last_run is None:
+            return None
+        return last_run - CLOCK_SKEW
+
+    def update(self, container, marker, last_run):
+        """
+        Records a complete run over a container
+        :param container: The name of the container
+        :param marker: The highest key listed or None
+        :param last_run: When the run started, in seconds since the epoch
+        :return: None
+        """
+        self.containers[container] = dict(marker=marker, last_run=last_run)
+
+    def save(self):
+        """
+        Writes the state file
+        :return: None
+        """
+        with atomic_write(self.path) as f:
+            json.dump(dict(containers=self.containers), f, indent=1,
+                      sort_keys=True)
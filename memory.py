@@ -0,0 +1,274 @@
+"""memory.py: Compact, memory-bounded storage of queued deletions."""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+from collections import deque
+import struct
+import sys
+import threading
+try:
+    import queue as Queue
+except ImportError:
+    import Queue
+import time
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Approximate bytes of bookkeeping per batch on top of its packed keys
+BATCH_OVERHEAD = 120
+
+# Keys are length prefixed with an unsigned short. No supported store allows
+# keys longer than 1024 bytes.
+LENGTH = struct.Struct('>H')
+
+
+class ContainerTable:
+    """Interns container names so queued batches only hold a small integer"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = dict()
+        self.names = list()
+
+    def id(self, name):
+        """
+        Returns the ID of a container, assigning one if needed
+        :param name: The name of the container
+        :return: The ID of the container
+        """
+        with self.lock:
+            if name not in self.ids:
+                self.ids[name] = len(self.names)
+                self.names.append(name)
+            return self.ids[name]
+
+    def name(self, id_):
+        """
+        Returns the name of a container
+        :param id_: The ID of the container
+        :return: The name of the container
+        """
+        return self.names[id_]
+
+
+class KeyBatch:
+    """A batch of object names of a single container packed into bytes"""
+
+    __slots__ = ('container', 'data', 'count')
+
+    def __init__(self, container, keys):
+        """
+        Packs a batch of keys
+        :param container: The ID of the container the keys belong to
+        :param keys: A list of object names
+        :return: None
+        """
+        parts = list()
+        for key in keys:
+            encoded = key.encode('utf-8')
+            parts.append(LENGTH.pack(len(encoded)))
+            parts.append(encoded)
+
+        self.container = container
+        self.data = b''.join(parts)
+        self.count = len(keys)
+
+    @property
+    def nbytes(self):
+        """
+        The approximate memory used by this batch
+        :return: The size in bytes
+        """
+        return len(self.data) + BATCH_OVERHEAD
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        """
+        Unpacks the keys of this batch
+        :return: A generator of object names
+        """
+        data = self.data
+        offset = 0
+        while offset < len(data):
+            length, = LENGTH.unpack_from(data, offset)
+            offset += LENGTH.size
+            yield data[offset:offset + length].decode('utf-8')
+            offset += length
+
+
+class BoundedQueue:
+    """A queue of KeyBatch objects bounded by the total number of queued keys
+    and/or the total bytes they use. A batch is always accepted into an empty
+    queue so an oversized batch can't block forever. Once closed, every
+    waiting and future call fails immediately."""
+
+    def __init__(self, max_keys=0, max_bytes=0):
+        """
+        Initializes a queue
+        :param max_keys: The most keys to hold. 0 for no limit.
+        :param max_bytes: The most bytes to hold. 0 for no limit.
+        :return: None
+        """
+        self.max_keys = max_keys
+        self.max_bytes = max_bytes
+        self.items = deque()
+        self.keys = 0
+        self.bytes = 0
+        self.closed = False
+        self.mutex = threading.Lock()
+        self.not_empty = threading.Condition(self.mutex)
+        self.not_full = threading.Condition(self.mutex)
+
+    def fits(self, item):
+        """
+        Checks whether an item may be added. Must be called with the mutex
+        held.
+        :param item: The KeyBatch to add
+        :return: True or False
+        """
+        if len(self.items) == 0:
+            return True
+        if self.max_keys > 0 and self.keys + item.count > self.max_keys:
+            return False
+        if self.max_bytes > 0 and self.bytes + item.nbytes > self.max_bytes:
+            return False
+        return True
+
+    def put(self, item, block=True, timeout=None):
+        """
+        Adds a batch to the queue
+        :param item: The KeyBatch to add
+        :param block: Whether to wait for room
+        :param timeout: The most seconds to wait or None to wait forever
+        :return: None
+        :throws: Queue.Full if there's no room or the queue is closed
+        """
+        with self.not_full:
+            if self.closed:
+                raise Queue.Full
+            if not self.fits(item):
+                if not block:
+                    raise Queue.Full
+                deadline = None if timeout is None else time.time() + timeout
+                while not self.fits(item):
+                    if self.closed:
+                        raise Queue.Full
+                    remaining = None if deadline is None else \
+                        deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        raise Queue.Full
+                    self.not_full.wait(remaining)
+
+            self.items.append(item)
+            self.keys += item.count
+            self.bytes += item.nbytes
+            self.not_empty.notify()
+
+    def get(self, block=True, timeout=None):
+        """
+        Removes and returns the oldest batch
+        :param block: Whether to wait for a batch
+        :param timeout: The most seconds to wait or None to wait forever
+        :return: A KeyBatch
+        :throws: Queue.Empty if there's nothing to return or the queue is
+         closed
+        """
+        with self.not_empty:
+            if self.closed:
+                raise Queue.Empty
+            if len(self.items) == 0:
+                if not block:
+                    raise Queue.Empty
+                deadline = None if timeout is None else time.time() + timeout
+                while len(self.items) == 0:
+                    if self.closed:
+                        raise Queue.Empty
+                    remaining = None if deadline is None else \
+                        deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        raise Queue.Empty
+                    self.not_empty.wait(remaining)
+
+            item = self.items.popleft()
+            self.keys -= item.count
+            self.bytes -= item.nbytes
+            self.not_full.notify_all()
+            return item
+
+    def join(self, max_keys=0, timeout=None):
+        """
+        Waits until at most max_keys keys are queued
+        :param max_keys: The most keys that may remain queued
+        :param timeout: The most seconds to wait or None to wait forever
+        :return: True if the queue drained far enough, otherwise False
+        """
+        with self.not_full:
+            deadline = None if timeout is None else time.time() + timeout
+            while self.keys > max_keys and not self.closed:
+                remaining = None if deadline is None else \
+                    deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.not_full.wait(remaining)
+            return self.keys <= max_keys
+
+    def drain(self):
+        """
+        Removes and returns every queued batch
+        :return: A list of KeyBatch objects
+        """
+        with self.mutex:
+            items = list(self.items)
+            self.items.clear()
+            self.keys = 0
+            self.bytes = 0
+            self.not_full.notify_all()
+            return items
+
+    def close(self):
+        """
+        Closes the queue and wakes up every waiting thread
+        :return: None
+        """
+        with self.mutex:
+            self.closed = True
+            self.not_empty.notify_all()
+            self.not_full.notify_all()
+
+    def qsize(self):
+        """
+        Returns the number of queued batches
+        :return: The number of batches
+        """
+        with self.mutex:
+            return len(self.items)
+
+    def full(self):
+        """
+        Checks whether the queue has reached one of its limits
+        :return: True or False
+        """
+        with self.mutex:
+            if self.max_keys > 0 and self.keys >= self.max_keys:
+                return True
+            return 0 < self.max_bytes <= self.bytes
+
+
+def peak_rss():
+    """
+    Returns the peak resident set size of this process
+    :return: The peak RSS in bytes or None if it can't be determined
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports kilobytes, macOS bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
@@ -6,12 +6,30 @@ __license__ = "GPL"
 __email__ = "me@chelseau.com"
 
 from abc import ABCMeta, abstractmethod
+from containercache import ContainerCache, ContainerInfo
+from profiler import NULL_PROFILER
 
 
 class ObjectStore:
     """An abstract ObjectStore class for accessing various object stores"""
     __metaclass__ = ABCMeta
 
+    # The profiler to record stages such as bulk_flush with outside of a run.
+    # Runs hand every thread its own profiler and audit in its Local object
+    # so several runs can share a store.
+    profiler = NULL_PROFILER
+
+    # Handles and metadata of containers. ThreadedDeleter replaces this with a
+    # cache of the configured size. It's created on first use otherwise.
+    cache = None
+
+    # Whether login succeeded. A store reused across runs only logs in once.
+    logged_in = False
+
+    # Whether object_exists can check single objects, so runs can be
+    # verified by sampling rather than listing every container again
+    can_check_objects = False
+
     @abstractmethod
     def login(self):
         """
@@ -70,3 +88,140 @@ class ObjectStore:
         :param container: The name of the container to get objects from
         :return: None
         """
+
+    def fetch_container_info(self, container):
+        """
+        Fetches the handle and metadata of a container. Stores that can tell
+        object counts, regions or reusable handles cheaply override this.
+        :param container: The name of the container
+        :return: A ContainerInfo
+        """
+        return ContainerInfo(container)
+
+    def container_info(self, container):
+        """
+        Returns the handle and metadata of a container, from the cache if
+        possible
+        :param container: The name of the container
+        :return: A ContainerInfo
+        """
+        if self.cache is None:
+            self.cache = ContainerCache()
+        return self.cache.load(container, self.fetch_container_info)
+
+    def prefetch_containers(self, containers, workers):
+        """
+        Fetches the handles and metadata of many containers in parallel
+        :param containers: A list of container names
+        :param workers: The most requests to make at once
+        :return: A list of error messages
+        """
+        if type(self).fetch_container_info == \
+                ObjectStore.fetch_container_info:
+            # There's nothing worth fetching
+            return list()
+
+        if self.cache is None:
+            self.cache = ContainerCache()
+        return self.cache.prefetch(containers, self.fetch_container_info,
+                                   workers)
+
+    def forget_container(self, container):
+        """
+        Drops a container from the cache, such as once it's deleted
+        :param container: The name of the container
+        :return: None
+        """
+        if self.cache is not None:
+            self.cache.pop(container)
+
+    def reserve_threads(self, threads):
+        """
+        Tells the store how many more threads will make requests at once so
+        it can size its connection and hedging pools
+        :param threads: The number of threads
+        :return: None
+        """
+        hedger = getattr(self, 'hedger', None)
+        if hedger is not None:
+            hedger.reserve(threads)
+
+    def release_threads(self, threads):
+        """
+        Releases threads reserved with reserve_threads
+        :param threads: The number of threads
+        :return: None
+        """
+        hedger = getattr(self, 'hedger', None)
+        if hedger is not None:
+            hedger.release(threads)
+
+    def stage(self, local, name):
+        """
+        Returns a stage of the profiler of the run a thread belongs to
+        :param local: The Local object of the thread
+        :param name: The name of the stage
+        :return: A context manager recording the stage
+        """
+        return getattr(local, 'profiler', self.profiler).stage(name)
+
+    def take_buffered(self, local):
+        """
+        Removes and returns the objects a thread buffered but hasn't deleted
+        yet. Runs out of time to drain checkpoint these rather than flushing
+        them in cleanup_thread.
+        :param local: The Local object of the thread
+        :return: A list of container, object tuples
+        """
+        return list()
+
+    def delete_failed(self, local, container, object_, error):
+        """
+        Records an object that couldn't be deleted in the audit of the run a
+        thread belongs to
+        :param local: The Local object of the thread
+        :param container: The name of the container
+        :param object_: The name of the object
+        :param error: What went wrong
+        :return: None
+        """
+        audit = getattr(local, 'audit', None)
+        if audit is not None:
+            audit.record_failure(container, object_, error)
+
+    def object_exists(self, container, object_):
+        """
+        Checks whether an object still exists. Stores that override this set
+        can_check_objects.
+        :param container: The name of the container
+        :param object_: The name of the object
+        :return: True if it exists
+        """
+        raise NotImplementedError()
+
+    def start_listing(self, container, start_after=None,
+                      modified_since=None):
+        """
+        Narrows the next listing of a container for incremental runs. Stores
+        that can't narrow listings ignore this and list everything, which
+        costs more requests but deletes nothing a full run wouldn't.
+        :param container: The name of the container
+        :param start_after: The key to start listing after or None
+        :param modified_since: Skip objects last modified before this many
+         seconds since the epoch. None lists objects of any age.
+        :return: None
+        """
+
+    def reset_listing(self, containers):
+        """
+        Forgets how far containers were listed so the next run lists them
+        from the start. The bundled stores keep their position in marker and
+        their incremental filters in start_after and modified_since.
+        :param containers: The names of the containers
+        :return: None
+        """
+        for attribute in ['marker', 'start_after', 'modified_since']:
+            state = getattr(self, attribute, None)
+            if state is not None:
+                for container in containers:
+                    state.pop(container, None)
@@ -0,0 +1,246 @@
+"""profiler.py: Opt-in per-stage profiling of deletion runs."""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+import threading
+import time
+
+# Wall clock with the best resolution available
+wall_clock = getattr(time, 'perf_counter', time.time)
+
+# CPU time of the calling thread, if the platform can tell us
+thread_clock = getattr(time, 'thread_time', lambda: 0.0)
+
+# Stages where a thread isn't doing any work
+IDLE_STAGES = ['dequeue_wait', 'enqueue_wait', 'list_wait']
+
+
+class NullStage:
+    """A stage that records nothing"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+class NullProfiler:
+    """A profiler that records nothing. This is used unless profiling is
+    enabled so instrumented code costs next to nothing."""
+
+    enabled = False
+    null_stage = NullStage()
+
+    def stage(self, name):
+        return self.null_stage
+
+    def start_thread(self):
+        pass
+
+    def stop_thread(self):
+        pass
+
+    def report(self):
+        return ''
+
+
+class Stage:
+    """Records the wall and CPU time of a stage on the current thread"""
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.wall = 0
+        self.cpu = 0
+
+    def __enter__(self):
+        self.profiler.local_stack().append(self)
+        self.children = 0
+        self.wall = wall_clock()
+        self.cpu = thread_clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall = wall_clock() - self.wall
+        cpu = thread_clock() - self.cpu
+
+        stack = self.profiler.local_stack()
+        stack.pop()
+        if len(stack) > 0:
+            # Our parent shouldn't count our time as its own
+            stack[-1].children += wall
+
+        stats = self.profiler.local_stats()
+        if self.name not in stats:
+            stats[self.name] = [0, 0.0, 0.0, 0.0]
+        record = stats[self.name]
+        record[0] += 1
+        record[1] += wall
+        record[2] += wall - self.children
+        record[3] += cpu
+
+
+class StageProfiler:
+    """Records per-stage wall and CPU time for every thread and optionally
+    captures cProfile or yappi output across all threads."""
+
+    enabled = True
+
+    def __init__(self, sampler=''):
+        """
+        Initializes a profiler
+        :param sampler: cprofile, yappi or an empty string for none
+        :return: None
+        """
+        if sampler not in ['', 'cprofile', 'yappi']:
+            raise Exception('Unknown profile sampler: {}'.format(sampler))
+
+        self.sampler = sampler
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.threads = dict()
+        self.profiles = list()
+        self.start = wall_clock()
+
+        if sampler == 'yappi':
+            import yappi
+            yappi.set_clock_type('wall')
+            yappi.start()
+
+    def local_stats(self):
+        """
+        Returns the stage stats of the current thread
+        :return: A dict of stage name to count, wall, self wall, CPU
+        """
+        if not hasattr(self.local, 'stats'):
+            self.local.stats = dict()
+            with self.lock:
+                self.threads[threading.current_thread().name] = \
+                    self.local.stats
+        return self.local.stats
+
+    def local_stack(self):
+        """
+        Returns the stages currently open on this thread
+        :return: A list of Stage objects
+        """
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = list()
+        return self.local.stack
+
+    def stage(self, name):
+        """
+        Returns a context manager recording a stage
+        :param name: The name of the stage
+        :return: A Stage
+        """
+        return Stage(self, name)
+
+    def start_thread(self):
+        """
+        Starts profiling the current thread with cProfile if enabled
+        :return: None
+        """
+        self.local_stats()
+        if self.sampler == 'cprofile':
+            import cProfile
+            self.local.profile = cProfile.Profile()
+            self.local.profile.enable()
+
+    def stop_thread(self):
+        """
+        Stops profiling the current thread
+        :return: None
+        """
+        profile = getattr(self.local, 'profile', None)
+        if profile is not None:
+            profile.disable()
+            self.local.profile = None
+            with self.lock:
+                self.profiles.append(profile)
+
+    def dump(self, path):
+        """
+        Writes the captured cProfile or yappi output in pstats format
+        :param path: The file to write to
+        :return: True if anything was written
+        """
+        if self.sampler == 'yappi':
+            import yappi
+            yappi.stop()
+            yappi.get_func_stats().save(path, type='pstat')
+            return True
+
+        if len(self.profiles) == 0:
+            return False
+
+        import pstats
+        stats = pstats.Stats(self.profiles[0])
+        for profile in self.profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(path)
+        return True
+
+    def report(self):
+        """
+        Builds the summary report
+        :return: The report as a string
+        """
+        elapsed = wall_clock() - self.start
+        with self.lock:
+            threads = dict((name, dict((stage, list(record))
+                                       for stage, record in stats.items()))
+                           for name, stats in self.threads.items())
+
+        totals = dict()
+        for stats in threads.values():
+            for stage, record in stats.items():
+                if stage not in totals:
+                    totals[stage] = [0, 0.0, 0.0, 0.0]
+                for index in range(4):
+                    totals[stage][index] += record[index]
+
+        lines = ['Profile of {:.2f} seconds across {} threads'.format(
+            elapsed, len(threads)),
+            '{:<18} {:>10} {:>10} {:>10} {:>10} {:>9}'.format(
+                'stage', 'calls', 'wall s', 'self s', 'cpu s', 'mean ms')]
+        for stage, record in sorted(totals.items(),
+                                    key=lambda item: -item[1][2]):
+            lines.append('{:<18} {:>10} {:>10.2f} {:>10.2f} {:>10.2f}'
+                         ' {:>9.2f}'.format(stage, record[0], record[1],
+                                            record[2], record[3],
+                                            record[1] / record[0] * 1000))
+
+        lines.append('{:<18} {:>10} {:>10} {:>10}'.format(
+            'thread', 'busy s', 'idle s', 'cpu s'))
+        for name in sorted(threads, key=lambda name: (len(name), name)):
+            busy = sum(record[2] for stage, record in threads[name].items()
+                       if stage not in IDLE_STAGES)
+            idle = sum(record[2] for stage, record in threads[name].items()
+                       if stage in IDLE_STAGES)
+            cpu = sum(record[3] for record in threads[name].values())
+            lines.append('{:<18} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+                name, busy, idle, cpu))
+
+        work = dict((stage, record) for stage, record in totals.items()
+                    if stage not in IDLE_STAGES)
+        if len(work) > 0:
+            busy = sum(record[2] for record in work.values())
+            stage = max(work, key=lambda name: work[name][2])
+            lines.append('Bottleneck: {stage} ({share:.0%} of busy time)'
+                         .format(stage=stage,
+                                 share=work[stage][2] / busy if busy else 0))
+
+            starved = totals.get('dequeue_wait', [0, 0.0, 0.0, 0.0])[2]
+            if starved > busy:
+                lines.append('Workers spent most of their time waiting for'
+                             ' work. Listing is not keeping up.')
+
+        return '\n'.join(lines)
+
+
+NULL_PROFILER = NullProfiler()
@@ -0,0 +1,82 @@
+"""scheduler.py: Orders containers so the largest are processed first.
+
+A run takes at least as long as its largest container. Handing containers to
+the listing threads longest processing time first starts the largest
+containers straight away and leaves the small ones to fill the gaps, so the
+total wall time approaches the time of the largest container.
+"""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+import threading
+
+
+class Schedule:
+    """Hands out containers largest first to any number of threads"""
+
+    def __init__(self, containers, object_store):
+        """
+        Initializes a schedule from the size estimates the object store
+        cached for every container. Containers of unknown size may be the
+        largest of all, so they go first.
+        :param containers: A list of container names
+        :param object_store: The object store we're working with
+        :return: None
+        """
+        self.lock = threading.Lock()
+        self.sizes = dict()
+        for container in containers:
+            info = None
+            if object_store.cache is not None:
+                info = object_store.cache.get(container)
+            self.sizes[container] = None if info is None else \
+                info.object_count
+
+        # Sorting is stable so containers of equal size keep their order
+        self.pending = sorted(containers, key=self.weight)
+        self.pending.reverse()
+
+    def weight(self, container):
+        """
+        Returns the sort key of a container. Smaller keys go first.
+        :param container: The name of the container
+        :return: A tuple
+        """
+        size = self.sizes[container]
+        if size is None:
+            return 0, 0
+        return 1, -size
+
+    def size(self, container):
+        """
+        Returns the estimated number of objects in a container
+        :param container: The name of the container
+        :return: The number of objects or None if unknown
+        """
+        return self.sizes.get(container)
+
+    def total(self):
+        """
+        Returns the estimated number of objects in all containers
+        :return: The number of objects or None if any size is unknown
+        """
+        if None in self.sizes.values():
+            return None
+        return sum(self.sizes.values())
+
+    def next(self):
+        """
+        Returns the next container to process
+        :return: The name of the container or None if there are none left
+        """
+        with self.lock:
+            if len(self.pending) == 0:
+                return None
+            return self.pending.pop()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.pending)
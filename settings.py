@@ -0,0 +1,95 @@
+"""settings.py: The settings of a deletion run."""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+
+class Settings:
+    """The settings of a single run. The class attributes are the defaults.
+    Every instance holds its own values, so several runs can be configured
+    in one process."""
+
+    store = ''
+    prefixes = list()
+    verbose = True
+    max_threads = 64
+    list_threads = 4
+    list_prefetch = 1
+    queue_size = 25000
+    memory_budget = 0
+    drain_timeout = 25
+    checkpoint_file = ''
+    state_file = ''
+    incremental_marker = False
+    verify = ''
+    verify_samples = 1000
+    audit_file = ''
+    container_cache_size = 10000
+    handle_signals = True
+    profile = False
+    profile_output = ''
+    profile_sampler = ''
+
+    def __init__(self, **kwargs):
+        """
+        Initializes settings
+        :param kwargs: Settings to override the defaults with
+        :return: None
+        :throws: TypeError for unknown settings
+        """
+        self.prefixes = list(self.prefixes)
+        for key, value in kwargs.items():
+            if not hasattr(Settings, key):
+                raise TypeError('Unknown setting: {}'.format(key))
+            setattr(self, key, value)
+
+    def validate(self):
+        """
+        Validates the settings
+        :return: None
+        :throws: ValueError on validation error
+        """
+        if self.max_threads <= 0:
+            raise ValueError("Maximum threads is too low. It must be at"
+                             " least 1.")
+
+        if self.list_threads <= 0:
+            raise ValueError("Listing threads is too low. It must be at"
+                             " least 1.")
+
+        if self.list_prefetch < 0:
+            raise ValueError("Listing prefetch is too low. It must be at"
+                             " least 0.")
+
+        if self.queue_size < 1:
+            raise ValueError("Maximum queue size is too low. It must be at"
+                             " least 1.")
+
+        if self.memory_budget < 0:
+            raise ValueError("Memory budget is too low. It must be at least"
+                             " 0.")
+
+        if self.container_cache_size < 1:
+            raise ValueError("Container cache size is too low. It must be at"
+                             " least 1.")
+
+        if self.drain_timeout < 0:
+            raise ValueError("Drain timeout is too low. It must be at least"
+                             " 0.")
+
+        if self.incremental_marker and len(self.state_file) == 0:
+            raise ValueError("Incremental markers need a state file.")
+
+        if self.verify not in ['', 'full', 'sample']:
+            raise ValueError("Invalid verification mode. It must be full or"
+                             " sample.")
+
+        if self.verify_samples < 1:
+            raise ValueError("Verification samples is too low. It must be at"
+                             " least 1.")
+
+        if self.profile_sampler not in ['', 'cprofile', 'yappi']:
+            raise ValueError("Invalid profile sampler. It must be cprofile or"
+                             " yappi.")
@@ -15,7 +15,10 @@ with open(os.path.join(here, 'README.md')) as f:
 
 requires = [
     'pyrax==1.9.5',
-    'boto3==1.1.4',
+    'boto3>=1.4.0',
+    'futures; python_version < "3"',
+    'python-swiftclient>=3.0.0',
+    'requests',
 ]
 
 setup(
@@ -25,13 +28,28 @@ setup(
     author_email=__email__,
     description='A lightweight, extremely fast deleter for various objects.',
     license=__license__,
-    keywords='cloudfiles threading',
+    keywords='cloudfiles s3 swift threading',
     url='https://github.com/chelseau/threadedobjectdeleter',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'tests']),
+    py_modules=['atomicfile', 'audit', 'containercache', 'delete', 'deletejob',
+                'incremental', 'memory', 'objectstore', 'profiler',
+                'scheduler', 'settings', 'threadeddeleter'],
     long_description=README,
     classifiers=[
         "Development Status :: 4 - Beta",
         "Topic :: Utilities",
     ],
     install_requires=requires,
+    entry_points={
+        'console_scripts': [
+            'threaded-object-deleter = delete:run',
+        ],
+        'threadedobjectdeleter.stores': [
+            'cloudfiles = stores.cloudfiles:Store',
+            'fanout = stores.fanout:Store',
+            's3 = stores.s3:Store',
+            's3compat = stores.s3compat:Store',
+            'swift = stores.swift:Store',
+        ],
+    },
 )
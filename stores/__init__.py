@@ -0,0 +1,94 @@
+"""stores: A registry of the available ObjectStore implementations.
+
+Stores are discovered through the threadedobjectdeleter.stores setuptools
+entry point group, so third party packages can provide their own stores
+without touching this tree. The stores that ship with the deleter are also
+registered here so running from a checkout works without installing.
+
+Nothing is imported until a store is actually requested. This keeps the SDKs
+of every other store out of the process. Bundled stores are resolved without
+scanning the installed distributions at all, as importing the entry point
+machinery alone costs more than the rest of the deleter's start up.
+"""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+import importlib
+from objectstore import ObjectStore
+
+ENTRY_POINT_GROUP = 'threadedobjectdeleter.stores'
+
+# Stores bundled with the deleter as module:attribute strings
+BUILTIN_STORES = {
+    'cloudfiles': 'stores.cloudfiles:Store',
+    'fanout': 'stores.fanout:Store',
+    's3': 'stores.s3:Store',
+    's3compat': 'stores.s3compat:Store',
+    'swift': 'stores.swift:Store',
+}
+
+
+def iter_entry_points():
+    """
+    Iterates the store entry points of all installed distributions
+    :return: An iterable of entry points
+    """
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        entry_points = None
+
+    if entry_points is not None:
+        points = entry_points()
+        if hasattr(points, 'select'):
+            return points.select(group=ENTRY_POINT_GROUP)
+        return points.get(ENTRY_POINT_GROUP, [])
+
+    try:
+        import pkg_resources
+    except ImportError:
+        return []
+    return pkg_resources.iter_entry_points(ENTRY_POINT_GROUP)
+
+
+def available_stores():
+    """
+    Lists the names of all stores that can be loaded
+    :return: A sorted list of store names
+    """
+    names = set(BUILTIN_STORES)
+    for entry_point in iter_entry_points():
+        names.add(entry_point.name.lower())
+    return sorted(names)
+
+
+def load_store(name):
+    """
+    Imports and returns the Store class registered under the given name. Only
+    the requested store module (and its SDK) is imported.
+    :param name: The name of the store, e.g. s3
+    :return: An ObjectStore subclass
+    :throws: ImportError if the store is unknown or malformed
+    """
+    name = name.lower()
+    store = None
+
+    if name in BUILTIN_STORES:
+        module, attribute = BUILTIN_STORES[name].split(':')
+        store = getattr(importlib.import_module(module), attribute, None)
+    else:
+        for entry_point in iter_entry_points():
+            if entry_point.name.lower() == name:
+                store = entry_point.load()
+                break
+        else:
+            raise ImportError('Unknown object store. Available stores: '
+                              '{}'.format(', '.join(available_stores())))
+
+    if not isinstance(store, type) or not issubclass(store, ObjectStore):
+        raise ImportError('Malformed object store module')
+
+    return store
@@ -7,15 +7,25 @@ __license__ = "GPL"
 __email__ = "me@chelseau.com"
 
 import os
-import pyrax
 import sys
+import threading
+from containercache import ContainerInfo
+from incremental import timestamp
 from objectstore import ObjectStore
+from stores.hedging import Hedger
+from stores.swiftbulk import BulkDeleter, MAX_BULK_DELETE
 from threadeddeleter import ThreadedDeleter
 
 
 class Store(ObjectStore):
     """A ObjectStore class for Rackspace Cloud Files"""
 
+    # The config section to read options from
+    section = 'cloudfiles'
+
+    # Whether object_exists can check single objects
+    can_check_objects = True
+
     @classmethod
     def get_retry_text(cls, retries):
         """
@@ -28,43 +38,67 @@ class Store(ObjectStore):
         else:
             return ' Retrying {} more times.'.format(retries)
 
-    def __init__(self, parser):
+    def __init__(self, parser, section=None):
         """
         Initialize all our variables
         :param parser: Our config parser object
+        :param section: The config section to read instead of the default
         :return: None
         :throws: Exception on validation error
         """
+        if section is not None:
+            self.section = section
 
         # Store arguments
         self.marker = dict()
+        self.modified_since = dict()
+        self.identity = None
         self.rax = None
+        self.storage_url = None
+        self.token = None
+        self.auth_lock = threading.Lock()
         self.region = ''
         self.bulk_size = 0
         self.username = ''
         self.api_key = ''
         self.page_size = 10000
-
-        options = ['region', 'bulk_size', 'username', 'api_key', 'page_size']
-        optional = ['bulk_size', 'page_size']
-
-        if not parser.has_section('cloudfiles'):
-            raise Exception('CloudFiles configuration is missing')
+        self.connect_timeout = 10
+        self.read_timeout = 60
+        self.hedge = 'False'
+        self.hedge_quantile = 0.99
+        self.hedger = None
+
+        options = ['region', 'bulk_size', 'username', 'api_key', 'page_size',
+                   'connect_timeout', 'read_timeout', 'hedge',
+                   'hedge_quantile']
+        optional = ['bulk_size', 'page_size', 'connect_timeout',
+                    'read_timeout', 'hedge', 'hedge_quantile']
+
+        if not parser.has_section(self.section):
+            raise Exception('{} configuration is missing'.format(
+                self.section))
 
         for option in options:
-            if not parser.has_option('cloudfiles', option):
+            if not parser.has_option(self.section, option):
                 if option not in optional:
-                    raise Exception('Missing cloudfiles option: {}'.format(
-                        option))
+                    raise Exception('Missing {section} option: {option}'
+                                    .format(section=self.section,
+                                            option=option))
             else:
-                setattr(self, option, parser.get('cloudfiles', option))
+                setattr(self, option, parser.get(self.section, option))
 
-        # Ensure data type
-        self.bulk_size = int(self.bulk_size)
+        # Ensure data type. A bulk delete request can't exceed the middleware's
+        # limit.
+        self.bulk_size = min(int(self.bulk_size), MAX_BULK_DELETE)
 
         # Ensure data type
         self.page_size = int(self.page_size)
 
+        # Ensure data type
+        self.connect_timeout = float(self.connect_timeout)
+        self.read_timeout = float(self.read_timeout)
+        self.hedge_quantile = float(self.hedge_quantile)
+
         # Validate options
         if len(self.region) == 0:
             raise Exception('No region specified')
@@ -74,9 +108,14 @@ class Store(ObjectStore):
             raise Exception('No API key specified')
         if self.page_size <= 0:
             raise Exception('Invalid page size specified')
+        if self.connect_timeout <= 0 or self.read_timeout <= 0:
+            raise Exception('Invalid timeout specified')
+        if self.hedge.lower() not in ['true', 'false']:
+            raise Exception('Invalid hedge value specified')
+        if not 0 < self.hedge_quantile < 1:
+            raise Exception('Invalid hedge quantile specified')
 
-        # Set identity type
-        pyrax.settings.set('identity_type', 'rackspace')
+        self.hedger = Hedger(self.hedge.lower() == 'true', self.hedge_quantile)
 
     def login(self):
         """
@@ -84,15 +123,29 @@ class Store(ObjectStore):
         init_thread is responsible for initializing individual threads.
         :return: True on success, false on failure
         """
+        try:
+            import pyrax
+        except ImportError as e:
+            ThreadedDeleter.output('Failed to load pyrax: {msg}'.format(
+                msg=str(e)))
+            return False
 
         try:
-            pyrax.set_credentials(username=self.username,
-                                  api_key=self.api_key)
-            self.rax = pyrax.connect_to_cloudfiles(self.region, True)
+            # Use an identity of our own rather than pyrax's global one so
+            # several accounts can be used in a single run
+            self.identity = pyrax.create_context('rackspace',
+                                                 username=self.username,
+                                                 api_key=self.api_key)
+            self.identity.authenticate()
+            self.rax = self.identity.get_client('object_store', self.region,
+                                                public=True)
             if self.rax is None:
                 ThreadedDeleter.output('Unknown error occured while connecting'
                                        ' to CloudFiles.')
                 return False
+            self.rax.timeout = (self.connect_timeout, self.read_timeout)
+            self.storage_url = self.rax.management_url
+            self.token = self.identity.get_token()
         except pyrax.exceptions.AuthenticationFailed as e:
             ThreadedDeleter.output('Authentication failed: {msg}'.format(
                 msg=str(e)))
@@ -104,6 +157,18 @@ class Store(ObjectStore):
 
         return True
 
+    def refresh_auth(self, token):
+        """
+        Re-authenticates after a token expired. Threads noticing the same
+        expired token only cause a single re-authentication.
+        :param token: The token that expired
+        :return: A tuple containing the storage URL and a valid token
+        """
+        with self.auth_lock:
+            if self.token == token:
+                self.token = self.identity.get_token(force=True)
+            return self.storage_url, self.token
+
     def list_containers(self, prefixes, retry=2):
         """
         Lists containers beginning with any of the provided prefixes
@@ -135,6 +200,47 @@ class Store(ObjectStore):
 
         return containers
 
+    def fetch_container_info(self, container):
+        """
+        Fetches a container handle along with its object count and size
+        :param container: The name of the container
+        :return: A ContainerInfo
+        """
+        handle = self.rax.get_container(container)
+        return ContainerInfo(container, handle=handle,
+                             object_count=handle.object_count,
+                             bytes=handle.total_bytes, region=self.region,
+                             endpoint=self.storage_url)
+
+    def list_page(self, attempt, container_name, marker):
+        """
+        Lists a single page of objects. This is idempotent so it can be hedged.
+        :param attempt: The attempt number. Every request of pyrax uses a new
+         connection so this isn't needed.
+        :param container_name: The name of the container to get objects from
+        :param marker: The name of the last object listed or None
+        :return: A list of StorageObjects
+        """
+        # Containers whose metadata failed to prefetch have no handle
+        container = self.container_info(container_name).handle or \
+            self.rax.get_container(container_name)
+        return container.list(marker=marker, limit=self.page_size)
+
+    def start_listing(self, container, start_after=None,
+                      modified_since=None):
+        """
+        Narrows the next listing of a container for incremental runs
+        :param container: The name of the container
+        :param start_after: The key to start listing after or None
+        :param modified_since: Skip objects last modified before this many
+         seconds since the epoch. None lists objects of any age.
+        :return: None
+        """
+        if start_after is not None:
+            self.marker[container] = start_after
+        if modified_since is not None:
+            self.modified_since[container] = modified_since
+
     def list_objects(self, container_name, retry=2):
         """
         Lists objects in a given container
@@ -142,13 +248,21 @@ class Store(ObjectStore):
         :param retry: The number of retries to use
         :return: A list of objects or False on error
         """
-        marker = None
-        if container_name in self.marker:
-            marker = self.marker.get(container_name)
+        since = self.modified_since.get(container_name)
+        objects = list()
 
         try:
-            container = self.rax.get_container(container_name)
-            objects_ = container.list(marker=marker, limit=self.page_size)
+            # Skip over pages holding nothing but older objects
+            while len(objects) == 0:
+                page = self.hedger.call('list', self.list_page,
+                                        container_name,
+                                        self.marker.get(container_name))
+                if len(page) == 0:
+                    break
+                self.marker[container_name] = page[-1].name
+                objects = [object_.name for object_ in page
+                           if since is None or
+                           timestamp(object_.last_modified) >= since]
         except Exception as e:
             ThreadedDeleter.output('List objects failed: {msg}.{retry}'
                                    .format(msg=str(e),
@@ -159,28 +273,45 @@ class Store(ObjectStore):
             # Retry
             return self.list_objects(container_name, retry - 1)
 
-        if len(objects_) == 0:
-            return objects_
-
-        objects = list()
-        for object in objects_:
-            objects.append(object.name)
-        self.marker[container_name] = objects[-1]
+        if len(objects) == 0:
+            # We're out of files. Release the listing state.
+            self.marker.pop(container_name, None)
+            self.modified_since.pop(container_name, None)
 
         return objects
 
+    def object_exists(self, container, object_):
+        """
+        Checks whether an object still exists. This lists the object rather
+        than reading it so it only needs the permissions deleting does.
+        :param container: The name of the container
+        :param object_: The name of the object
+        :return: True if it exists
+        """
+        handle = self.container_info(container).handle or \
+            self.rax.get_container(container)
+        return any(entry.name == object_
+                   for entry in handle.list(prefix=object_, limit=1))
+
     def delete_objects_bulk(self, local):
+        """
+        Deletes all buffered objects of a thread with the bulk delete
+        middleware. A single request may span several containers.
+        :param local: The Local object
+        :return: None
+        """
         if local.size > 0:
-            for container, objects in local.data.iteritems()\
-                    if hasattr(local.data, 'iteritems')\
-                    else local.data.items():
-                try:
-                    self.rax.bulk_delete(container, objects)
-                except Exception as e:
-                    ThreadedDeleter.output('Bulk delete objects failed: {msg}.'
-                                           .format(msg=str(e)))
+            with self.stage(local, 'bulk_flush'):
+                deleted, failed = local.bulk.delete(local.data)
+                if len(failed) > 0:
+                    ThreadedDeleter.output('Bulk delete failed for {count}'
+                                           ' objects: {msg}.'.format(
+                                               count=len(failed),
+                                               msg=failed[0][2]))
+                for container, object_, status in failed:
+                    self.delete_failed(local, container, object_, status)
         local.size = 0
-        local.data = dict()
+        local.data = list()
 
     def delete_object(self, container, object_, local):
         """
@@ -197,33 +328,48 @@ class Store(ObjectStore):
             except Exception as e:
                 ThreadedDeleter.output('Delete object failed: {msg}.'
                                        .format(msg=str(e)))
+                self.delete_failed(local, container, object_, e)
         else:
-            if container not in local.data:
-                local.data[container] = list()
-            local.data[container].append(object_)
+            local.data.append((container, object_))
             local.size += 1
             if local.size >= self.bulk_size:
                 self.delete_objects_bulk(local)
 
     def init_thread(self, local):
         """
-        Initialize thread-specific RAX connection & data list
+        Initialize thread-specific bulk delete connection & data list
         :param local: The Local object
         :return: None
         """
-        local.rax = pyrax.connect_to_cloudfiles(self.region, True)
-        local.data = dict()
+        local.bulk = BulkDeleter(self.storage_url, self.token,
+                                 reauth=self.refresh_auth,
+                                 timeout=(self.connect_timeout,
+                                          self.read_timeout),
+                                 hedger=self.hedger)
+        local.data = list()
+        local.size = 0
+
+    def take_buffered(self, local):
+        """
+        Removes and returns the objects a thread buffered but hasn't deleted
+        :param local: The Local object
+        :return: A list of container, object tuples
+        """
+        buffered = local.data
+        local.data = list()
         local.size = 0
+        return buffered
 
     def cleanup_thread(self, local):
         """
-        Cleanup thread-specific RAX connection
+        Cleanup thread-specific bulk delete connection
         :param local: The Local object
         :return: None
         """
 
         # Delete any remaining objects first if using bulk deletions
         self.delete_objects_bulk(local)
+        local.bulk.close()
 
     def delete_container(self, container, retry=2):
         """
@@ -234,6 +380,7 @@ class Store(ObjectStore):
         """
         try:
             self.rax.delete_container(container, del_objects=True)
+            self.forget_container(container)
             return True
         except Exception as e:
             ThreadedDeleter.output('Delete container failed: {msg}.{retry}'
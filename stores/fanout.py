@@ -0,0 +1,301 @@
+"""fanout.py: Contains an ObjectStore that spreads a run over other stores.
+
+A single run can delete from several regions and accounts at once. Every
+target is another store reading its own config section, e.g. two S3 accounts
+in [s3-prod] and [s3-staging] and a Cloud Files region in [cloudfiles-ord].
+Containers are named target/container so they stay unique across targets and
+all of them share the deleter's threads, queue and schedule.
+"""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+from containercache import ContainerCache, ContainerInfo
+from objectstore import ObjectStore
+import stores
+from threadeddeleter import ThreadedDeleter
+
+# Separates the target from the container name. No supported store allows it
+# in container names.
+SEPARATOR = '/'
+
+
+class Local:
+    """Thread-specific variables of a single target"""
+
+
+class TargetAudit:
+    """Records the failures of a target in the audit of the run under
+    qualified container names"""
+
+    def __init__(self, audit, target):
+        """
+        Initializes a target audit
+        :param audit: The Audit of the run
+        :param target: The name of the target
+        :return: None
+        """
+        self.audit = audit
+        self.target = target
+
+    def record_failure(self, container, object_, error):
+        """
+        Records an object that couldn't be deleted
+        :param container: The name of the container within the target
+        :param object_: The name of the object
+        :param error: What went wrong
+        :return: None
+        """
+        self.audit.record_failure(self.target + SEPARATOR + container,
+                                  object_, error)
+
+
+class Store(ObjectStore):
+    """A ObjectStore class spreading a run over several other stores"""
+
+    # The config section to read options from
+    section = 'fanout'
+
+    def __init__(self, parser, section=None):
+        """
+        Initialize all our variables and the stores of every target
+        :param parser: Our config parser object
+        :param section: The config section to read instead of the default
+        :return: None
+        :throws: Exception on validation error
+        """
+        if section is not None:
+            self.section = section
+
+        if not parser.has_section(self.section):
+            raise Exception('{} configuration is missing'.format(
+                self.section))
+        if not parser.has_option(self.section, 'targets'):
+            raise Exception('Missing {} option: targets'.format(
+                self.section))
+
+        # Targets are store:section pairs. The section defaults to the name
+        # of the store.
+        self.targets = dict()
+        self.order = list()
+        for target in parser.get(self.section, 'targets').split(','):
+            target = target.strip()
+            if len(target) == 0:
+                continue
+            name, _, section_ = target.partition(':')
+            section_ = section_ or name
+            if name.lower() == 'fanout':
+                raise Exception('Fan-out targets can\'t fan out')
+            if section_ in self.targets:
+                raise Exception('Duplicate target: {}'.format(section_))
+
+            try:
+                store_class = stores.load_store(name)
+            except ImportError as e:
+                raise Exception('Failed to load {store} store: {err}'.format(
+                    store=name, err=str(e)))
+            self.targets[section_] = store_class(parser, section_)
+            self.order.append(section_)
+
+        if len(self.targets) == 0:
+            raise Exception('No targets specified')
+
+    @property
+    def can_check_objects(self):
+        """
+        Whether every target can check single objects
+        :return: A bool
+        """
+        return all(store.can_check_objects for store in self.targets.values())
+
+    def split(self, container):
+        """
+        Splits a qualified container name
+        :param container: The name of the container, e.g. s3-prod/logs
+        :return: A tuple containing the target store and container name
+        """
+        target, _, name = container.partition(SEPARATOR)
+        return self.targets[target], name
+
+    def login(self):
+        """
+        Logs into every target. Targets get a container cache of our size.
+        :return: True on success, false on failure
+        """
+        for target in self.order:
+            store = self.targets[target]
+            if self.cache is not None:
+                store.cache = ContainerCache(self.cache.max_size)
+
+            if not store.login():
+                ThreadedDeleter.output('Failed to log into {}'.format(target))
+                return False
+        return True
+
+    def list_containers(self, prefixes, retry=2):
+        """
+        Lists containers beginning with any of the provided prefixes across
+        all targets
+        :param prefixes: The (list of) prefixes to get containers for
+        :param retry: The number of retries to use
+        :return: A list of qualified containers or False on error
+        """
+        containers = list()
+        for target in self.order:
+            containers_ = self.targets[target].list_containers(prefixes,
+                                                               retry)
+            if containers_ is False:
+                return False
+            for container in containers_:
+                containers.append(target + SEPARATOR + container)
+        return containers
+
+    def fetch_container_info(self, container):
+        """
+        Fetches the handle and metadata of a container from its target
+        :param container: The qualified name of the container
+        :return: A ContainerInfo
+        """
+        store, name = self.split(container)
+        info = store.container_info(name)
+
+        # Handles stay with the target's own cache
+        return ContainerInfo(container, object_count=info.object_count,
+                             bytes=info.bytes, region=info.region,
+                             endpoint=info.endpoint)
+
+    def list_objects(self, container, retry=2):
+        """
+        Lists objects in a given container
+        :param container: The qualified name of the container
+        :param retry: The number of retries to use
+        :return: A list of objects or False on error
+        """
+        store, name = self.split(container)
+        return store.list_objects(name, retry)
+
+    def delete_object(self, container, object_, local):
+        """
+        Deletes an object from a given container. Targets set up their
+        thread-specific variables on first use.
+        :param container: The qualified name of the container
+        :param object_: The name of the object to delete
+        :param local: A Local class object for storing thread-specific
+         variables in.
+        :return: None
+        """
+        target, _, name = container.partition(SEPARATOR)
+        if target not in local.targets:
+            # Targets record into the profiler and audit of our run
+            local_ = Local()
+            local_.profiler = getattr(local, 'profiler', self.profiler)
+            audit = getattr(local, 'audit', None)
+            if audit is not None:
+                local_.audit = TargetAudit(audit, target)
+            local.targets[target] = local_
+            self.targets[target].init_thread(local_)
+        self.targets[target].delete_object(name, object_,
+                                           local.targets[target])
+
+    def init_thread(self, local):
+        """
+        Initialize the thread-specific variables of every target
+        :param local: The Local object
+        :return: None
+        """
+        local.targets = dict()
+
+    def take_buffered(self, local):
+        """
+        Removes and returns the objects every target buffered but hasn't
+        deleted
+        :param local: The Local object
+        :return: A list of container, object tuples with qualified
+         container names
+        """
+        buffered = list()
+        for target, local_ in local.targets.items():
+            buffered.extend((target + SEPARATOR + container, object_)
+                            for container, object_ in
+                            self.targets[target].take_buffered(local_))
+        return buffered
+
+    def cleanup_thread(self, local):
+        """
+        Cleanup the thread-specific variables of every target used
+        :param local: The Local object
+        :return: None
+        """
+        for target, local_ in local.targets.items():
+            self.targets[target].cleanup_thread(local_)
+        local.targets = dict()
+
+    def object_exists(self, container, object_):
+        """
+        Checks whether an object still exists
+        :param container: The qualified name of the container
+        :param object_: The name of the object
+        :return: True if it exists
+        """
+        store, name = self.split(container)
+        return store.object_exists(name, object_)
+
+    def start_listing(self, container, start_after=None,
+                      modified_since=None):
+        """
+        Narrows the next listing of a container for incremental runs
+        :param container: The qualified name of the container
+        :param start_after: The key to start listing after or None
+        :param modified_since: Skip objects last modified before this many
+         seconds since the epoch. None lists objects of any age.
+        :return: None
+        """
+        store, name = self.split(container)
+        store.start_listing(name, start_after, modified_since)
+
+    def reserve_threads(self, threads):
+        """
+        Reserves threads with every target, since any of them may be used by
+        all our threads
+        :param threads: The number of threads
+        :return: None
+        """
+        for store in self.targets.values():
+            store.reserve_threads(threads)
+
+    def release_threads(self, threads):
+        """
+        Releases threads reserved with every target
+        :param threads: The number of threads
+        :return: None
+        """
+        for store in self.targets.values():
+            store.release_threads(threads)
+
+    def reset_listing(self, containers):
+        """
+        Forgets how far containers were listed in their targets
+        :param containers: The qualified names of the containers
+        :return: None
+        """
+        names = dict()
+        for container in containers:
+            target, _, name = container.partition(SEPARATOR)
+            names.setdefault(target, list()).append(name)
+        for target, names_ in names.items():
+            self.targets[target].reset_listing(names_)
+
+    def delete_container(self, container, retry=2):
+        """
+        Deletes a container
+        :param container: The qualified name of the container
+        :param retry: The number of retries to use
+        :return: True on success, false on failure
+        """
+        store, name = self.split(container)
+        deleted = store.delete_container(name, retry)
+        if deleted:
+            self.forget_container(container)
+        return deleted
@@ -0,0 +1,163 @@
+"""hedging.py: Hedged requests to cut tail latency.
+
+A request that is still outstanding after the observed p99 latency of its
+operation is re-issued and whichever attempt succeeds first wins. Only
+idempotent requests (deletes and listing a single page) may be hedged.
+"""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import threading
+import time
+
+
+class Hedger:
+    """Tracks request latencies and hedges requests slower than a quantile"""
+
+    def __init__(self, enabled=False, quantile=0.99, min_samples=50,
+                 window=1000, workers=64):
+        """
+        Initializes a hedger
+        :param enabled: Whether to hedge requests at all
+        :param quantile: The latency quantile after which requests are hedged
+        :param min_samples: The samples an operation needs before hedging
+        :param window: The number of recent samples to compute quantiles over
+        :param workers: The least number of requests in flight. The pool
+         grows with the threads reserved.
+        :return: None
+        """
+        self.enabled = enabled
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.window = window
+        self.workers = workers
+
+        self.lock = threading.Lock()
+        self.samples = dict()
+        self.delays = dict()
+        self.stale = dict()
+        self.executor = None
+        self.pool_size = 0
+        self.callers = 0
+        self.hedged = 0
+
+    def reserve(self, callers):
+        """
+        Makes room for more threads making requests at once. Every caller may
+        have an attempt and a hedge in flight, so the pool holds two workers
+        per caller. Requests waiting for a worker would otherwise look slow.
+        :param callers: The number of threads
+        :return: None
+        """
+        with self.lock:
+            self.callers += callers
+            if self.executor is not None and \
+                    self.pool_size < 2 * self.callers:
+                # Calls in flight may still hedge on the old pool, so it
+                # isn't shut down. Its threads exit once they let go of it.
+                self.executor = None
+
+    def release(self, callers):
+        """
+        Releases threads reserved with reserve
+        :param callers: The number of threads
+        :return: None
+        """
+        with self.lock:
+            self.callers = max(0, self.callers - callers)
+
+    def record(self, operation, latency):
+        """
+        Records the latency of a successful request
+        :param operation: The name of the operation
+        :param latency: The latency in seconds
+        :return: None
+        """
+        with self.lock:
+            if operation not in self.samples:
+                self.samples[operation] = deque(maxlen=self.window)
+                self.stale[operation] = 0
+            self.samples[operation].append(latency)
+            self.stale[operation] += 1
+
+    def delay(self, operation):
+        """
+        Returns how long to wait before hedging a request. The quantile is
+        only recomputed every min_samples new samples.
+        :param operation: The name of the operation
+        :return: The delay in seconds or None if there are too few samples
+        """
+        with self.lock:
+            samples = self.samples.get(operation)
+            if samples is None or len(samples) < self.min_samples:
+                return None
+
+            if operation not in self.delays or \
+                    self.stale[operation] >= self.min_samples:
+                ordered = sorted(samples)
+                self.delays[operation] = ordered[
+                    int(self.quantile * (len(ordered) - 1))]
+                self.stale[operation] = 0
+
+            return self.delays[operation]
+
+    def call(self, operation, function, *args):
+        """
+        Calls a function, hedging it if it's slower than usual. The function
+        is called with the attempt number (0 or 1) followed by args and
+        should use a different connection for each attempt.
+        :param operation: The name of the operation, e.g. delete
+        :param function: The idempotent function to call
+        :return: The result of the first attempt to succeed
+        :throws: The exception of the first attempt if all attempts failed
+        """
+        if not self.enabled:
+            return function(0, *args)
+
+        started = threading.Event()
+
+        def attempt(number):
+            if number == 0:
+                started.set()
+            start = time.time()
+            result = function(number, *args)
+            self.record(operation, time.time() - start)
+            return result
+
+        delay = self.delay(operation)
+        if delay is None:
+            # We don't know what slow looks like yet
+            return attempt(0)
+
+        with self.lock:
+            if self.executor is None:
+                self.pool_size = max(self.workers, 2 * self.callers)
+                self.executor = ThreadPoolExecutor(self.pool_size)
+            executor = self.executor
+
+        # Slow is measured from when the request starts, not from when it
+        # was queued
+        pending = set([executor.submit(attempt, 0)])
+        started.wait()
+        done, pending = wait(pending, timeout=delay)
+        if len(done) == 0:
+            self.hedged += 1
+            pending.add(executor.submit(attempt, 1))
+
+        error = None
+        while len(done) > 0 or len(pending) > 0:
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                if error is None:
+                    error = future.exception()
+            if len(pending) == 0:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+        raise error
@@ -5,13 +5,49 @@ __copyright__ = "Copyright 2015, Chelsea Urquhart"
 __license__ = "GPL"
 __email__ = "me@chelseau.com"
 
+import datetime
 import os
-from boto3.session import Session
 import sys
+import threading
+from containercache import ContainerInfo
+from incremental import timestamp
 from objectstore import ObjectStore
+from stores.hedging import Hedger
 from threadeddeleter import ThreadedDeleter
 
 
+class Region:
+    """The connections and concurrency budget of a single region"""
+
+    def __init__(self, resource, clients, concurrency=0):
+        """
+        Initializes a region
+        :param resource: The S3 resource of the region
+        :param clients: A list of clients. Hedged requests use the second.
+        :param concurrency: The most requests in flight. 0 for no limit.
+        :return: None
+        """
+        self.resource = resource
+        self.clients = clients
+        self.semaphore = None
+        if concurrency > 0:
+            self.semaphore = threading.BoundedSemaphore(concurrency)
+
+    def call(self, attempt, method, **kwargs):
+        """
+        Makes a request within the concurrency budget of the region
+        :param attempt: The attempt number, used to pick a client
+        :param method: The name of the client method
+        :param kwargs: The arguments of the request
+        :return: The response
+        """
+        function = getattr(self.clients[attempt], method)
+        if self.semaphore is None:
+            return function(**kwargs)
+        with self.semaphore:
+            return function(**kwargs)
+
+
 class Store(ObjectStore):
     """A ObjectStore class for Amazon S3"""
 
@@ -27,37 +63,92 @@ class Store(ObjectStore):
         else:
             return ' Retrying {} more times.'.format(retries)
 
-    def __init__(self, parser):
+    # The config section to read options from
+    section = 's3'
+
+    # The options to read from the config section
+    options = ['access_key_id', 'access_key_secret', 'region', 'page_size',
+               'bulk_size', 'connect_timeout', 'read_timeout', 'hedge',
+               'hedge_quantile', 'size_estimate', 'max_pool_connections',
+               'region_concurrency']
+    optional = ['bulk_size', 'page_size', 'connect_timeout', 'read_timeout',
+                'hedge', 'hedge_quantile', 'size_estimate',
+                'max_pool_connections', 'region_concurrency']
+
+    # Whether buckets are routed to clients in their own region
+    route_regions = True
+
+    # Whether object_exists can check single objects
+    can_check_objects = True
+
+    # How bucket sizes are estimated for scheduling: CloudWatch storage
+    # metrics falling back to sampling, sampling the first page of keys, or
+    # not at all
+    size_estimates = ['metrics', 'sample', 'none']
+    default_size_estimate = 'metrics'
+
+    # The most keys S3 returns or deletes per request
+    max_keys = 1000
+
+    # The storage classes S3 reports the BucketSizeBytes metric of object
+    # data for. Unlike object counts there's no total across them.
+    storage_types = ['StandardStorage', 'IntelligentTieringFAStorage',
+                     'IntelligentTieringIAStorage',
+                     'IntelligentTieringAAStorage',
+                     'IntelligentTieringAIAStorage',
+                     'IntelligentTieringDAAStorage', 'StandardIAStorage',
+                     'OneZoneIAStorage', 'ReducedRedundancyStorage',
+                     'GlacierInstantRetrievalStorage', 'GlacierStorage',
+                     'DeepArchiveStorage']
+
+    def __init__(self, parser, section=None):
         """
         Initialize all our variables
         :param parser: Our config parser object
+        :param section: The config section to read instead of the default
         :return: None
         :throws: Exception on validation error
         """
+        if section is not None:
+            self.section = section
 
         # Store arguments
-        self.objects = dict()
+        self.marker = dict()
+        self.start_after = dict()
+        self.modified_since = dict()
         self.aws = None
+        self.clients = list()
+        self.regions = dict()
+        self.bucket_regions = dict()
+        self.regions_lock = threading.Lock()
+        self.hedger = None
         self.region = ''
         self.bulk_size = 0
         self.access_key_id = ''
         self.access_key_secret = ''
         self.page_size = 10000
-
-        options = ['access_key_id', 'access_key_secret', 'region', 'page_size',
-                   'bulk_size']
-        optional = ['bulk_size', 'page_size']
-
-        if not parser.has_section('s3'):
-            raise Exception('S3 configuration is missing')
-
-        for option in options:
-            if not parser.has_option('s3', option):
-                if option not in optional:
-                    raise Exception('Missing S3 option: {}'.format(
-                        option))
+        self.connect_timeout = 10
+        self.read_timeout = 60
+        self.hedge = 'False'
+        self.hedge_quantile = 0.99
+        self.size_estimate = self.default_size_estimate
+        self.max_pool_connections = 64
+        self.region_concurrency = 0
+        self.metrics = dict()
+        self.metrics_lock = threading.Lock()
+
+        if not parser.has_section(self.section):
+            raise Exception('{} configuration is missing'.format(
+                self.section))
+
+        for option in self.options:
+            if not parser.has_option(self.section, option):
+                if option not in self.optional:
+                    raise Exception('Missing {section} option: {option}'
+                                    .format(section=self.section,
+                                            option=option))
             else:
-                setattr(self, option, parser.get('s3', option))
+                setattr(self, option, parser.get(self.section, option))
 
         # Ensure data type
         self.bulk_size = int(self.bulk_size)
@@ -65,7 +156,23 @@ class Store(ObjectStore):
         # Ensure data type
         self.page_size = int(self.page_size)
 
-        # Validate options
+        # Ensure data type
+        self.connect_timeout = float(self.connect_timeout)
+        self.read_timeout = float(self.read_timeout)
+        self.hedge_quantile = float(self.hedge_quantile)
+
+        # Ensure data type
+        self.max_pool_connections = int(self.max_pool_connections)
+        self.region_concurrency = int(self.region_concurrency)
+
+        self.validate()
+
+    def validate(self):
+        """
+        Validates the options read from the config
+        :return: None
+        :throws: Exception on validation error
+        """
         if len(self.region) == 0:
             raise Exception('No region specified')
         if len(self.access_key_id) == 0:
@@ -74,6 +181,123 @@ class Store(ObjectStore):
             raise Exception('No API key secret specified')
         if self.page_size <= 0:
             raise Exception('Invalid page size specified')
+        if self.connect_timeout <= 0 or self.read_timeout <= 0:
+            raise Exception('Invalid timeout specified')
+        if self.hedge.lower() not in ['true', 'false']:
+            raise Exception('Invalid hedge value specified')
+        if not 0 < self.hedge_quantile < 1:
+            raise Exception('Invalid hedge quantile specified')
+        if self.size_estimate not in self.size_estimates:
+            raise Exception('Invalid size estimate specified')
+        if self.max_pool_connections <= 0:
+            raise Exception('Invalid max pool connections specified')
+        if self.region_concurrency < 0:
+            raise Exception('Invalid region concurrency specified')
+
+    def client_config(self, **kwargs):
+        """
+        Returns the botocore config for our clients
+        :param kwargs: Any extra config options
+        :return: A botocore Config
+        """
+        from botocore.client import Config
+        return Config(connect_timeout=self.connect_timeout,
+                      read_timeout=self.read_timeout,
+                      max_pool_connections=self.max_pool_connections,
+                      **kwargs)
+
+    def resource_options(self):
+        """
+        Returns any extra keyword arguments for creating the S3 resource
+        :return: A dict
+        """
+        return dict(config=self.client_config())
+
+    def session(self):
+        """
+        Creates a new session with our credentials
+        :return: A boto3 Session
+        """
+        from boto3.session import Session
+        return Session(aws_access_key_id=self.access_key_id,
+                       aws_secret_access_key=self.access_key_secret,
+                       region_name=self.region)
+
+    def connect(self, region=None):
+        """
+        Creates a new S3 resource with its own session
+        :param region: The region to connect to. Defaults to ours.
+        :return: An S3 resource
+        """
+        return self.session().resource('s3', region_name=region or self.region,
+                                       **self.resource_options())
+
+    def connect_region(self, region):
+        """
+        Connects to a region. Hedged requests go out on a connection pool of
+        their own.
+        :param region: The region to connect to
+        :return: A Region
+        """
+        resource = self.connect(region)
+        clients = [resource.meta.client]
+        if self.hedge.lower() == 'true':
+            clients.append(self.connect(region).meta.client)
+        return Region(resource, clients, self.region_concurrency)
+
+    def region_for(self, region):
+        """
+        Returns the connections of a region, connecting on first use
+        :param region: The name of the region or None for ours
+        :return: A Region
+        """
+        if not self.route_regions or region is None:
+            region = self.region
+
+        with self.regions_lock:
+            if region not in self.regions:
+                self.regions[region] = self.connect_region(region)
+            return self.regions[region]
+
+    def bucket_region(self, container):
+        """
+        Returns the connections of the region a bucket lives in
+        :param container: The name of the container
+        :return: A Region
+        """
+        if not self.route_regions:
+            return self.region_for(None)
+
+        # Containers that failed to prefetch are cached without a region
+        info = None if self.cache is None else self.cache.get(container)
+        if info is not None and info.region is not None:
+            return self.region_for(info.region)
+
+        # Fetching all the container info takes several requests. Only the
+        # region is needed to make this one.
+        with self.regions_lock:
+            region = self.bucket_regions.get(container)
+        if region is None:
+            try:
+                region = self.bucket_location(container)
+            except Exception:
+                # We may not be allowed to look it up. Requests to our own
+                # region still work, if more slowly.
+                region = self.region
+            with self.regions_lock:
+                self.bucket_regions[container] = region
+        return self.region_for(region)
+
+    def bucket_location(self, container):
+        """
+        Looks up the name of the region a bucket lives in
+        :param container: The name of the container
+        :return: The name of the region
+        """
+        location = self.clients[0].get_bucket_location(Bucket=container)
+
+        # Buckets in us-east-1 have no location constraint
+        return location.get('LocationConstraint') or 'us-east-1'
 
     def login(self):
         """
@@ -83,10 +307,11 @@ class Store(ObjectStore):
         """
 
         try:
-            session = Session(aws_access_key_id=self.access_key_id,
-                              aws_secret_access_key=self.access_key_secret,
-                              region_name=self.region)
-            self.aws = session.resource('s3')
+            home = self.region_for(self.region)
+            self.aws = home.resource
+            self.clients = home.clients
+            self.hedger = Hedger(self.hedge.lower() == 'true',
+                                 self.hedge_quantile)
         except Exception as e:
             ThreadedDeleter.output('Unknown error occurred: {msg}'.format(
                 msg=str(e)))
@@ -123,6 +348,140 @@ class Store(ObjectStore):
 
         return containers
 
+    def metrics_client(self, region):
+        """
+        Returns a CloudWatch client for a region. Storage metrics are only
+        published in the region of their bucket.
+        :param region: The region of the bucket
+        :return: A CloudWatch client
+        """
+        with self.metrics_lock:
+            if region not in self.metrics:
+                self.metrics[region] = self.session().client(
+                    'cloudwatch', region_name=region,
+                    config=self.client_config())
+            return self.metrics[region]
+
+    def metric_sizes(self, container, region):
+        """
+        Returns the object count and size CloudWatch last reported for a
+        bucket. S3 reports storage metrics once a day.
+        :param container: The name of the container
+        :param region: The region of the bucket
+        :return: A tuple containing the number of objects and bytes, both
+         None if there are no metrics
+        """
+        def query(id_, metric, storage_type):
+            return dict(Id=id_, MetricStat=dict(
+                Metric=dict(Namespace='AWS/S3', MetricName=metric,
+                            Dimensions=[dict(Name='BucketName',
+                                             Value=container),
+                                        dict(Name='StorageType',
+                                             Value=storage_type)]),
+                Period=86400, Stat='Average'))
+
+        queries = [query('objects', 'NumberOfObjects', 'AllStorageTypes')]
+        for index, storage_type in enumerate(self.storage_types):
+            queries.append(query('bytes{}'.format(index), 'BucketSizeBytes',
+                                 storage_type))
+
+        end = datetime.datetime.utcnow()
+        response = self.metrics_client(region).get_metric_data(
+            MetricDataQueries=queries,
+            StartTime=end - datetime.timedelta(days=3), EndTime=end)
+
+        # Values come newest first
+        latest = dict((result['Id'], result['Values'][0])
+                      for result in response.get('MetricDataResults', [])
+                      if len(result.get('Values', [])) > 0)
+        if 'objects' not in latest:
+            return None, None
+        return int(latest.pop('objects')), int(sum(latest.values()))
+
+    def sample_sizes(self, container, region):
+        """
+        Lists the first page of a bucket. Small buckets are counted exactly.
+        Anything larger is reported as a full page of unknown size.
+        :param container: The name of the container
+        :param region: The region of the bucket
+        :return: A tuple containing the number of objects and bytes
+        """
+        response = self.region_for(region).call(
+            0, 'list_objects_v2', Bucket=container, MaxKeys=self.max_keys)
+        bytes_ = None
+        if not response.get('IsTruncated'):
+            bytes_ = sum(object_.get('Size', 0)
+                         for object_ in response.get('Contents', []))
+        return response.get('KeyCount', 0), bytes_
+
+    def fetch_container_info(self, container):
+        """
+        Fetches the region a bucket lives in and estimates of its object
+        count and size. Requests go through the clients of the region, so
+        there's no handle worth keeping.
+        :param container: The name of the container
+        :return: A ContainerInfo
+        """
+        region = self.region
+        if self.route_regions:
+            region = self.bucket_location(container)
+
+        object_count = bytes_ = None
+        if self.size_estimate == 'metrics':
+            try:
+                object_count, bytes_ = self.metric_sizes(container, region)
+            except Exception:
+                # We may not be allowed to read metrics. Sample instead.
+                pass
+        if object_count is None and self.size_estimate != 'none':
+            object_count, bytes_ = self.sample_sizes(container, region)
+
+        return ContainerInfo(container, object_count=object_count,
+                             bytes=bytes_, region=region)
+
+    def list_page(self, attempt, container_name, token, limit):
+        """
+        Lists a single page of objects. This is idempotent so it can be hedged.
+        :param attempt: The attempt number, used to pick a connection
+        :param container_name: The name of the container to get objects from
+        :param token: The continuation token or None to start listing
+        :param limit: The maximum number of objects to return
+        :return: A tuple containing the object names and the next
+         continuation token (None once the listing is complete)
+        """
+        options = dict(Bucket=container_name, MaxKeys=limit)
+        if token is not None:
+            options['ContinuationToken'] = token
+        elif container_name in self.start_after:
+            options['StartAfter'] = self.start_after[container_name]
+
+        response = self.bucket_region(container_name).call(
+            attempt, 'list_objects_v2', **options)
+
+        # S3 can't filter by age so older objects are skipped here
+        since = self.modified_since.get(container_name)
+        objects = [object_['Key'] for object_ in response.get('Contents', [])
+                   if since is None or
+                   timestamp(object_['LastModified']) >= since]
+        if not response.get('IsTruncated'):
+            return objects, None
+        return objects, response['NextContinuationToken']
+
+    def start_listing(self, container, start_after=None,
+                      modified_since=None):
+        """
+        Narrows the next listing of a container for incremental runs
+        :param container: The name of the container
+        :param start_after: The key to start listing after or None
+        :param modified_since: Skip objects last modified before this many
+         seconds since the epoch. None lists objects of any age.
+        :return: None
+        """
+        if start_after is not None:
+            self.start_after[container] = start_after
+        if modified_since is not None:
+            self.modified_since[container] = modified_since
+
     def list_objects(self, container_name, retry=2):
         """
         Lists objects in a given container
@@ -130,26 +489,22 @@ class Store(ObjectStore):
         :param retry: The number of retries to use
         :return: A list of objects or False on error
         """
-        if container_name in self.objects:
-            objects = self.objects.get(container_name)
-        else:
-            objects = None
+        token = self.marker.get(container_name, '')
+        if token is None:
+            # We're out of files. Release the listing state.
+            self.reset_listing([container_name])
+            return list()
 
         objects_ = list()
 
         try:
-            if objects is None:
-                bucket = self.aws.Bucket(container_name)
-                objects = iter(bucket.objects.page_size(self.page_size))
-                self.objects[container_name] = objects
-
-            for i in range(0, self.page_size):
-                try:
-                    object_ = next(objects)
-                    objects_.append(object_.key)
-                except StopIteration as e:
-                    # Just ignore this. We're out of files.
-                    pass
+            while len(objects_) < self.page_size:
+                objects, token = self.hedger.call(
+                    'list', self.list_page, container_name, token or None,
+                    min(self.max_keys, self.page_size - len(objects_)))
+                objects_.extend(objects)
+                if token is None:
+                    break
 
         except Exception as e:
             ThreadedDeleter.output('List objects failed: {msg}.{retry}'
@@ -161,21 +516,84 @@ class Store(ObjectStore):
             # Retry
             return self.list_objects(container_name, retry - 1)
 
+        if token is None and len(objects_) == 0:
+            # Nothing was left, or nothing new enough. Listing stops at an
+            # empty page so we won't be asked again and the next run has to
+            # start over.
+            self.reset_listing([container_name])
+            return objects_
+
+        self.marker[container_name] = token
         return objects_
 
+    def object_exists(self, container, object_):
+        """
+        Checks whether an object still exists. This lists the object rather
+        than reading it so it only needs the permissions deleting does.
+        :param container: The name of the container
+        :param object_: The name of the object
+        :return: True if it exists
+        """
+        response = self.bucket_region(container).call(
+            0, 'list_objects_v2', Bucket=container, Prefix=object_, MaxKeys=1)
+        return any(entry['Key'] == object_
+                   for entry in response.get('Contents', []))
+
+    def delete_page(self, attempt, container, objects):
+        """
+        Deletes a batch of objects from a container. This is idempotent so it
+        can be hedged.
+        :param attempt: The attempt number, used to pick a connection
+        :param container: The name of the container to delete from
+        :param objects: A list of object names
+        :return: A list of the errors of objects that weren't deleted
+        """
+        response = self.bucket_region(container).call(
+            attempt, 'delete_objects', Bucket=container,
+            Delete=dict(Objects=[dict(Key=object_) for object_ in objects],
+                        Quiet=True))
+
+        # Quiet responses only list the objects that failed
+        return response.get('Errors', [])
+
+    def delete_single(self, attempt, container, object_):
+        """
+        Deletes a single object. This is idempotent so it can be hedged.
+        :param attempt: The attempt number, used to pick a connection
+        :param container: The name of the container to delete from
+        :param object_: The name of the object
+        :return: None
+        """
+        self.bucket_region(container).call(attempt, 'delete_object',
+                                           Bucket=container, Key=object_)
+
     def delete_objects_bulk(self, local):
         if local.size > 0:
-            for container, objects in local.data.iteritems()\
-                    if hasattr(local.data, 'iteritems')\
-                    else local.data.items():
-                try:
-                    bucket = self.aws.Bucket(container)
-                    bucket.delete_objects(Delete=dict(
-                        Objects=objects
-                    ))
-                except Exception as e:
-                    ThreadedDeleter.output('Bulk delete objects failed: {msg}.'
-                                           .format(msg=str(e)))
+            with self.stage(local, 'bulk_flush'):
+                for container, objects in local.data.iteritems()\
+                        if hasattr(local.data, 'iteritems')\
+                        else local.data.items():
+                    try:
+                        errors = self.hedger.call('delete', self.delete_page,
+                                                  container, objects)
+                    except Exception as e:
+                        ThreadedDeleter.output('Bulk delete objects failed:'
+                                               ' {msg}.'.format(msg=str(e)))
+                        for object_ in objects:
+                            self.delete_failed(local, container, object_, e)
+                        continue
+
+                    if len(errors) > 0:
+                        ThreadedDeleter.output('Bulk delete failed for'
+                                               ' {count} objects: {msg}.'
+                                               .format(count=len(errors),
+                                                       msg=errors[0].get(
+                                                           'Message')))
+                    for error in errors:
+                        self.delete_failed(local, container, error.get('Key'),
+                                           '{code} {msg}'.format(
+                                               code=error.get('Code'),
+                                               msg=error.get('Message')))
         local.size = 0
         local.data = dict()
 
@@ -190,36 +608,46 @@ class Store(ObjectStore):
         """
         if self.bulk_size <= 1:
             try:
-                bucket = self.aws.Bucket(container)
-                object_ = bucket.Object(object_)
-                object_.delete()
+                self.hedger.call('delete', self.delete_single, container,
+                                 object_)
             except Exception as e:
                 ThreadedDeleter.output('Delete object failed: {msg}.'
                                        .format(msg=str(e)))
+                self.delete_failed(local, container, object_, e)
         else:
             if container not in local.data:
                 local.data[container] = list()
-            local.data[container].append(dict(Key=object_))
+            local.data[container].append(object_)
             local.size += 1
             if local.size >= self.bulk_size:
                 self.delete_objects_bulk(local)
 
     def init_thread(self, local):
         """
-        Initialize thread-specific S3 connection & data list
+        Initialize thread-specific data list. S3 clients are thread safe so
+        all threads share our connection pools.
         :param local: The Local object
         :return: None
         """
-        session = Session(aws_access_key_id=self.access_key_id,
-                          aws_secret_access_key=self.access_key_secret,
-                          region_name=self.region)
-        local.aws = session.resource('s3')
         local.data = dict()
         local.size = 0
 
+    def take_buffered(self, local):
+        """
+        Removes and returns the objects a thread buffered but hasn't deleted
+        :param local: The Local object
+        :return: A list of container, object tuples
+        """
+        buffered = [(container, object_)
+                    for container, objects in local.data.items()
+                    for object_ in objects]
+        local.data = dict()
+        local.size = 0
+        return buffered
+
     def cleanup_thread(self, local):
         """
-        Cleanup thread-specific S3 connection
+        Cleanup thread-specific data
         :param local: The Local object
         :return: None
         """
@@ -227,6 +655,16 @@ class Store(ObjectStore):
         # Delete any remaining objects first if using bulk deletions
         self.delete_objects_bulk(local)
 
+    def forget_container(self, container):
+        """
+        Drops a container from the caches, such as once it's deleted
+        :param container: The name of the container
+        :return: None
+        """
+        ObjectStore.forget_container(self, container)
+        with self.regions_lock:
+            self.bucket_regions.pop(container, None)
+
     def delete_container(self, container, retry=2):
         """
         Deletes a container
@@ -235,8 +673,8 @@ class Store(ObjectStore):
         :return: None
         """
         try:
-            bucket = self.aws.Bucket(container)
-            bucket.delete()
+            self.bucket_region(container).resource.Bucket(container).delete()
+            self.forget_container(container)
             return True
         except Exception as e:
             ThreadedDeleter.output('Delete container failed: {msg}.{retry}'
@@ -0,0 +1,87 @@
+"""s3compat.py: Contains an ObjectStore for any S3 compatible service.
+
+This works with anything that speaks the S3 API on a custom endpoint such as
+MinIO or Ceph RGW. Deletions use the same batched path as the S3 store.
+"""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+from stores import s3
+
+
+class Store(s3.Store):
+    """A ObjectStore class for S3 compatible services"""
+
+    section = 's3compat'
+
+    options = s3.Store.options + ['endpoint_url', 'addressing_style',
+                                  'signature_version', 'verify_ssl',
+                                  'ca_bundle']
+    optional = s3.Store.optional + ['region', 'addressing_style',
+                                    'signature_version', 'verify_ssl',
+                                    'ca_bundle']
+
+    # Services have a single endpoint whatever a bucket's location says
+    route_regions = False
+
+    # There are no CloudWatch metrics outside of AWS
+    size_estimates = ['sample', 'none']
+    default_size_estimate = 'sample'
+
+    def __init__(self, parser, section=None):
+        """
+        Initialize all our variables
+        :param parser: Our config parser object
+        :param section: The config section to read instead of the default
+        :return: None
+        :throws: Exception on validation error
+        """
+        self.endpoint_url = ''
+        self.addressing_style = 'path'
+        self.signature_version = 's3v4'
+        self.verify_ssl = 'True'
+        self.ca_bundle = ''
+
+        s3.Store.__init__(self, parser, section)
+
+    def validate(self):
+        """
+        Validates the options read from the config
+        :return: None
+        :throws: Exception on validation error
+        """
+        # Most S3 compatible services ignore the region, but requests still
+        # need to be signed for one.
+        if len(self.region) == 0:
+            self.region = 'us-east-1'
+
+        s3.Store.validate(self)
+
+        if len(self.endpoint_url) == 0:
+            raise Exception('No endpoint URL specified')
+        if self.addressing_style not in ['path', 'virtual', 'auto']:
+            raise Exception('Invalid addressing style specified')
+        if self.verify_ssl.lower() not in ['true', 'false']:
+            raise Exception('Invalid verify_ssl value specified')
+
+    def resource_options(self):
+        """
+        Returns the endpoint, addressing and TLS options for the S3 resource
+        :return: A dict
+        """
+        if self.verify_ssl.lower() == 'false':
+            verify = False
+        elif len(self.ca_bundle) > 0:
+            verify = self.ca_bundle
+        else:
+            verify = True
+
+        return dict(endpoint_url=self.endpoint_url,
+                    use_ssl=self.endpoint_url.lower().startswith('https'),
+                    verify=verify,
+                    config=self.client_config(
+                        signature_version=self.signature_version,
+                        s3=dict(addressing_style=self.addressing_style)))
@@ -0,0 +1,429 @@
+"""swift.py: Contains an OpenStack Swift implementation of ObjectStore."""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+import threading
+from containercache import ContainerInfo
+from incremental import timestamp
+from objectstore import ObjectStore
+from stores.hedging import Hedger
+from stores.swiftbulk import BulkDeleter, MAX_BULK_DELETE
+from threadeddeleter import ThreadedDeleter
+
+
+class Store(ObjectStore):
+    """A ObjectStore class for OpenStack Swift"""
+
+    # The config section to read options from
+    section = 'swift'
+
+    # Whether object_exists can check single objects
+    can_check_objects = True
+
+    @classmethod
+    def get_retry_text(cls, retries):
+        """
+        Returns retry text based on the number of retries
+        :param retries: The number of retries
+        :return: A string
+        """
+        if retries == 0:
+            return ' All retries exhausted.'
+        else:
+            return ' Retrying {} more times.'.format(retries)
+
+    def __init__(self, parser, section=None):
+        """
+        Initialize all our variables
+        :param parser: Our config parser object
+        :param section: The config section to read instead of the default
+        :return: None
+        :throws: Exception on validation error
+        """
+        if section is not None:
+            self.section = section
+
+        # Store arguments
+        self.marker = dict()
+        self.modified_since = dict()
+        self.conn = None
+        self.storage_url = None
+        self.token = None
+        self.auth_lock = threading.Lock()
+        self.auth_url = ''
+        self.auth_version = '1.0'
+        self.username = ''
+        self.key = ''
+        self.project_name = ''
+        self.user_domain_name = 'Default'
+        self.project_domain_name = 'Default'
+        self.region = ''
+        self.insecure = 'False'
+        self.ca_bundle = ''
+        self.bulk_size = MAX_BULK_DELETE
+        self.page_size = 10000
+        self.connect_timeout = 10
+        self.read_timeout = 60
+        self.hedge = 'False'
+        self.hedge_quantile = 0.99
+        self.hedger = None
+        self.thread_local = threading.local()
+
+        options = ['auth_url', 'auth_version', 'username', 'key',
+                   'project_name', 'user_domain_name', 'project_domain_name',
+                   'region', 'insecure', 'ca_bundle', 'bulk_size',
+                   'page_size', 'connect_timeout', 'read_timeout', 'hedge',
+                   'hedge_quantile']
+        optional = ['auth_version', 'project_name', 'user_domain_name',
+                    'project_domain_name', 'region', 'insecure', 'ca_bundle',
+                    'bulk_size', 'page_size', 'connect_timeout',
+                    'read_timeout', 'hedge', 'hedge_quantile']
+
+        if not parser.has_section(self.section):
+            raise Exception('{} configuration is missing'.format(
+                self.section))
+
+        for option in options:
+            if not parser.has_option(self.section, option):
+                if option not in optional:
+                    raise Exception('Missing {section} option: {option}'
+                                    .format(section=self.section,
+                                            option=option))
+            else:
+                setattr(self, option, parser.get(self.section, option))
+
+        # Ensure data type. A bulk delete request can't exceed the middleware's
+        # limit.
+        self.bulk_size = min(int(self.bulk_size), MAX_BULK_DELETE)
+
+        # Ensure data type
+        self.page_size = int(self.page_size)
+
+        # Ensure data type
+        self.connect_timeout = float(self.connect_timeout)
+        self.read_timeout = float(self.read_timeout)
+        self.hedge_quantile = float(self.hedge_quantile)
+
+        # Validate options
+        if len(self.auth_url) == 0:
+            raise Exception('No auth URL specified')
+        if len(self.username) == 0:
+            raise Exception('No username specified')
+        if len(self.key) == 0:
+            raise Exception('No key specified')
+        if self.auth_version not in ['1.0', '2.0', '3']:
+            raise Exception('Invalid auth version specified')
+        if self.insecure.lower() not in ['true', 'false']:
+            raise Exception('Invalid insecure value specified')
+        if self.page_size <= 0:
+            raise Exception('Invalid page size specified')
+        if self.connect_timeout <= 0 or self.read_timeout <= 0:
+            raise Exception('Invalid timeout specified')
+        if self.hedge.lower() not in ['true', 'false']:
+            raise Exception('Invalid hedge value specified')
+        if not 0 < self.hedge_quantile < 1:
+            raise Exception('Invalid hedge quantile specified')
+
+        # Only bulk deletes are hedged. swiftclient connections can't be
+        # shared with a request that lost the race but is still running.
+        self.hedger = Hedger(self.hedge.lower() == 'true', self.hedge_quantile)
+
+    def connect(self):
+        """
+        Creates a new Swift connection. Once we're logged in the connection
+        reuses our token rather than authenticating again.
+        :return: A swiftclient Connection
+        """
+        from swiftclient.client import Connection
+
+        os_options = dict(region_name=self.region or None)
+        if self.auth_version != '1.0':
+            os_options.update(project_name=self.project_name or None,
+                              tenant_name=self.project_name or None,
+                              user_domain_name=self.user_domain_name,
+                              project_domain_name=self.project_domain_name)
+
+        return Connection(authurl=self.auth_url, user=self.username,
+                          key=self.key, auth_version=self.auth_version,
+                          os_options=os_options,
+                          insecure=self.insecure.lower() == 'true',
+                          cacert=self.ca_bundle or None,
+                          preauthurl=self.storage_url,
+                          preauthtoken=self.token,
+                          timeout=self.read_timeout)
+
+    def login(self):
+        """
+        Logs into Swift. Note that this is on the main thread.
+        init_thread is responsible for initializing individual threads.
+        :return: True on success, false on failure
+        """
+        try:
+            self.conn = self.connect()
+            self.storage_url, self.token = self.conn.get_auth()
+        except Exception as e:
+            ThreadedDeleter.output('Authentication failed: {msg}'.format(
+                msg=str(e)))
+            return False
+
+        # Bulk deletes need the bulk middleware. Respect its limits.
+        if self.bulk_size > 1:
+            try:
+                capabilities = self.conn.get_capabilities()
+            except Exception:
+                capabilities = dict()
+
+            if 'bulk_delete' not in capabilities:
+                ThreadedDeleter.output('Bulk delete is not supported by this'
+                                       ' cluster. Deleting objects one at a'
+                                       ' time.')
+                self.bulk_size = 1
+            else:
+                self.bulk_size = min(
+                    self.bulk_size, capabilities['bulk_delete'].get(
+                        'max_deletes_per_request', self.bulk_size))
+
+        return True
+
+    def refresh_auth(self, token):
+        """
+        Re-authenticates after a token expired. Threads noticing the same
+        expired token only cause a single re-authentication.
+        :param token: The token that expired
+        :return: A tuple containing the storage URL and a valid token
+        """
+        with self.auth_lock:
+            if self.token == token:
+                self.storage_url, self.token = self.conn.get_auth()
+            return self.storage_url, self.token
+
+    def list_containers(self, prefixes, retry=2):
+        """
+        Lists containers beginning with any of the provided prefixes
+        :param prefixes: The (list of) prefixes to get containers for
+        :param retry: The number of retries to use
+        :return: A list of containers or False on error
+        """
+        containers = list()
+        if len(prefixes) == 0:
+            prefixes = [None]
+
+        for prefix in prefixes:
+            try:
+                headers, containers_ = self.conn.get_account(
+                    prefix=prefix, full_listing=True)
+            except Exception as e:
+                ThreadedDeleter.output('List containers failed: {msg}.{retry}'
+                                       .format(msg=str(e),
+                                               retry=self.get_retry_text(
+                                                   retry)))
+                if retry == 0:
+                    return False
+
+                # Retry
+                return self.list_containers(prefixes, retry - 1)
+
+            for container in containers_:
+                containers.append(container['name'])
+
+        return containers
+
+    def thread_conn(self):
+        """
+        Returns a connection for the calling thread. Prefetching and listing
+        run on several threads at once and swiftclient connections can't be
+        shared between threads.
+        :return: A swiftclient Connection
+        """
+        if not hasattr(self.thread_local, 'conn'):
+            self.thread_local.conn = self.connect()
+        return self.thread_local.conn
+
+    def fetch_container_info(self, container):
+        """
+        Fetches the object count and size of a container
+        :param container: The name of the container
+        :return: A ContainerInfo
+        """
+        headers = self.thread_conn().head_container(container)
+        return ContainerInfo(
+            container,
+            object_count=int(headers.get('x-container-object-count', 0)),
+            bytes=int(headers.get('x-container-bytes-used', 0)),
+            region=self.region or None, endpoint=self.storage_url)
+
+    def start_listing(self, container, start_after=None,
+                      modified_since=None):
+        """
+        Narrows the next listing of a container for incremental runs
+        :param container: The name of the container
+        :param start_after: The key to start listing after or None
+        :param modified_since: Skip objects last modified before this many
+         seconds since the epoch. None lists objects of any age.
+        :return: None
+        """
+        if start_after is not None:
+            self.marker[container] = start_after
+        if modified_since is not None:
+            self.modified_since[container] = modified_since
+
+    def list_objects(self, container_name, retry=2):
+        """
+        Lists objects in a given container
+        :param container_name: The name of the container to get objects from
+        :param retry: The number of retries to use
+        :return: A list of objects or False on error
+        """
+        since = self.modified_since.get(container_name)
+        objects = list()
+
+        try:
+            # Skip over pages holding nothing but older objects
+            while len(objects) == 0:
+                headers, objects_ = self.thread_conn().get_container(
+                    container_name, marker=self.marker.get(container_name, ''),
+                    limit=self.page_size)
+                if len(objects_) == 0:
+                    break
+                self.marker[container_name] = objects_[-1]['name']
+                for object in objects_:
+                    if since is None or \
+                            timestamp(object['last_modified']) >= since:
+                        objects.append(object['name'])
+        except Exception as e:
+            ThreadedDeleter.output('List objects failed: {msg}.{retry}'
+                                   .format(msg=str(e),
+                                           retry=self.get_retry_text(retry)))
+            if retry == 0:
+                return False
+
+            # Retry
+            return self.list_objects(container_name, retry - 1)
+
+        if len(objects) == 0:
+            # We're out of files. Release the listing state.
+            self.marker.pop(container_name, None)
+            self.modified_since.pop(container_name, None)
+
+        return objects
+
+    def object_exists(self, container, object_):
+        """
+        Checks whether an object still exists. This lists the object rather
+        than reading it so it only needs the permissions deleting does.
+        :param container: The name of the container
+        :param object_: The name of the object
+        :return: True if it exists
+        """
+        headers, objects = self.thread_conn().get_container(
+            container, prefix=object_, limit=1)
+        return any(entry['name'] == object_ for entry in objects)
+
+    def delete_objects_bulk(self, local):
+        """
+        Deletes all buffered objects of a thread with the bulk delete
+        middleware. A single request may span several containers.
+        :param local: The Local object
+        :return: None
+        """
+        if local.size > 0:
+            with self.stage(local, 'bulk_flush'):
+                deleted, failed = local.bulk.delete(local.data)
+                if len(failed) > 0:
+                    ThreadedDeleter.output('Bulk delete failed for {count}'
+                                           ' objects: {msg}.'.format(
+                                               count=len(failed),
+                                               msg=failed[0][2]))
+                for container, object_, status in failed:
+                    self.delete_failed(local, container, object_, status)
+        local.size = 0
+        local.data = list()
+
+    def delete_object(self, container, object_, local):
+        """
+        Deletes an object from a given container
+        :param container: The name of the container to get objects from
+        :param object_: The name of the object to delete
+        :param local: A Local class object for storing thread-specific
+         variables in.
+        :return: None
+        """
+        if self.bulk_size <= 1:
+            try:
+                local.conn.delete_object(container, object_)
+            except Exception as e:
+                ThreadedDeleter.output('Delete object failed: {msg}.'
+                                       .format(msg=str(e)))
+                self.delete_failed(local, container, object_, e)
+        else:
+            local.data.append((container, object_))
+            local.size += 1
+            if local.size >= self.bulk_size:
+                self.delete_objects_bulk(local)
+
+    def init_thread(self, local):
+        """
+        Initialize thread-specific Swift connections & data list
+        :param local: The Local object
+        :return: None
+        """
+        if self.insecure.lower() == 'true':
+            verify = False
+        else:
+            verify = self.ca_bundle or True
+
+        local.conn = self.connect()
+        local.bulk = BulkDeleter(self.storage_url, self.token,
+                                 reauth=self.refresh_auth, verify=verify,
+                                 timeout=(self.connect_timeout,
+                                          self.read_timeout),
+                                 hedger=self.hedger)
+        local.data = list()
+        local.size = 0
+
+    def take_buffered(self, local):
+        """
+        Removes and returns the objects a thread buffered but hasn't deleted
+        :param local: The Local object
+        :return: A list of container, object tuples
+        """
+        buffered = local.data
+        local.data = list()
+        local.size = 0
+        return buffered
+
+    def cleanup_thread(self, local):
+        """
+        Cleanup thread-specific Swift connection
+        :param local: The Local object
+        :return: None
+        """
+
+        # Delete any remaining objects first if using bulk deletions
+        self.delete_objects_bulk(local)
+        local.bulk.close()
+        local.conn.close()
+
+    def delete_container(self, container, retry=2):
+        """
+        Deletes a container
+        :param container: The name of the container to get objects from
+        :param retry: The number of retries to use
+        :return: None
+        """
+        try:
+            self.conn.delete_container(container)
+            self.forget_container(container)
+            return True
+        except Exception as e:
+            ThreadedDeleter.output('Delete container failed: {msg}.{retry}'
+                                   .format(msg=str(e),
+                                           retry=self.get_retry_text(retry)))
+            if retry == 0:
+                return False
+
+            # Retry
+            return self.delete_container(container, retry - 1)
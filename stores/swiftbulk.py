@@ -0,0 +1,172 @@
+"""swiftbulk.py: Native deletes through the Swift bulk delete middleware.
+
+Both Cloud Files and OpenStack Swift accept up to 10000 newline separated,
+URL encoded /container/object paths per bulk delete request and the paths may
+span containers. The request body is streamed from the buffered paths rather
+than built as one string and the per path report in the response is parsed so
+failed paths can be retried.
+"""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+import json
+from stores.hedging import Hedger
+import time
+try:
+    from urllib.parse import quote, unquote
+except ImportError:
+    from urllib import quote, unquote
+
+# The most paths the bulk delete middleware accepts per request by default
+MAX_BULK_DELETE = 10000
+
+
+def encode_path(container, object_):
+    """
+    Encodes a container and object as a line of a bulk delete request body
+    :param container: The name of the container
+    :param object_: The name of the object
+    :return: The URL encoded line as bytes
+    """
+    path = u'/{container}/{object}'.format(container=container,
+                                           object=object_)
+    return quote(path.encode('utf-8')).encode('ascii') + b'\n'
+
+
+def decode_path(path):
+    """
+    Decodes a path from a bulk delete report
+    :param path: The URL encoded /container/object path
+    :return: A tuple containing container, object
+    """
+    container, object_ = unquote(path).lstrip('/').split('/', 1)
+    return container, object_
+
+
+def stream(paths):
+    """
+    Generates the body of a bulk delete request one line at a time
+    :param paths: A list of container, object tuples
+    :return: A generator of bytes
+    """
+    for container, object_ in paths:
+        yield encode_path(container, object_)
+
+
+class BulkDeleteError(Exception):
+    """Raised when a whole bulk delete request fails"""
+
+
+class BulkDeleter:
+    """Sends bulk delete requests over a connection of its own"""
+
+    def __init__(self, storage_url, token, reauth=None, verify=True,
+                 timeout=None, hedger=None):
+        """
+        Initializes a bulk deleter. Each thread should use its own.
+        :param storage_url: The storage URL of the account
+        :param token: The auth token to use
+        :param reauth: A callable taking the expired token and returning a
+         new storage URL, token tuple
+        :param verify: Whether to verify TLS certificates or a CA bundle
+        :param timeout: A connect timeout, read timeout tuple in seconds
+        :param hedger: The Hedger to hedge slow requests with
+        :return: None
+        """
+        import requests
+
+        self.storage_url = storage_url
+        self.token = token
+        self.reauth = reauth
+        self.timeout = timeout
+        self.hedger = hedger or Hedger()
+
+        # Hedged requests go out on a connection of their own
+        self.sessions = list()
+        for attempt in range(2 if self.hedger.enabled else 1):
+            session = requests.Session()
+            session.verify = verify
+            self.sessions.append(session)
+
+    def close(self):
+        """
+        Closes our connections
+        :return: None
+        """
+        for session in self.sessions:
+            session.close()
+
+    def request(self, attempt, paths):
+        """
+        Sends a single bulk delete request. Deletes are idempotent so this
+        can be hedged.
+        :param attempt: The attempt number, used to pick a connection
+        :param paths: A list of container, object tuples
+        :return: The parsed bulk delete report
+        :throws: BulkDeleteError if the request as a whole failed
+        """
+        response = self.sessions[attempt].post(
+            self.storage_url, params={'bulk-delete': ''},
+            headers={'X-Auth-Token': self.token,
+                     'Content-Type': 'text/plain',
+                     'Accept': 'application/json'},
+            data=stream(paths), timeout=self.timeout)
+
+        if response.status_code == 401 and self.reauth is not None:
+            self.storage_url, self.token = self.reauth(self.token)
+            raise BulkDeleteError('Authentication expired')
+        if response.status_code >= 300:
+            raise BulkDeleteError('{code} {reason}'.format(
+                code=response.status_code, reason=response.reason))
+
+        # The middleware sends whitespace to keep the connection alive while
+        # it works so the report has to be stripped.
+        report = json.loads(response.content.decode('utf-8').strip())
+        status = report.get('Response Status', '')
+        if not status.startswith('2') and \
+                len(report.get('Errors', [])) == 0:
+            raise BulkDeleteError('{status} {body}'.format(
+                status=status, body=report.get('Response Body', '')))
+
+        return report
+
+    def delete(self, paths, retry=2):
+        """
+        Deletes the given paths in batches of up to MAX_BULK_DELETE, retrying
+        any paths that failed.
+        :param paths: A list of container, object tuples
+        :param retry: The number of retries to use
+        :return: A tuple containing the number of deleted (or already missing)
+         objects and a list of container, object, status tuples that failed
+        """
+        deleted = 0
+        failed = list()
+
+        for start in range(0, len(paths), MAX_BULK_DELETE):
+            batch = paths[start:start + MAX_BULK_DELETE]
+            for attempt in range(retry + 1):
+                if attempt > 0:
+                    # Back off a little in case we're being throttled
+                    time.sleep(0.5 * 2 ** (attempt - 1))
+
+                try:
+                    report = self.hedger.call('delete', self.request, batch)
+                except Exception as e:
+                    errors = [(container, object_, str(e))
+                              for container, object_ in batch]
+                else:
+                    deleted += report.get('Number Deleted', 0) + \
+                        report.get('Number Not Found', 0)
+                    errors = [decode_path(path) + (status,)
+                              for path, status in report.get('Errors', [])]
+
+                if len(errors) == 0 or attempt == retry:
+                    break
+                batch = [(container, object_)
+                         for container, object_, status in errors]
+            failed.extend(errors)
+
+        return deleted, failed
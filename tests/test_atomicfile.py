@@ -0,0 +1,44 @@
+"""test_atomicfile.py: Tests of replacing files whole."""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+from atomicfile import atomic_write
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class AtomicWriteTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'report.json')
+        with open(self.path, 'w') as f:
+            f.write('old')
+
+    def read(self):
+        with open(self.path) as f:
+            return f.read()
+
+    def test_replaces(self):
+        with atomic_write(self.path) as f:
+            f.write('new')
+            self.assertEqual(self.read(), 'old')
+        self.assertEqual(self.read(), 'new')
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+
+    def test_failure_keeps_file(self):
+        with self.assertRaises(ValueError):
+            with atomic_write(self.path) as f:
+                f.write('new')
+                raise ValueError()
+        self.assertEqual(self.read(), 'old')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+"""test_audit.py: Tests of the run audit and sampled verification bounds."""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+import random
+import unittest
+from audit import Audit, MAX_FAILURES_REPORTED, Reservoir, upper_bound
+
+
+class UpperBoundTest(unittest.TestCase):
+
+    def test_no_samples(self):
+        self.assertEqual(upper_bound(0, 0), 1.0)
+
+    def test_no_survivors(self):
+        # The Wilson bound of p = 0 is z^2 / (n + z^2)
+        self.assertAlmostEqual(upper_bound(0, 1000),
+                               1.96 ** 2 / (1000 + 1.96 ** 2))
+        self.assertGreater(upper_bound(0, 1000), 0)
+
+    def test_all_survivors(self):
+        self.assertAlmostEqual(upper_bound(10, 10), 1.0)
+        self.assertAlmostEqual(upper_bound(1, 1), 1.0)
+
+    def test_bounds_observed_fraction(self):
+        for survivors in [0, 1, 10, 500, 999]:
+            bound = upper_bound(survivors, 1000)
+            self.assertGreater(bound, survivors / 1000.0)
+            self.assertLessEqual(bound, 1.0)
+
+    def test_monotonic(self):
+        bounds = [upper_bound(survivors, 100) for survivors in range(101)]
+        self.assertEqual(bounds, sorted(bounds))
+
+    def test_narrows_with_samples(self):
+        self.assertLess(upper_bound(0, 10000), upper_bound(0, 100))
+        self.assertLess(upper_bound(10, 1000), upper_bound(1, 100))
+
+    def test_confidence(self):
+        self.assertLess(upper_bound(5, 100, z=1.0), upper_bound(5, 100))
+
+
+class ReservoirTest(unittest.TestCase):
+
+    def test_keeps_everything_until_full(self):
+        reservoir = Reservoir(10, random.Random(0))
+        reservoir.add('a', ['1', '2', '3'])
+        reservoir.add('b', ['4'])
+        reservoir.add('b', [])
+        self.assertEqual(reservoir.items, [('a', '1'), ('a', '2'),
+                                           ('a', '3'), ('b', '4')])
+        self.assertEqual(reservoir.seen, 4)
+
+    def test_size(self):
+        reservoir = Reservoir(10, random.Random(0))
+        for page in range(100):
+            reservoir.add('c', [str(page * 100 + index)
+                                for index in range(100)])
+        self.assertEqual(len(reservoir.items), 10)
+        self.assertEqual(len(set(reservoir.items)), 10)
+        self.assertEqual(reservoir.seen, 10000)
+
+    def test_uniform(self):
+        # Every item should be kept size / items of the time, whatever the
+        # page it arrived in
+        rng = random.Random(1)
+        items, size, trials = 100, 10, 2000
+        counts = [0] * items
+        for _ in range(trials):
+            reservoir = Reservoir(size, rng)
+            start = 0
+            while start < items:
+                end = min(items, start + rng.randint(1, 30))
+                reservoir.add('c', list(range(start, end)))
+                start = end
+            for _, item in reservoir.items:
+                counts[item] += 1
+
+        expected = trials * size / float(items)
+        # About 4.5 standard deviations
+        for count in counts:
+            self.assertLess(abs(count - expected), 60)
+
+        # Early items aren't favoured over late ones
+        first, last = sum(counts[:items // 2]), sum(counts[items // 2:])
+        self.assertLess(abs(first - last), 0.05 * trials * size)
+
+
+class AuditTest(unittest.TestCase):
+
+    def test_listed(self):
+        audit = Audit()
+        audit.listed('a', ['1', '2'])
+        audit.listed('a', ['3'])
+        record = audit.container('a')
+        self.assertEqual(record.listed, 3)
+        self.assertIsNotNone(record.started)
+        self.assertIsNone(audit.sample)
+
+    def test_sample(self):
+        audit = Audit(samples=5)
+        audit.listed('a', ['1', '2', '3'])
+        self.assertEqual(audit.sample.items, [('a', '1'), ('a', '2'),
+                                              ('a', '3')])
+
+    def test_failures(self):
+        audit = Audit()
+        for index in range(MAX_FAILURES_REPORTED + 5):
+            audit.record_failure('a', str(index), Exception('503'))
+        audit.record_failure('b', 'x', 'denied')
+
+        containers, failures = audit.report()
+        self.assertEqual(audit.failed, MAX_FAILURES_REPORTED + 6)
+        self.assertEqual(containers['a']['failed'], MAX_FAILURES_REPORTED + 5)
+        self.assertEqual(containers['b']['failed'], 1)
+        self.assertEqual(len(failures), MAX_FAILURES_REPORTED)
+        self.assertEqual(failures[0], dict(container='a', object='0',
+                                           error='503'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+"""test_containercache.py: Tests of the container metadata cache."""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+import unittest
+from containercache import ContainerCache, ContainerInfo
+
+
+class ContainerCacheTest(unittest.TestCase):
+
+    def test_least_recently_used_are_evicted(self):
+        cache = ContainerCache(2)
+        cache.put(ContainerInfo('a'))
+        cache.put(ContainerInfo('b'))
+        cache.get('a')
+        cache.put(ContainerInfo('c'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(sorted(cache.items), ['a', 'c'])
+
+    def test_put_replaces(self):
+        cache = ContainerCache(2)
+        cache.put(ContainerInfo('a', object_count=1))
+        cache.put(ContainerInfo('b'))
+        cache.put(ContainerInfo('a', object_count=2))
+        cache.put(ContainerInfo('c'))
+        self.assertEqual(cache.get('a').object_count, 2)
+        self.assertIsNone(cache.get('b'))
+
+    def test_pop(self):
+        cache = ContainerCache()
+        cache.put(ContainerInfo('a'))
+        cache.pop('a')
+        cache.pop('missing')
+        self.assertIsNone(cache.get('a'))
+
+    def test_load(self):
+        cache = ContainerCache()
+        loaded = list()
+
+        def loader(name):
+            loaded.append(name)
+            return ContainerInfo(name, object_count=len(name))
+
+        self.assertEqual(cache.load('abc', loader).object_count, 3)
+        self.assertEqual(cache.load('abc', loader).object_count, 3)
+        self.assertEqual(loaded, ['abc'])
+
+    def test_prefetch(self):
+        cache = ContainerCache(3)
+        cache.put(ContainerInfo('a', object_count=1))
+        loaded = list()
+
+        def loader(name):
+            loaded.append(name)
+            if name == 'b':
+                raise IOError('denied')
+            return ContainerInfo(name, object_count=10)
+
+        errors = cache.prefetch(['a', 'b', 'c', 'd'], loader, 4)
+        self.assertEqual(errors, ['denied'])
+        # Cached containers aren't fetched again and those beyond the size
+        # of the cache aren't fetched at all
+        self.assertEqual(sorted(loaded), ['b', 'c'])
+        self.assertEqual(cache.get('a').object_count, 1)
+        # Failures are cached without metadata
+        self.assertIsNone(cache.get('b').object_count)
+        self.assertEqual(cache.get('c').object_count, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
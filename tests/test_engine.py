@@ -0,0 +1,290 @@
+"""test_engine.py: Runs the deleter end to end against the in-memory store.
+
+The fake store answers instantly, so whole runs take milliseconds.
+"""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from benchmarks.fakestore import Container, Latency, SimulatedError, \
+    Store
+from deletejob import DeleteJob
+from settings import Settings
+from threadeddeleter import DeleteError, ThreadedDeleter
+
+
+def fake_store(containers=4, objects=250, **kwargs):
+    """
+    Builds a fake store of equally sized containers
+    :param containers: The number of containers
+    :param objects: The number of objects in every container
+    :param kwargs: Arguments for the Store
+    :return: A Store
+    """
+    kwargs.setdefault('bulk_size', 10)
+    kwargs.setdefault('page_size', 50)
+    return Store([Container('c{}'.format(index), objects)
+                  for index in range(containers)], **kwargs)
+
+
+def run(store, prefixes=None, **kwargs):
+    """
+    Runs a deletion over the containers of a store
+    :param store: The Store
+    :param prefixes: The container prefixes to delete. Defaults to all.
+    :param kwargs: Settings to override
+    :return: The deleter, once it's done
+    """
+    kwargs.setdefault('max_threads', 4)
+    kwargs.setdefault('list_threads', 2)
+    deleter = ThreadedDeleter(store, Settings(verbose=False,
+                                              handle_signals=False, **kwargs))
+    with deleter:
+        deleter.delete(prefixes or [])
+    return deleter
+
+
+class FailingStore(Store):
+    """A fake store that fails to delete the objects of some containers"""
+
+    failing = ['c1']
+
+    def delete_objects_bulk(self, local):
+        for container in self.failing:
+            for object_ in local.data.pop(container, []):
+                self.delete_failed(local, container, object_,
+                                   SimulatedError('403 Access Denied'))
+        Store.delete_objects_bulk(self, local)
+
+
+class EngineTest(unittest.TestCase):
+
+    def test_deletes_everything(self):
+        for prefetch in [0, 1, 3]:
+            store = fake_store()
+            deleter = run(store, list_prefetch=prefetch)
+            self.assertEqual(store.remaining(), 0)
+            self.assertEqual(deleter.deleted_objects, 1000)
+            self.assertEqual(deleter.containers_deleted, 4)
+
+    def test_memory_budget(self):
+        store = fake_store()
+        run(store, memory_budget=4096, queue_size=20)
+        self.assertEqual(store.remaining(), 0)
+
+    def test_lister_failure_fails_run(self):
+        class BrokenStore(Store):
+            def list_objects(self, container_name, retry=2):
+                # Other listing threads take the containers while the
+                # main thread's listing is slow
+                if threading.current_thread().name in ['MainThread',
+                                                       'Prefetch-0']:
+                    time.sleep(0.01)
+                elif container_name != 'c0':
+                    raise RuntimeError('boom')
+                return Store.list_objects(self, container_name, retry)
+
+            def delete_container(self, container, retry=2):
+                raise AssertionError('Deleted {}'.format(container))
+
+        for prefetch in [0, 1]:
+            store = BrokenStore([Container('c{}'.format(index), 100)
+                                 for index in range(4)], page_size=10)
+            self.assertRaises(DeleteError, run, store, list_threads=4,
+                              list_prefetch=prefetch)
+
+    def test_prefixes(self):
+        store = Store([Container('keep', 10), Container('tmp-1', 10)])
+        run(store, ['tmp-'])
+        self.assertEqual(store.containers['keep'].remaining, 10)
+        self.assertEqual(store.containers['tmp-1'].remaining, 0)
+
+
+class AuditTest(unittest.TestCase):
+
+    def test_failed_deletes_are_audited(self):
+        store = FailingStore([Container('c{}'.format(index), 100)
+                              for index in range(3)], bulk_size=10,
+                             page_size=30)
+        deleter = run(store, verify='full')
+        report = deleter.audit_report()
+
+        self.assertEqual(report['failed_objects'], 100)
+        self.assertEqual(report['deleted_objects'], 200)
+        self.assertEqual(report['containers']['c1']['failed'], 100)
+        self.assertEqual(report['failures'][0]['error'],
+                         '403 Access Denied')
+        self.assertFalse(report['verification']['verified'])
+        self.assertEqual(report['verification']['remaining_objects'], 100)
+        self.assertEqual(report['containers']['c1']['remaining'], 100)
+
+    def test_sampled_verification(self):
+        store = fake_store()
+        deleter = run(store, verify='sample', verify_samples=100)
+        verification = deleter.audit_report()['verification']
+        self.assertEqual(verification['mode'], 'sample')
+        self.assertEqual(verification['checked'], 100)
+        self.assertTrue(verification['verified'])
+
+    def test_sampling_needs_object_checks(self):
+        store = fake_store()
+        store.can_check_objects = False
+        deleter = run(store, verify='sample', verify_samples=100)
+        verification = deleter.audit_report()['verification']
+        self.assertEqual(verification['mode'], 'full')
+        self.assertTrue(verification['verified'])
+
+
+class StopTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.checkpoint_file = os.path.join(directory, 'checkpoint')
+
+    def test_buffered_objects_are_checkpointed(self):
+        class StoppingStore(Store):
+            def list_objects(self, container_name, retry=2):
+                # Stop once the first page is queued
+                if self.deleter.deleted_objects > 0:
+                    self.deleter.stop()
+                return Store.list_objects(self, container_name, retry)
+
+        # Buffers never fill and flushing them would take 30 seconds
+        store = StoppingStore([Container('c0', 200)], bulk_size=1000,
+                              page_size=50,
+                              delete_latency=Latency('constant', 30))
+        deleter = ThreadedDeleter(store, Settings(
+            verbose=False, handle_signals=False, max_threads=4,
+            list_prefetch=0, drain_timeout=0,
+            checkpoint_file=self.checkpoint_file))
+        store.deleter = deleter
+        start = time.time()
+        with deleter:
+            deleter.delete([])
+
+        self.assertLess(time.time() - start, 10)
+        self.assertEqual(store.remaining(), 200)
+        self.assertEqual(deleter.deleted_objects, 0)
+        with open(self.checkpoint_file) as f:
+            objects = [object_ for line in f
+                       for object_ in json.loads(line)['objects']]
+        listed = deleter.audit.container('c0').listed
+        self.assertGreater(listed, 0)
+        self.assertEqual(sorted(objects),
+                         [store.containers['c0'].name_of(index)
+                          for index in range(listed)])
+
+        # The next run deletes them first
+        store.delete_latency = Latency()
+        store.deleter = run(store, checkpoint_file=self.checkpoint_file)
+        self.assertEqual(store.remaining(), 0)
+        self.assertFalse(os.path.exists(self.checkpoint_file))
+
+
+class IncrementalTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.state_file = os.path.join(directory, 'state.json')
+
+    def test_containers_are_kept(self):
+        store = fake_store()
+        deleter = run(store, state_file=self.state_file)
+        self.assertEqual(store.remaining(), 0)
+        self.assertEqual(deleter.containers_deleted, 0)
+        with open(self.state_file) as f:
+            self.assertEqual(sorted(json.load(f)['containers']),
+                             ['c0', 'c1', 'c2', 'c3'])
+
+    def test_marker(self):
+        store = Store([Container('c0', 100)], page_size=30)
+        run(store, state_file=self.state_file, incremental_marker=True)
+
+        # Keys written after the last run sort after its marker
+        store.containers['c0'] = Container('c0', 150)
+        for index in range(100):
+            store.containers['c0'].deleted[index] = 1
+        store.containers['c0'].remaining = 50
+        deleter = run(store, state_file=self.state_file,
+                      incremental_marker=True)
+        self.assertEqual(store.remaining(), 0)
+        self.assertEqual(deleter.audit.container('c0').listed, 50)
+
+    def test_failed_containers_are_retried(self):
+        store = FailingStore([Container('c{}'.format(index), 100)
+                              for index in range(2)], bulk_size=10)
+        run(store, state_file=self.state_file, incremental_marker=True)
+        self.assertEqual(store.remaining(), 100)
+
+        store.failing = []
+        run(store, state_file=self.state_file, incremental_marker=True)
+        self.assertEqual(store.remaining(), 0)
+
+
+class DeleteJobTest(unittest.TestCase):
+
+    def test_run(self):
+        store = fake_store()
+        progress = list()
+        job = DeleteJob(store, max_threads=4,
+                        on_progress=lambda job, update:
+                        progress.append(update))
+        result = job.run()
+        self.assertEqual(result['deleted_objects'], 1000)
+        self.assertEqual(store.remaining(), 0)
+        self.assertGreater(len(progress), 0)
+        self.assertEqual(job.report()['failed_objects'], 0)
+
+    def test_settings_are_copied(self):
+        settings = Settings(verbose=False)
+        job = DeleteJob(fake_store(), settings=settings, max_threads=4)
+        job.run()
+        self.assertTrue(settings.handle_signals)
+        self.assertEqual(settings.max_threads, 64)
+        self.assertFalse(job.settings.handle_signals)
+
+    def test_concurrent_jobs_share_a_store(self):
+        store = fake_store(containers=0)
+        store.containers = dict(
+            ('{}{}'.format(prefix, index), Container(
+                '{}{}'.format(prefix, index), 100))
+            for prefix in ['a', 'b'] for index in range(3))
+        jobs = [DeleteJob(store, prefixes=[prefix], max_threads=4)
+                for prefix in ['a', 'b']]
+        futures = [job.start() for job in jobs]
+        for future in futures:
+            self.assertEqual(future.result(30)['deleted_objects'], 300)
+        self.assertEqual(store.remaining(), 0)
+
+    def test_cancel(self):
+        job = DeleteJob(fake_store(), max_threads=4)
+        job.cancel()
+        result = job.run()
+        self.assertTrue(result['stopped'])
+
+    def test_stopped_jobs_leave_other_listings_alone(self):
+        store = Store([Container('a0', 100), Container('b0', 100)],
+                      page_size=10)
+        # Another job is part way through listing b0
+        self.assertEqual(len(store.list_objects('b0')), 10)
+
+        job = DeleteJob(store, prefixes=['a'], max_threads=4)
+        job.cancel()
+        job.run()
+        self.assertEqual(store.list_objects('b0')[0],
+                         store.containers['b0'].name_of(10))
+
+
+if __name__ == '__main__':
+    unittest.main()
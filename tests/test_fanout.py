@@ -0,0 +1,136 @@
+"""test_fanout.py: Tests of runs spread over several stores."""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+import threading
+import unittest
+from audit import Audit
+from benchmarks.fakestore import Container, SimulatedError
+from benchmarks.fakestore import Store as FakeStore
+from stores import fanout
+from tests.test_engine import run
+try:
+    from configparser import ConfigParser
+except ImportError:
+    from ConfigParser import ConfigParser
+
+
+class DenyingStore(FakeStore):
+    """A fake store that fails to delete anything"""
+
+    def delete_objects_bulk(self, local):
+        for container, objects in local.data.items():
+            for object_ in objects:
+                self.delete_failed(local, container, object_,
+                                   SimulatedError('403 Access Denied'))
+        local.data = dict()
+        local.size = 0
+
+
+def fanout_store(**targets):
+    """
+    Builds a fan-out store over the given stores
+    :param targets: The stores by target name
+    :return: A fanout Store
+    """
+    # The constructor loads targets from the config
+    store = fanout.Store.__new__(fanout.Store)
+    store.targets = targets
+    store.order = sorted(targets)
+    return store
+
+
+class FanoutTest(unittest.TestCase):
+
+    def test_names(self):
+        a = FakeStore([Container('logs', 1), Container('tmp', 1)])
+        b = FakeStore([Container('logs', 1)])
+        store = fanout_store(a=a, b=b)
+        self.assertEqual(store.list_containers(['logs']),
+                         ['a/logs', 'b/logs'])
+        self.assertEqual(store.split('b/logs'), (b, 'logs'))
+        # Only the first separator splits
+        self.assertEqual(store.split('a/logs/2015'), (a, 'logs/2015'))
+
+    def test_run(self):
+        a = FakeStore([Container('c0', 100), Container('c1', 50)],
+                      bulk_size=10)
+        b = FakeStore([Container('c0', 100)], bulk_size=10)
+        run(fanout_store(a=a, b=b))
+        self.assertEqual(a.remaining() + b.remaining(), 0)
+
+    def test_failures_are_audited_by_target(self):
+        a = FakeStore([Container('c0', 20)], bulk_size=10)
+        b = DenyingStore([Container('c0', 30)], bulk_size=10)
+        report = run(fanout_store(a=a, b=b)).audit_report()
+        self.assertEqual(report['failed_objects'], 30)
+        self.assertEqual(report['containers']['b/c0']['failed'], 30)
+        self.assertEqual(report['containers']['a/c0']['failed'], 0)
+        self.assertEqual(set(failure['container']
+                             for failure in report['failures']), set(['b/c0']))
+
+    def test_reset_listing(self):
+        a = FakeStore([Container('c0', 10), Container('c1', 10)], page_size=5)
+        b = FakeStore([Container('c0', 10)], page_size=5)
+        store = fanout_store(a=a, b=b)
+        for container in ['a/c0', 'a/c1', 'b/c0']:
+            store.list_objects(container)
+        store.reset_listing(['a/c0', 'b/c0'])
+        self.assertEqual(sorted(a.marker), ['c1'])
+        self.assertEqual(b.marker, dict())
+
+    def test_target_audit(self):
+        audit = Audit()
+        fanout.TargetAudit(audit, 'b').record_failure('c0', 'key', 'denied')
+        containers, failures = audit.report()
+        self.assertEqual(list(containers), ['b/c0'])
+        self.assertEqual(failures, [dict(container='b/c0', object='key',
+                                         error='denied')])
+
+    def test_take_buffered(self):
+        a = FakeStore([Container('c0', 1)], bulk_size=10)
+        b = FakeStore([Container('c0', 1)], bulk_size=10)
+        store = fanout_store(a=a, b=b)
+        local = threading.local()
+        store.init_thread(local)
+        store.delete_object('a/c0', 'x', local)
+        store.delete_object('b/c0', 'y', local)
+        self.assertEqual(sorted(store.take_buffered(local)),
+                         [('a/c0', 'x'), ('b/c0', 'y')])
+        self.assertEqual(store.take_buffered(local), [])
+
+    def test_can_check_objects(self):
+        a = FakeStore([Container('c0', 10)], bulk_size=10)
+        b = FakeStore([Container('c0', 10)], bulk_size=10)
+        store = fanout_store(a=a, b=b)
+        self.assertTrue(store.can_check_objects)
+        report = run(store, verify='sample').audit_report()
+        self.assertEqual(report['verification']['mode'], 'sample')
+
+        # Sampling needs every target to check objects
+        b.can_check_objects = False
+        self.assertFalse(store.can_check_objects)
+
+    def test_config(self):
+        for targets, error in [('', 'No targets specified'),
+                               ('fanout', 'Fan-out targets can\'t fan out'),
+                               ('s3:a, s3:a', 'Duplicate target: a')]:
+            parser = ConfigParser()
+            parser.add_section('fanout')
+            parser.set('fanout', 'targets', targets)
+            parser.add_section('a')
+            for option, value in [('access_key_id', 'key'),
+                                  ('access_key_secret', 'secret'),
+                                  ('region', 'us-east-1'),
+                                  ('page_size', '1000')]:
+                parser.set('a', option, value)
+            with self.assertRaises(Exception) as context:
+                fanout.Store(parser)
+            self.assertEqual(str(context.exception), error)
+
+
+if __name__ == '__main__':
+    unittest.main()
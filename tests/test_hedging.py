@@ -0,0 +1,135 @@
+"""test_hedging.py: Tests of hedged requests."""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+import threading
+import unittest
+from stores.hedging import Hedger
+
+
+def warm(hedger, operation='op', latency=0.01):
+    """
+    Records enough samples for an operation to be hedged
+    :param hedger: The Hedger
+    :param operation: The name of the operation
+    :param latency: The latency of every sample
+    :return: None
+    """
+    for _ in range(hedger.min_samples):
+        hedger.record(operation, latency)
+
+
+class HedgerTest(unittest.TestCase):
+
+    def test_disabled(self):
+        hedger = Hedger()
+        warm(hedger)
+        self.assertEqual(hedger.call('op', lambda attempt, value:
+                                     (attempt, value), 'x'), (0, 'x'))
+        self.assertEqual(hedger.hedged, 0)
+
+    def test_delay(self):
+        hedger = Hedger(True, quantile=0.5, min_samples=10)
+        for latency in range(9):
+            hedger.record('op', latency)
+        self.assertIsNone(hedger.delay('op'))
+        hedger.record('op', 9)
+        self.assertEqual(hedger.delay('op'), 4)
+        self.assertIsNone(hedger.delay('other'))
+
+    def test_delay_is_recomputed_every_min_samples(self):
+        hedger = Hedger(True, quantile=0.0, min_samples=10)
+        warm(hedger, latency=1.0)
+        self.assertEqual(hedger.delay('op'), 1.0)
+        for _ in range(9):
+            hedger.record('op', 0.5)
+        self.assertEqual(hedger.delay('op'), 1.0)
+        hedger.record('op', 0.5)
+        self.assertEqual(hedger.delay('op'), 0.5)
+
+    def test_fast_calls_are_not_hedged(self):
+        hedger = Hedger(True)
+        warm(hedger, latency=1.0)
+        attempts = list()
+        self.assertEqual(hedger.call('op', lambda attempt:
+                                     attempts.append(attempt) or 'ok'), 'ok')
+        self.assertEqual(attempts, [0])
+        self.assertEqual(hedger.hedged, 0)
+
+    def test_slow_calls_are_hedged(self):
+        hedger = Hedger(True)
+        warm(hedger)
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def function(attempt):
+            if attempt == 0:
+                release.wait(5)
+            return attempt
+
+        self.assertEqual(hedger.call('op', function), 1)
+        self.assertEqual(hedger.hedged, 1)
+
+    def test_failed_attempt_waits_for_the_other(self):
+        hedger = Hedger(True)
+        warm(hedger)
+        hedge = threading.Event()
+
+        def function(attempt):
+            if attempt == 0:
+                hedge.wait(5)
+                raise IOError('reset')
+            hedge.set()
+            return 'ok'
+
+        self.assertEqual(hedger.call('op', function), 'ok')
+
+    def test_all_attempts_failed(self):
+        hedger = Hedger(True)
+        warm(hedger, latency=0.0)
+
+        def function(attempt):
+            raise IOError('attempt {}'.format(attempt))
+
+        self.assertRaises(IOError, hedger.call, 'op', function)
+
+    def test_reserve_grows_the_pool(self):
+        hedger = Hedger(True, workers=4)
+        warm(hedger, latency=1.0)
+        hedger.call('op', lambda attempt: None)
+        self.assertEqual(hedger.pool_size, 4)
+        hedger.reserve(10)
+        hedger.call('op', lambda attempt: None)
+        self.assertEqual(hedger.pool_size, 20)
+        hedger.release(10)
+        self.assertEqual(hedger.callers, 0)
+
+    def test_reserve_during_a_call(self):
+        # Another run starting on the same store mustn't break the hedges of
+        # calls already waiting on their delay
+        hedger = Hedger(True, workers=2)
+        warm(hedger, latency=0.1)
+        started = threading.Event()
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def function(attempt):
+            if attempt == 0:
+                started.set()
+                release.wait(5)
+            return attempt
+
+        def reserve():
+            started.wait(5)
+            hedger.reserve(100)
+
+        threading.Thread(target=reserve).start()
+        self.assertEqual(hedger.call('op', function), 1)
+        self.assertEqual(hedger.pool_size, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+"""test_incremental.py: Tests of the state kept between incremental runs."""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from incremental import CLOCK_SKEW, IncrementalState, timestamp
+
+
+class TimestampTest(unittest.TestCase):
+
+    def test_datetime(self):
+        self.assertEqual(timestamp(datetime.datetime(1970, 1, 2)), 86400)
+        self.assertEqual(timestamp(datetime.datetime(1970, 1, 1, 0, 0, 1,
+                                                     500000)), 1.5)
+
+    def test_iso_string(self):
+        # Swift reports microseconds, Cloud Files may not
+        self.assertEqual(timestamp('1970-01-02T00:00:00.000000'), 86400)
+        self.assertEqual(timestamp('1970-01-02T00:00:00'), 86400)
+        self.assertEqual(timestamp('2015-06-01T12:00:00Z'),
+                         timestamp(datetime.datetime(2015, 6, 1, 12)))
+
+
+class IncrementalStateTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'state.json')
+
+    def test_new(self):
+        state = IncrementalState(self.path)
+        self.assertIsNone(state.marker('c'))
+        self.assertIsNone(state.modified_since('c'))
+
+    def test_round_trip(self):
+        state = IncrementalState(self.path)
+        state.update('c', 'key-9', 10000.0)
+        state.update('d', None, 20000.0)
+        state.save()
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+
+        state = IncrementalState(self.path)
+        self.assertEqual(state.marker('c'), 'key-9')
+        self.assertIsNone(state.marker('d'))
+        self.assertEqual(state.modified_since('c'), 10000.0 - CLOCK_SKEW)
+        self.assertEqual(state.modified_since('d'), 20000.0 - CLOCK_SKEW)
+
+    def test_corrupt(self):
+        with open(self.path, 'w') as f:
+            f.write('{')
+        self.assertRaises(ValueError, IncrementalState, self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+"""test_memory.py: Tests of the packed, bounded deletion queue."""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+import threading
+import time
+import unittest
+from memory import BATCH_OVERHEAD, BoundedQueue, ContainerTable, KeyBatch
+try:
+    import queue as Queue
+except ImportError:
+    import Queue
+
+
+class KeyBatchTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        keys = ['a', '', 'logs/2015/06/01/access.log', u'caf\u00e9/\u2603',
+                'x' * 1024]
+        batch = KeyBatch(3, keys)
+        self.assertEqual(list(batch), keys)
+        self.assertEqual(len(batch), len(keys))
+        self.assertEqual(batch.container, 3)
+
+    def test_round_trip_twice(self):
+        batch = KeyBatch(0, ['one', 'two'])
+        self.assertEqual(list(batch), list(batch))
+
+    def test_empty(self):
+        batch = KeyBatch(0, [])
+        self.assertEqual(list(batch), [])
+        self.assertEqual(len(batch), 0)
+        self.assertEqual(batch.nbytes, BATCH_OVERHEAD)
+
+    def test_nbytes_counts_encoded_keys(self):
+        # Two bytes of length prefix for every key
+        batch = KeyBatch(0, ['ab', u'\u00e9'])
+        self.assertEqual(batch.nbytes, 2 + 2 + 2 + 2 + BATCH_OVERHEAD)
+
+
+class ContainerTableTest(unittest.TestCase):
+
+    def test_ids(self):
+        table = ContainerTable()
+        self.assertEqual(table.id('a'), 0)
+        self.assertEqual(table.id('b'), 1)
+        self.assertEqual(table.id('a'), 0)
+        self.assertEqual(table.name(1), 'b')
+
+
+class BoundedQueueTest(unittest.TestCase):
+
+    @staticmethod
+    def batch(keys):
+        return KeyBatch(0, ['key-{}'.format(index) for index in range(keys)])
+
+    def test_max_keys(self):
+        queue = BoundedQueue(max_keys=10)
+        queue.put(self.batch(6), False)
+        queue.put(self.batch(4), False)
+        self.assertTrue(queue.full())
+        self.assertRaises(Queue.Full, queue.put, self.batch(1), False)
+        self.assertRaises(Queue.Full, queue.put, self.batch(1), True, 0.01)
+
+        queue.get(False)
+        self.assertFalse(queue.full())
+        queue.put(self.batch(6), False)
+        self.assertEqual(queue.keys, 10)
+
+    def test_max_bytes(self):
+        batch = self.batch(10)
+        queue = BoundedQueue(max_bytes=2 * batch.nbytes)
+        queue.put(batch, False)
+        queue.put(self.batch(10), False)
+        self.assertTrue(queue.full())
+        self.assertRaises(Queue.Full, queue.put, self.batch(1), False)
+        self.assertEqual(queue.bytes, 2 * batch.nbytes)
+
+    def test_oversized_batch_fits_empty_queue(self):
+        queue = BoundedQueue(max_keys=5, max_bytes=10)
+        queue.put(self.batch(100), False)
+        self.assertEqual(queue.qsize(), 1)
+        self.assertRaises(Queue.Full, queue.put, self.batch(1), False)
+
+    def test_unbounded(self):
+        queue = BoundedQueue()
+        for _ in range(100):
+            queue.put(self.batch(1000), False)
+        self.assertFalse(queue.full())
+
+    def test_fifo(self):
+        queue = BoundedQueue()
+        first, second = self.batch(1), self.batch(2)
+        queue.put(first)
+        queue.put(second)
+        self.assertIs(queue.get(), first)
+        self.assertIs(queue.get(), second)
+        self.assertEqual(queue.qsize(), 0)
+        self.assertEqual(queue.keys, 0)
+        self.assertEqual(queue.bytes, 0)
+
+    def test_get_empty(self):
+        queue = BoundedQueue()
+        self.assertRaises(Queue.Empty, queue.get, False)
+        start = time.time()
+        self.assertRaises(Queue.Empty, queue.get, True, 0.05)
+        self.assertGreaterEqual(time.time() - start, 0.04)
+
+    def test_get_wakes_blocked_put(self):
+        queue = BoundedQueue(max_keys=1)
+        queue.put(self.batch(1))
+        thread = threading.Thread(target=queue.put, args=[self.batch(1)])
+        thread.start()
+        queue.get()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(queue.qsize(), 1)
+
+    def test_close_wakes_waiting_threads(self):
+        queue = BoundedQueue(max_keys=1)
+        full = BoundedQueue(max_keys=1)
+        full.put(self.batch(1))
+        errors = list()
+
+        def get():
+            try:
+                queue.get()
+            except Queue.Empty:
+                errors.append('get')
+
+        def put():
+            try:
+                full.put(self.batch(1))
+            except Queue.Full:
+                errors.append('put')
+
+        threads = [threading.Thread(target=get), threading.Thread(target=put)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        queue.close()
+        full.close()
+        for thread in threads:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(sorted(errors), ['get', 'put'])
+
+    def test_closed_queue_fails_immediately(self):
+        queue = BoundedQueue()
+        queue.put(self.batch(1))
+        queue.close()
+        self.assertRaises(Queue.Full, queue.put, self.batch(1))
+        self.assertRaises(Queue.Empty, queue.get)
+
+    def test_join(self):
+        queue = BoundedQueue()
+        queue.put(self.batch(5))
+        queue.put(self.batch(5))
+        self.assertFalse(queue.join(5, timeout=0.01))
+        self.assertTrue(queue.join(10, timeout=0.01))
+
+        thread = threading.Thread(target=queue.get)
+        thread.start()
+        self.assertTrue(queue.join(5, timeout=5))
+        thread.join()
+
+    def test_join_returns_once_closed(self):
+        queue = BoundedQueue()
+        queue.put(self.batch(5))
+        threading.Timer(0.05, queue.close).start()
+        self.assertFalse(queue.join(0, timeout=5))
+
+    def test_drain(self):
+        queue = BoundedQueue(max_keys=10)
+        batches = [self.batch(5), self.batch(5)]
+        for batch in batches:
+            queue.put(batch)
+        self.assertEqual(queue.drain(), batches)
+        self.assertEqual(queue.qsize(), 0)
+        self.assertEqual(queue.keys, 0)
+        self.assertEqual(queue.bytes, 0)
+        queue.put(self.batch(10), False)
+
+
+if __name__ == '__main__':
+    unittest.main()
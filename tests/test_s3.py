@@ -0,0 +1,403 @@
+"""test_s3.py: Tests of the S3 stores against a stubbed client."""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+import threading
+import unittest
+from containercache import ContainerCache, ContainerInfo
+from stores import s3, s3compat
+try:
+    from configparser import ConfigParser
+except ImportError:
+    from ConfigParser import ConfigParser
+
+
+class Service:
+    """The buckets of a stub S3 service, shared by the clients of every
+    region"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = dict()
+        self.regions = dict()
+        self.denied = set()
+        self.calls = list()
+
+    def add(self, bucket, keys, region='us-east-1', modified=0.0):
+        """
+        Adds a bucket, or keys to one
+        :param bucket: The name of the bucket
+        :param keys: A list of keys
+        :param region: The region of the bucket
+        :param modified: When the keys were last modified, in seconds since
+         the epoch
+        :return: None
+        """
+        import datetime
+
+        self.regions[bucket] = region
+        objects = self.buckets.setdefault(bucket, dict())
+        for key in keys:
+            objects[key] = dict(
+                Key=key, Size=len(key),
+                LastModified=datetime.datetime.utcfromtimestamp(modified))
+
+
+class Client:
+    """A stub boto3 S3 client of a single region"""
+
+    def __init__(self, service, region):
+        self.service = service
+        self.region = region
+
+    def call(self, method, bucket):
+        self.service.calls.append((method, self.region, bucket))
+        if (method, bucket) in self.service.denied:
+            raise Exception('AccessDenied')
+
+    def get_bucket_location(self, Bucket):
+        self.call('get_bucket_location', Bucket)
+        region = self.service.regions[Bucket]
+        return dict(LocationConstraint=None if region == 'us-east-1'
+                    else region)
+
+    def list_objects_v2(self, Bucket, MaxKeys=1000, ContinuationToken=None,
+                        StartAfter=None, Prefix=''):
+        self.call('list_objects_v2', Bucket)
+        keys = sorted(key for key in self.service.buckets[Bucket]
+                      if key.startswith(Prefix) and
+                      key > (ContinuationToken or StartAfter or ''))
+        page = [self.service.buckets[Bucket][key] for key in keys[:MaxKeys]]
+        response = dict(KeyCount=len(page),
+                        IsTruncated=len(keys) > MaxKeys)
+        if len(page) > 0:
+            response['Contents'] = page
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]['Key']
+        return response
+
+    def delete_objects(self, Bucket, Delete):
+        self.call('delete_objects', Bucket)
+        errors = list()
+        with self.service.lock:
+            for entry in Delete['Objects']:
+                if entry['Key'].startswith('locked'):
+                    errors.append(dict(Key=entry['Key'], Code='AccessDenied',
+                                       Message='Access Denied'))
+                else:
+                    self.service.buckets[Bucket].pop(entry['Key'], None)
+        return dict(Errors=errors) if len(errors) > 0 else dict()
+
+
+class Buckets:
+    """The bucket collection of a stub resource"""
+
+    def __init__(self, service):
+        self.service = service
+
+    def filter(self, Prefix=None):
+        class Bucket:
+            def __init__(self, name):
+                self.name = name
+
+        return [Bucket(name) for name in sorted(self.service.buckets)
+                if name.startswith(Prefix or '')]
+
+
+class Resource:
+    """A stub boto3 S3 resource"""
+
+    def __init__(self, client):
+        self.client = client
+        self.buckets = Buckets(client.service)
+
+    def Bucket(self, name):
+        resource = self
+
+        class Bucket:
+            def delete(self):
+                resource.client.call('delete_bucket', name)
+                with resource.client.service.lock:
+                    if len(resource.client.service.buckets[name]) > 0:
+                        raise Exception('BucketNotEmpty')
+                    del resource.client.service.buckets[name]
+
+        return Bucket()
+
+
+class StubbedStore:
+    """Connects the stores to a stub service instead of AWS"""
+
+    service = None
+
+    def connect_region(self, region):
+        client = Client(self.service, region)
+        return s3.Region(Resource(client), [client])
+
+
+class Store(StubbedStore, s3.Store):
+    pass
+
+
+class CompatStore(StubbedStore, s3compat.Store):
+    pass
+
+
+def stub_store(service, store_class=Store, section='s3', **options):
+    """
+    Builds a logged in store on a stub service
+    :param service: The Service
+    :param store_class: The class of the store
+    :param section: The config section of the store
+    :param options: Options to set in the config
+    :return: A store
+    """
+    parser = ConfigParser()
+    parser.add_section(section)
+    values = dict(access_key_id='key', access_key_secret='secret',
+                  region='us-west-2', page_size='1000', bulk_size='100',
+                  size_estimate='sample')
+    if store_class is CompatStore:
+        values['endpoint_url'] = 'https://minio.local'
+    values.update(options)
+    for option, value in values.items():
+        parser.set(section, option, value)
+
+    store = store_class(parser)
+    store.service = service
+    store.cache = ContainerCache()
+    assert store.login()
+    return store
+
+
+class RegionTest(unittest.TestCase):
+
+    def test_buckets_are_routed_to_their_region(self):
+        service = Service()
+        service.add('eu', ['a'], region='eu-west-1')
+        service.add('us', ['a'])
+        store = stub_store(service)
+
+        self.assertEqual(store.bucket_region('eu').clients[0].region,
+                         'eu-west-1')
+        self.assertEqual(store.bucket_region('us').clients[0].region,
+                         'us-east-1')
+        store.bucket_region('eu')
+        self.assertEqual([call for call in service.calls
+                          if call[0] == 'get_bucket_location'],
+                         [('get_bucket_location', 'us-west-2', 'eu'),
+                          ('get_bucket_location', 'us-west-2', 'us')])
+
+    def test_cache_misses_only_look_up_the_region(self):
+        service = Service()
+        service.add('eu', ['a'], region='eu-west-1')
+        store = stub_store(service)
+        store.bucket_region('eu')
+        self.assertEqual([call[0] for call in service.calls],
+                         ['get_bucket_location'])
+
+    def test_denied_location_uses_the_home_region(self):
+        service = Service()
+        service.add('eu', ['a'], region='eu-west-1')
+        service.denied.add(('get_bucket_location', 'eu'))
+        store = stub_store(service)
+        self.assertEqual(store.bucket_region('eu').clients[0].region,
+                         'us-west-2')
+        self.assertEqual(store.list_objects('eu'), ['a'])
+
+    def test_cached_region(self):
+        service = Service()
+        service.add('eu', ['a'], region='eu-west-1')
+        store = stub_store(service)
+        store.cache.put(ContainerInfo('eu', region='eu-west-1'))
+        self.assertEqual(store.bucket_region('eu').clients[0].region,
+                         'eu-west-1')
+
+        # Containers that failed to prefetch have no region
+        store.cache.put(ContainerInfo('eu'))
+        self.assertEqual(store.bucket_region('eu').clients[0].region,
+                         'eu-west-1')
+        self.assertEqual(len(service.calls), 1)
+
+    def test_container_info(self):
+        service = Service()
+        service.add('eu', ['a', 'b'], region='eu-west-1')
+        store = stub_store(service)
+        info = store.container_info('eu')
+        self.assertEqual(info.region, 'eu-west-1')
+        self.assertEqual(info.object_count, 2)
+
+    def test_compatible_stores_have_one_endpoint(self):
+        service = Service()
+        service.add('bucket', ['a', 'b'])
+        service.denied.add(('get_bucket_location', 'bucket'))
+        store = stub_store(service, CompatStore, 's3compat')
+
+        info = store.container_info('bucket')
+        self.assertEqual(info.object_count, 2)
+        self.assertEqual(store.list_objects('bucket'), ['a', 'b'])
+        self.assertNotIn('get_bucket_location',
+                         [call[0] for call in service.calls])
+
+
+class ListingTest(unittest.TestCase):
+
+    def store(self, keys, **options):
+        self.service = Service()
+        self.service.add('bucket', keys, modified=1000.0)
+        store = stub_store(self.service, **options)
+        # Small pages make every listing span several requests
+        store.max_keys = 2
+        return store
+
+    def test_pages(self):
+        keys = ['k{}'.format(index) for index in range(7)]
+        store = self.store(keys, page_size='3')
+        pages = list()
+        while True:
+            page = store.list_objects('bucket')
+            if len(page) == 0:
+                break
+            pages.append(page)
+        self.assertEqual(pages, [keys[:3], keys[3:6], keys[6:]])
+        self.assertEqual(store.marker, dict())
+        self.assertEqual(len([call for call in self.service.calls
+                              if call[0] == 'list_objects_v2']), 5)
+
+    def test_empty_bucket(self):
+        store = self.store([])
+        self.assertEqual(store.list_objects('bucket'), [])
+        self.assertEqual(store.marker, dict())
+
+        # The next listing asks again
+        self.service.add('bucket', ['new'])
+        self.assertEqual(store.list_objects('bucket'), ['new'])
+
+    def test_start_after(self):
+        store = self.store(['a', 'b', 'c', 'd'])
+        store.start_listing('bucket', start_after='b')
+        self.assertEqual(store.list_objects('bucket'), ['c', 'd'])
+        self.assertEqual(store.list_objects('bucket'), [])
+        self.assertEqual(store.start_after, dict())
+
+    def test_modified_since(self):
+        store = self.store(['a', 'b'])
+        self.service.add('bucket', ['c', 'd'], modified=2000.0)
+        store.start_listing('bucket', modified_since=1500.0)
+        self.assertEqual(store.list_objects('bucket'), ['c', 'd'])
+        self.assertEqual(store.list_objects('bucket'), [])
+        self.assertEqual(store.modified_since, dict())
+
+    def test_nothing_new_releases_the_listing(self):
+        # Night 1 finds nothing new. Night 2 reuses the store and must
+        # still see what was written since.
+        store = self.store(['old'])
+        store.start_listing('bucket', start_after='old',
+                            modified_since=1500.0)
+        self.assertEqual(store.list_objects('bucket'), [])
+        self.assertEqual((store.marker, store.start_after,
+                          store.modified_since), (dict(), dict(), dict()))
+
+        self.service.add('bucket', ['tomorrow'], modified=3000.0)
+        store.start_listing('bucket', start_after='old',
+                            modified_since=2500.0)
+        self.assertEqual(store.list_objects('bucket'), ['tomorrow'])
+
+        # Verifying lists the whole bucket again
+        self.assertEqual(store.list_objects('bucket'), [])
+        self.assertEqual(store.list_objects('bucket'), ['old', 'tomorrow'])
+
+    def test_reset_listing(self):
+        store = self.store(['a', 'b', 'c'], page_size='2')
+        self.service.add('other', ['x', 'y', 'z'])
+        store.list_objects('bucket')
+        store.list_objects('other')
+        store.reset_listing(['bucket'])
+        self.assertEqual(store.list_objects('bucket'), ['a', 'b'])
+        self.assertEqual(store.list_objects('other'), ['z'])
+
+
+class Metrics:
+    """A stub CloudWatch client"""
+
+    def __init__(self, values):
+        self.values = values
+
+    def get_metric_data(self, MetricDataQueries, StartTime, EndTime):
+        results = list()
+        for query in MetricDataQueries:
+            dimensions = dict((dimension['Name'], dimension['Value'])
+                              for dimension in
+                              query['MetricStat']['Metric']['Dimensions'])
+            value = self.values.get((query['MetricStat']['Metric']
+                                     ['MetricName'],
+                                     dimensions['StorageType']))
+            results.append(dict(Id=query['Id'], Values=[] if value is None
+                                else [value, 0.0]))
+        return dict(MetricDataResults=results)
+
+
+class SizeTest(unittest.TestCase):
+
+    def test_sample(self):
+        service = Service()
+        service.add('small', ['a', 'bb', 'ccc'])
+        service.add('large', ['k{}'.format(index) for index in range(5)])
+        store = stub_store(service)
+        store.max_keys = 3
+
+        info = store.container_info('small')
+        self.assertEqual((info.object_count, info.bytes), (3, 6))
+        # Only the first page of large buckets is listed
+        info = store.container_info('large')
+        self.assertEqual((info.object_count, info.bytes), (3, None))
+
+    def test_metrics(self):
+        service = Service()
+        service.add('bucket', ['a'])
+        store = stub_store(service, size_estimate='metrics')
+        store.metrics_client = lambda region: Metrics({
+            ('NumberOfObjects', 'AllStorageTypes'): 30.0,
+            ('BucketSizeBytes', 'StandardStorage'): 1000.0,
+            ('BucketSizeBytes', 'GlacierStorage'): 24.0})
+
+        info = store.container_info('bucket')
+        self.assertEqual((info.object_count, info.bytes), (30, 1024))
+        self.assertEqual(service.calls, [('get_bucket_location',
+                                          'us-west-2', 'bucket')])
+
+    def test_no_metrics(self):
+        service = Service()
+        service.add('bucket', ['a', 'b'])
+        store = stub_store(service, size_estimate='metrics')
+        store.metrics_client = lambda region: Metrics(dict())
+        info = store.container_info('bucket')
+        self.assertEqual((info.object_count, info.bytes), (2, 2))
+
+
+class RunTest(unittest.TestCase):
+
+    def test_run(self):
+        from tests.test_engine import run
+
+        service = Service()
+        service.add('tmp-a', ['k{}'.format(index) for index in range(250)])
+        service.add('tmp-b', ['a', 'bb', 'ccc'])
+        service.add('keep', ['k'])
+        store = stub_store(service, bulk_size='20')
+
+        deleter = run(store, ['tmp-'], verify='full')
+        report = deleter.audit_report()
+        self.assertEqual(sorted(service.buckets), ['keep'])
+        self.assertEqual(deleter.deleted_objects, 253)
+        self.assertEqual(report['containers']['tmp-a']['bytes'],
+                         10 * 2 + 90 * 3 + 150 * 4)
+        self.assertEqual(report['containers']['tmp-b']['bytes'], 6)
+        self.assertEqual(report['bytes_before'], 896)
+        self.assertTrue(report['verification']['verified'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""test_scheduler.py: Tests of the largest first container schedule."""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+import threading
+import unittest
+from containercache import ContainerCache, ContainerInfo
+from objectstore import ObjectStore
+from scheduler import Schedule
+
+
+def store(sizes):
+    """
+    Builds an object store whose cache holds the given sizes
+    :param sizes: A dict of container names and object counts
+    :return: An ObjectStore
+    """
+    object_store = ObjectStore.__new__(ObjectStore)
+    object_store.cache = ContainerCache()
+    for name, size in sizes.items():
+        object_store.cache.put(ContainerInfo(name, object_count=size))
+    return object_store
+
+
+def order(schedule):
+    """
+    Takes every container from a schedule
+    :param schedule: The Schedule
+    :return: A list of container names
+    """
+    containers = list()
+    while True:
+        container = schedule.next()
+        if container is None:
+            return containers
+        containers.append(container)
+
+
+class ScheduleTest(unittest.TestCase):
+
+    def test_largest_first(self):
+        schedule = Schedule(['a', 'b', 'c', 'd'],
+                            store(dict(a=10, b=1000, c=0, d=50)))
+        self.assertEqual(order(schedule), ['b', 'd', 'a', 'c'])
+        self.assertIsNone(schedule.next())
+
+    def test_unknown_sizes_first(self):
+        schedule = Schedule(['a', 'b', 'c', 'd'],
+                            store(dict(a=10, c=1000)))
+        self.assertEqual(order(schedule), ['b', 'd', 'c', 'a'])
+
+    def test_ties_keep_their_order(self):
+        schedule = Schedule(['c', 'a', 'b'], store(dict(a=5, b=5, c=5)))
+        self.assertEqual(order(schedule), ['c', 'a', 'b'])
+
+    def test_no_cache(self):
+        object_store = ObjectStore.__new__(ObjectStore)
+        schedule = Schedule(['b', 'a'], object_store)
+        self.assertEqual(order(schedule), ['b', 'a'])
+        self.assertIsNone(schedule.total())
+
+    def test_sizes(self):
+        schedule = Schedule(['a', 'b'], store(dict(a=10, b=20)))
+        self.assertEqual(schedule.size('a'), 10)
+        self.assertIsNone(schedule.size('z'))
+        self.assertEqual(schedule.total(), 30)
+        self.assertEqual(len(schedule), 2)
+        self.assertIsNone(Schedule(['a', 'b'], store(dict(a=10))).total())
+
+    def test_threads_share_containers(self):
+        containers = ['c{}'.format(index) for index in range(1000)]
+        schedule = Schedule(containers, store(dict()))
+        taken = list()
+
+        def take():
+            while True:
+                container = schedule.next()
+                if container is None:
+                    return
+                taken.append(container)
+
+        threads = [threading.Thread(target=take) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(taken), sorted(containers))
+
+
+if __name__ == '__main__':
+    unittest.main()
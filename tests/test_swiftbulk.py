@@ -0,0 +1,147 @@
+"""test_swiftbulk.py: Tests of Swift bulk delete bodies and reports."""
+
+__author__ = "Chelsea Urquhart"
+__copyright__ = "Copyright 2015, Chelsea Urquhart"
+__license__ = "GPL"
+__email__ = "me@chelseau.com"
+
+import json
+import time
+import unittest
+from stores import swiftbulk
+from stores.hedging import Hedger
+from stores.swiftbulk import BulkDeleteError, BulkDeleter, decode_path, \
+    encode_path, stream
+
+
+class Response:
+    """A stub requests response"""
+
+    def __init__(self, status_code=200, report=None, reason='OK'):
+        self.status_code = status_code
+        self.reason = reason
+        # The middleware pads reports with whitespace
+        self.content = b'  \n' + json.dumps(report or dict()).encode('utf-8')
+
+
+class Session:
+    """A stub requests session answering with canned responses"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.bodies = list()
+
+    def post(self, url, params=None, headers=None, data=None, timeout=None):
+        self.bodies.append(b''.join(data))
+        return self.responses.pop(0)
+
+
+class NoSleep:
+    """Stands in for the time module so retries don't back off"""
+
+    @staticmethod
+    def sleep(seconds):
+        pass
+
+
+def bulk_deleter(responses, reauth=None):
+    """
+    Builds a bulk deleter whose single connection is a stub session
+    :param responses: The Responses to answer with, in order
+    :param reauth: The reauthentication function
+    :return: A BulkDeleter
+    """
+    # The real constructor opens requests sessions
+    deleter = BulkDeleter.__new__(BulkDeleter)
+    deleter.storage_url = 'https://swift/v1/AUTH_test'
+    deleter.token = 'token'
+    deleter.reauth = reauth
+    deleter.timeout = None
+    deleter.hedger = Hedger()
+    deleter.sessions = [Session(responses)]
+    return deleter
+
+
+class PathTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        for container, object_ in [('c', 'o'), ('c', 'a/b/c.txt'),
+                                   ('my container', 'with space & %'),
+                                   (u'caf\u00e9', u'\u2603/\u00e9')]:
+            line = encode_path(container, object_)
+            self.assertTrue(line.endswith(b'\n'))
+            self.assertNotIn(b' ', line)
+            self.assertEqual(decode_path(line[:-1].decode('ascii')),
+                             (container, object_))
+
+    def test_stream(self):
+        body = b''.join(stream([('c', 'a'), ('c', 'b c')]))
+        self.assertEqual(body, b'/c/a\n/c/b%20c\n')
+
+
+class BulkDeleterTest(unittest.TestCase):
+
+    def setUp(self):
+        swiftbulk.time = NoSleep
+        self.addCleanup(setattr, swiftbulk, 'time', time)
+
+    def test_deleted(self):
+        deleter = bulk_deleter([Response(report={
+            'Response Status': '200 OK', 'Number Deleted': 2,
+            'Number Not Found': 1, 'Errors': []})])
+        self.assertEqual(deleter.delete([('c', 'a'), ('c', 'b'),
+                                         ('c', 'gone')]), (3, []))
+
+    def test_failed_paths_are_retried(self):
+        deleter = bulk_deleter([
+            Response(report={'Response Status': '400 Bad Request',
+                             'Number Deleted': 1,
+                             'Errors': [['/c/b%20c', '409 Conflict']]}),
+            Response(report={'Response Status': '200 OK',
+                             'Number Deleted': 1, 'Errors': []})])
+        self.assertEqual(deleter.delete([('c', 'a'), ('c', 'b c')]),
+                         (2, []))
+        self.assertEqual(deleter.sessions[0].bodies[1], b'/c/b%20c\n')
+
+    def test_failures_are_reported(self):
+        report = {'Response Status': '400 Bad Request', 'Number Deleted': 0,
+                  'Errors': [['/c/a', '409 Conflict']]}
+        deleter = bulk_deleter([Response(report=report)] * 3)
+        self.assertEqual(deleter.delete([('c', 'a')]),
+                         (0, [('c', 'a', '409 Conflict')]))
+
+    def test_request_failures(self):
+        deleter = bulk_deleter([Response(503, reason='Unavailable')] * 2)
+        self.assertEqual(deleter.delete([('c', 'a')], retry=1),
+                         (0, [('c', 'a', '503 Unavailable')]))
+
+    def test_status_without_errors_fails(self):
+        deleter = bulk_deleter([Response(report={
+            'Response Status': '413 Request Entity Too Large',
+            'Response Body': 'Max delete failures exceeded'})])
+        self.assertRaises(BulkDeleteError, deleter.request, 0, [('c', 'a')])
+
+    def test_reauth(self):
+        deleter = bulk_deleter([
+            Response(401, reason='Unauthorized'),
+            Response(report={'Response Status': '200 OK',
+                             'Number Deleted': 1})],
+            reauth=lambda token: ('https://swift/v1/AUTH_new', 'new'))
+        self.assertEqual(deleter.delete([('c', 'a')]), (1, []))
+        self.assertEqual(deleter.token, 'new')
+
+    def test_batches(self):
+        paths = [('c', str(index))
+                 for index in range(swiftbulk.MAX_BULK_DELETE + 5)]
+        deleter = bulk_deleter([
+            Response(report={'Number Deleted': swiftbulk.MAX_BULK_DELETE,
+                             'Response Status': '200 OK'}),
+            Response(report={'Number Deleted': 5,
+                             'Response Status': '200 OK'})])
+        self.assertEqual(deleter.delete(paths),
+                         (swiftbulk.MAX_BULK_DELETE + 5, []))
+        self.assertEqual(deleter.sessions[0].bodies[1].count(b'\n'), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
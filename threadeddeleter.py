@@ -5,9 +5,17 @@ __copyright__ = "Copyright 2015, Chelsea Urquhart"
 __license__ = "GPL"
 __email__ = "me@chelseau.com"
 
+from atomicfile import atomic_write
+from audit import Audit, MAX_FAILURES_REPORTED, upper_bound
+from containercache import ContainerCache
+from incremental import IncrementalState
+import json
+import math
+from memory import BoundedQueue, ContainerTable, KeyBatch, peak_rss
 import os
+from profiler import NULL_PROFILER, StageProfiler
+from scheduler import Schedule
 import signal
-import sys
 import threading
 try:
     import queue as Queue
@@ -15,6 +23,17 @@ except ImportError:
     import Queue
 import time
 
+# The signals that stop a run
+SIGNALS = [signal.SIGINT, signal.SIGTERM, signal.SIGHUP]
+
+# How often, in seconds, the main thread checks whether it was told to stop
+# while waiting on the queue
+POLL_INTERVAL = 0.5
+
+
+class DeleteError(Exception):
+    """Raised when a run fails"""
+
 
 class ThreadedDeleter:
     """A class for managing and controlling deletion threads."""
@@ -28,48 +47,117 @@ class ThreadedDeleter:
     def signal_handler(self, signum, frame):
         """
         Handles signals. This is responsible for handling SIGINT, SIGTERM,
-        and SIGHUP.
+        and SIGHUP. The first signal stops listing and gives the threads
+        drain_timeout seconds to work through the queue. Whatever is left is
+        checkpointed. A second signal kills us immediately.
         :param signum: The signal that we received
         :param frame: The frame info
         :return: None
         """
-        # Shut down all the threads.
-        self.finish()
+        self.signum = signum
+        self.stop()
 
-        # Remove handler
-        signal.signal(signum, signal.SIG_DFL)
+        # Remove handlers so a second signal aborts
+        for other in SIGNALS:
+            signal.signal(other, signal.SIG_DFL)
 
-        # Throw signal
-        os.kill(os.getpid(), signum)
+    def stop(self):
+        """
+        Stops listing and gives the threads drain_timeout seconds to work
+        through the queue. This only sets flags so it's safe to call from
+        signal handlers and other threads.
+        :return: None
+        """
+        if not self.stopping:
+            self.deadline = time.time() + self.drain_timeout
+            self.stopping = True
 
-    def __init__(self, object_store, settings):
+    def __init__(self, object_store, settings, on_progress=None):
         """
         Initializes a threaded deleter class.
         :param object_store: The object store we're working with
         :param settings: The settings object to get our settings from
+        :param on_progress: A function called with a progress dict whenever
+         a container is listed or deleted
         :return: None
         """
         self.object_store = object_store
+        self.on_progress = on_progress
         self.queue_size = settings.queue_size
         self.max_threads = settings.max_threads
+        self.list_threads = settings.list_threads
+        self.list_prefetch = settings.list_prefetch
         self.verbose = settings.verbose
 
-        self.lock = threading.Lock()
-        self.queue = Queue.Queue(settings.queue_size)
+        # Queued keys are packed into per-container batches. With a memory
+        # budget the queue is bounded by bytes rather than by keys.
+        self.queue = BoundedQueue(
+            max_keys=0 if settings.memory_budget > 0 else settings.queue_size,
+            max_bytes=settings.memory_budget)
+        self.containers = ContainerTable()
         self.finished = False
+        self.failed = False
+        self.error = None
         self.deleted_objects = 0
+        self.containers_total = 0
+        self.matched = list()
+        self.containers_listed = 0
+        self.containers_deleted = 0
+        self.start_time = None
         self.threads = []
+        self.reserved = 0
+        self.lock = threading.Lock()
+
+        # Shutdown
+        self.handle_signals = settings.handle_signals
+        self.previous_handlers = dict()
+        self.drain_timeout = settings.drain_timeout
+        self.checkpoint_file = settings.checkpoint_file
+        self.stopping = False
+        self.signum = None
+        self.deadline = None
+        self.leftovers = []
+
+        # Incremental runs remember the highest key listed in each container
+        self.state_file = settings.state_file
+        self.incremental_marker = settings.incremental_marker
+        self.state = None
+        self.markers = dict()
+
+        # Failed deletes are recorded as stores report them. The run can be
+        # verified by listing again or by checking a sample of what we listed.
+        self.verify = settings.verify
+        self.audit_file = settings.audit_file
+        self.audit = Audit(settings.verify_samples
+                           if settings.verify == 'sample' else 0)
+        self.verification = None
+
+        # Profiling is opt-in. The null profiler costs next to nothing.
+        if settings.profile:
+            self.profiler = StageProfiler(settings.profile_sampler)
+        else:
+            self.profiler = NULL_PROFILER
+        self.profile_output = settings.profile_output
+        self.profile_reported = False
+
+        # Container handles and metadata are shared by every thread. A store
+        # reused across runs keeps its warm cache.
+        if self.object_store.cache is None:
+            self.object_store.cache = ContainerCache(
+                settings.container_cache_size)
 
     def __enter__(self):
         """
         Setup the class. This registers a signal handler to make sure we can
-        shut down cleanly
+        shut down cleanly, unless handle_signals is off. Signal handlers can
+        only be registered on the main thread.
         :return: self
         """
         # Register signal handlers
-        signal.signal(signal.SIGINT, self.signal_handler)
-        signal.signal(signal.SIGTERM, self.signal_handler)
-        signal.signal(signal.SIGHUP, self.signal_handler)
+        if self.handle_signals:
+            for signum in SIGNALS:
+                self.previous_handlers[signum] = signal.signal(
+                    signum, self.signal_handler)
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
@@ -81,6 +169,47 @@ class ThreadedDeleter:
         :return: None
         """
         self.finish()
+        self.report_profile()
+
+        # Verification is done too, so nothing of ours makes requests
+        self.object_store.release_threads(self.reserved)
+        self.reserved = 0
+
+        if self.signum is not None:
+            # Exit the way the signal would have made us exit
+            os.kill(os.getpid(), self.signum)
+
+        # Restore whatever handled signals before us
+        for signum, handler in self.previous_handlers.items():
+            signal.signal(signum, handler)
+        self.previous_handlers = dict()
+
+    def report_profile(self):
+        """
+        Writes the profile report, if profiling is enabled
+        :return: None
+        """
+        if not self.profiler.enabled or self.profile_reported:
+            return
+        self.profile_reported = True
+        self.profiler.stop_thread()
+
+        report = self.profiler.report()
+        if len(self.profile_output) > 0:
+            with open(self.profile_output, 'w') as f:
+                f.write(report + '\n')
+            ThreadedDeleter.output('Profile written to {}'.format(
+                self.profile_output))
+        else:
+            for line in report.splitlines():
+                ThreadedDeleter.output(line)
+
+        path = (os.path.splitext(self.profile_output)[0] or 'deleter') + \
+            '.pstats'
+        if self.profiler.dump(path):
+            ThreadedDeleter.output('{sampler} output written to {path}'
+                                   .format(sampler=self.profiler.sampler,
+                                           path=path))
 
     def delete_object(self, thread_id):
         """
@@ -89,8 +218,14 @@ class ThreadedDeleter:
         :param thread_id: The numeric ID of the currently running thread
         :return: None
         """
-        # Setup a threadlocal instance for this thread
+        self.profiler.start_thread()
+
+        # Setup a threadlocal instance for this thread. Stores record into
+        # the profiler and audit of our run through it so several runs can
+        # share a store.
         local = threading.local()
+        local.profiler = self.profiler
+        local.audit = self.audit
         if hasattr(self.object_store, 'init_local'):
             # Legacy support
             self.object_store.init_local(local)
@@ -99,139 +234,306 @@ class ThreadedDeleter:
 
         # Is there more data to process?
         while not self.finished:
-            self.lock.acquire()
-            if not self.queue.empty():
-                container, object = self.queue.get()
-                self.lock.release()
+            with self.profiler.stage('dequeue_wait'):
+                try:
+                    batch = self.queue.get()
+                except Queue.Empty:
+                    # The queue was closed. We're done.
+                    break
+
+            container = self.containers.name(batch.container)
+            for object in batch:
                 if self.verbose:
                     ThreadedDeleter.output('[Thread %s] Deleting %s...' % (
                         thread_id, object))
                 try:
-                    self.object_store.delete_object(container, object, local)
-                except Exception:
+                    with self.profiler.stage('delete'):
+                        self.object_store.delete_object(container, object,
+                                                        local)
+                except Exception as e:
+                    self.error = e
                     self.finished = True
+                    self.queue.close()
                     raise
-            else:
-                self.lock.release()
-                time.sleep(1)
-                # Sleep for 1 second
 
+        # Flush whatever is buffered. Every thread does this at once. Past the
+        # drain deadline there's no time left for that, so it's checkpointed
+        # instead.
+        if self.stopping and time.time() >= self.deadline:
+            self.keep_leftovers(self.object_store.take_buffered(local))
         if hasattr(self.object_store, 'cleanup_local'):
             # Legacy support
             self.object_store.cleanup_local(local)
 
         self.object_store.cleanup_thread(local)
+        self.profiler.stop_thread()
+
+    def pack(self, data):
+        """
+        Groups objects into one packed batch per container
+        :param data: A list of tuples containing container, filename
+        :return: A list of KeyBatch objects
+        """
+        keys = dict()
+        for container, object in data:
+            if container not in keys:
+                keys[container] = list()
+            keys[container].append(object)
+
+        return [KeyBatch(self.containers.id(container), objects)
+                for container, objects in keys.items()]
 
     def add_to_queue(self, data):
         """
-        Adds the given container, filename tuple to the deletion queue
-        :param data: A tuple containing container, filename
+        Adds the given container, filename tuples to the deletion queue
+        :param data: A list of tuples containing container, filename
+        :return: None
+        """
+        for batch in self.pack(data):
+            while True:
+                try:
+                    # Is the queue full? Wait for the threads to catch up.
+                    self.queue.put(batch, True, POLL_INTERVAL)
+                    with self.lock:
+                        self.deleted_objects += len(batch)
+                    break
+                except Queue.Full:
+                    if self.finished or self.stopping:
+                        # Nothing is going to wait for room. Keep it for the
+                        # checkpoint.
+                        self.leftovers.append(batch)
+                        break
+
+    def keep_leftovers(self, data):
+        """
+        Keeps objects that were queued but not deleted for the checkpoint
+        :param data: A list of tuples containing container, filename
         :return: None
         """
-        # Acquire a lock
-        self.lock.acquire()
+        batches = self.pack(data)
+        with self.lock:
+            self.leftovers.extend(batches)
+            self.deleted_objects -= sum(len(batch) for batch in batches)
 
-        # Iterate the array of data. Put it in the queue.
-        for item in data:
-            try:
-                self.queue.put(item, False)
-                self.deleted_objects += 1
-            except Queue.Full:
-                # Is the queue full? Lets sleep for a bit to let the threads
-                # catch up.
-                self.lock.release()
-                while self.queue.full():
-                    # Let some threads catch up!
-                    time.sleep(1)
-
-                # The queue isn't full anymore so we can acquire a new lock
-                # and put the item in again. This time we're going to use a
-                # blocking request because we cannot have this fail.
-                self.lock.acquire()
-                self.queue.put(item)
-                self.deleted_objects += 1
-        self.lock.release()
+    def resume(self, containers):
+        """
+        Queues the work a previous run checkpointed when it was stopped
+        :param containers: The containers we're deleting from
+        :return: None
+        """
+        if len(self.checkpoint_file) == 0 or \
+                not os.path.exists(self.checkpoint_file):
+            return
+
+        containers = set(containers)
+        count = 0
+        with open(self.checkpoint_file) as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry['container'] not in containers:
+                    continue
+                self.add_to_queue([(entry['container'], object)
+                                   for object in entry['objects']])
+                count += len(entry['objects'])
+        os.remove(self.checkpoint_file)
+
+        ThreadedDeleter.output('Resumed %s checkpointed objects' % count)
+
+    def drain(self):
+        """
+        Waits for the threads to work through the queue. If we were told to
+        stop, this waits no longer than the drain deadline and keeps whatever
+        is left for the checkpoint.
+        :return: None
+        """
+        while not self.finished:
+            timeout = POLL_INTERVAL
+            if self.stopping:
+                timeout = min(timeout, self.deadline - time.time())
+                if timeout <= 0:
+                    break
+            if self.queue.join(0, timeout):
+                break
+
+        if not self.stopping:
+            return
+
+        batches = self.queue.drain()
+        self.deleted_objects -= sum(len(batch) for batch in batches)
+        self.leftovers.extend(batches)
+
+    def checkpoint(self):
+        """
+        Writes the work that was queued but not deleted to the checkpoint
+        file so the next run deletes it first
+        :return: None
+        """
+        count = sum(len(batch) for batch in self.leftovers)
+        if count == 0:
+            return
+        # finish runs again on exit. Don't write the checkpoint twice.
+        leftovers, self.leftovers = self.leftovers, []
+
+        if len(self.checkpoint_file) == 0:
+            ThreadedDeleter.output('%s queued objects were not deleted. They'
+                                   ' will be listed again on the next run.'
+                                   % count)
+            return
+
+        with atomic_write(self.checkpoint_file) as f:
+            for batch in leftovers:
+                f.write(json.dumps(dict(
+                    container=self.containers.name(batch.container),
+                    objects=list(batch))) + '\n')
+
+        ThreadedDeleter.output('Checkpointed %s queued objects to %s' % (
+            count, self.checkpoint_file))
 
     def delete(self, prefixes):
         """
         Deletes all files in all containers identified by prefix
 
         :param prefixes: A list of prefixes
-        :return: None
+        :return: The final progress dict
+        :throws: DeleteError if the run failed
         """
-        # Login
-        if self.verbose:
-            ThreadedDeleter.output('Logging in...')
-        if not self.object_store.login():
-            self.finish()
-            sys.exit(1)
+        self.profiler.start_thread()
+        self.start_time = time.time()
+
+        # Login. A store that's reused across runs stays logged in.
+        if not self.object_store.logged_in:
+            if self.verbose:
+                ThreadedDeleter.output('Logging in...')
+            with self.profiler.stage('login'):
+                logged_in = self.object_store.login()
+            if not logged_in:
+                raise self.fail('Login failed')
+            self.object_store.logged_in = True
+
+        # Workers, listers and their prefetch threads all make requests
+        self.reserved = self.max_threads + 2 * self.list_threads
+        self.object_store.reserve_threads(self.reserved)
+
+        if len(self.state_file) > 0:
+            try:
+                self.state = IncrementalState(self.state_file)
+            except (IOError, ValueError) as e:
+                raise self.fail('Loading {path} failed: {err}'.format(
+                    path=self.state_file, err=str(e)))
 
         # Fetch matching containers
         if self.verbose:
             ThreadedDeleter.output('Fetching containers...')
-        containers = self.object_store.list_containers(prefixes)
+        with self.profiler.stage('list_containers'):
+            containers = self.object_store.list_containers(prefixes)
         if containers is False:
-            self.finish()
-            sys.exit(1)
+            raise self.fail('Listing containers failed')
+        self.containers_total = len(containers)
+        self.matched = containers
+
+        # Fetch container handles and metadata all at once rather than one
+        # request at a time as we get to each container
+        with self.profiler.stage('prefetch'):
+            errors = self.object_store.prefetch_containers(containers,
+                                                           self.max_threads)
+        if len(errors) > 0:
+            ThreadedDeleter.output('Fetching metadata failed for %s'
+                                   ' containers: %s' % (len(errors),
+                                                        errors[0]))
+
+        # Every container is reported, along with its size before we started
+        for container in containers:
+            info = self.object_store.cache.get(container)
+            self.audit.container(container).bytes = \
+                None if info is None else info.bytes
 
         # Initialize and start up threads 1-max_threads
         for index in range(1, self.max_threads):
-            thread = threading.Thread(target=self.delete_object, args=[index])
+            thread = threading.Thread(target=self.delete_object, args=[index],
+                                      name='Worker-{}'.format(index))
             thread.start()
             self.threads.append(thread)
 
-        data = []
-        start_time = time.time()
+        # Work left over from a run that was stopped goes first
+        self.resume(containers)
+
+        # Largest containers go first. Several threads list at once so the
+        # small containers fill in around the large ones.
+        schedule = Schedule(containers, self.object_store)
+        if self.verbose and schedule.total() is not None:
+            ThreadedDeleter.output('Found %s objects in %s containers' % (
+                schedule.total(), len(containers)))
+
+        listers = []
+        for index in range(1, min(self.list_threads, len(containers))):
+            thread = threading.Thread(target=self.list_thread,
+                                      args=[schedule, index],
+                                      name='Lister-{}'.format(index))
+            thread.start()
+            listers.append(thread)
 
-        # Iterate the list of containers to delete everything
-        for container in containers:
-            if self.verbose:
-                ThreadedDeleter.output('Processing %s...' % container)
-            while not self.finished:
-                # Keep trying until we run out of files for object stores
-                # that don't return everything at once.
-                files = self.object_store.list_objects(container)
-                if files is False:
-                    self.finish()
-                    sys.exit(1)
+        # This thread lists too
+        self.list_schedule(schedule)
+        for thread in listers:
+            thread.join()
+
+        if self.failed:
+            raise self.fail('Listing objects failed')
 
-                if len(files) == 0:
-                    break
-                for file in files:
-                    data.append((container, file))
-                    # continue
-                    if len(data) > self.max_threads / 2:
-                        # We've got enough of a buffer to get going. Lets
-                        # do it!
-                        self.add_to_queue(data)
-                        data = []
-                while self.queue.qsize() > self.max_threads / 2:
-                    # Sleep for a second before we retry this container.
-                    # There were likely errors on some files, so we'll want
-                    # to retry those.
-                    time.sleep(1)
-                # Add any leftovers to the queue
-                if len(data) > 0:
-                    self.add_to_queue(data)
-                    data = []
-            ThreadedDeleter.output('Finished Processing %s...' % container)
-            # All out of files!
         # Wait for all the data to be processed before we continue.
-        while not self.queue.empty():
-            time.sleep(1 / 10)
-            pass
+        with self.profiler.stage('enqueue_wait'):
+            self.drain()
 
         # Set the finished variable so all the threads will die when they're
         # done working
         self.finish()
 
-        # Iterate the containers again and delete them.
-        for container in containers:
-            if self.verbose:
-                ThreadedDeleter.output('Deleting %s...' % container)
-            if not self.object_store.delete_container(container):
-                self.finish()
-                sys.exit(1)
+        if self.error is not None:
+            raise self.fail('Deleting objects failed: {}'.format(self.error))
+
+        if self.stopping:
+            # The containers aren't empty. Leave them for the next run, which
+            # may reuse this store.
+            self.reset_listing()
+            ThreadedDeleter.output(
+                'Stopped. Deleted %s objects in %s seconds' % (
+                    self.deleted_objects, time.time() - self.start_time))
+            self.write_audit()
+            return self.progress()
+
+        # Containers are verified before they're deleted, which would leave
+        # nothing to list
+        if len(self.verify) > 0:
+            with self.profiler.stage('verify'):
+                self.verify_run(containers)
+
+        if self.state is not None:
+            # Incremental runs leave the containers in place for new objects
+            # and remember how far we got instead. Containers with failed
+            # deletes keep their old state so the next run retries them.
+            for container in containers:
+                if self.audit.container(container).failed > 0:
+                    continue
+                self.state.update(container, self.markers.get(
+                    container, self.state.marker(container)), self.start_time)
+            try:
+                self.state.save()
+            except IOError as e:
+                raise self.fail('Saving {path} failed: {err}'.format(
+                    path=self.state_file, err=str(e)))
+
+        else:
+            # Iterate the containers again and delete them.
+            for container in containers:
+                if self.verbose:
+                    ThreadedDeleter.output('Deleting %s...' % container)
+                with self.profiler.stage('container_delete'):
+                    deleted = self.object_store.delete_container(container)
+                if not deleted:
+                    raise self.fail('Deleting {} failed'.format(container))
+                self.audit.container(container).deleted = True
+                self.containers_deleted += 1
+                self.report_progress()
 
         # Calculate Duration
         end_time = time.time()
@@ -243,19 +545,473 @@ class ThreadedDeleter:
             ThreadedDeleter.output(
                 'Deleted %s objects from %s containers in %s seconds' % (
                     self.deleted_objects, len(containers),
-                    (end_time - start_time)))
+                    (end_time - self.start_time)))
+
+            rss = peak_rss()
+            if rss is not None:
+                ThreadedDeleter.output('Peak memory usage: %.1f MB' % (
+                    rss / 1048576.0))
+
+        if self.audit.failed > 0:
+            ThreadedDeleter.output('%s objects could not be deleted' %
+                                   self.audit.failed)
+
+        if not self.write_audit():
+            raise DeleteError('Writing the audit report to {} failed'.format(
+                self.audit_file))
+        return self.progress()
+
+    def reset_listing(self):
+        """
+        Forgets how far our containers were listed so the next run using the
+        store lists them from the start. Other runs sharing the store keep
+        their place.
+        :return: None
+        """
+        self.object_store.reset_listing(self.matched)
+
+    def fail(self, message):
+        """
+        Finishes a failed run and writes its audit report
+        :param message: What went wrong
+        :return: A DeleteError to raise
+        """
+        self.finish()
+        self.write_audit(message)
+        return DeleteError(message)
+
+    def verify_run(self, containers):
+        """
+        Verifies the objects we listed are gone. Sampling falls back to
+        listing every container again for stores that can't check objects.
+        :param containers: The containers we deleted from
+        :return: None
+        """
+        if self.verify == 'sample':
+            if self.object_store.can_check_objects:
+                self.verification = self.verify_sample()
+                return
+            ThreadedDeleter.output('The store can\'t check single objects.'
+                                   ' Listing every container instead.')
+        self.verification = self.verify_full(containers)
+
+    def verify_full(self, containers):
+        """
+        Lists every container again on list_threads threads and counts
+        what's left
+        :param containers: The containers we deleted from
+        :return: A dict describing the verification
+        """
+        start = time.time()
+
+        # Incremental runs are verified over the whole container. Anything
+        # before the marker or older than the last run counts too.
+        def count(container):
+            remaining = 0
+            while True:
+                files = self.object_store.list_objects(container)
+                if files is False:
+                    return None
+                if len(files) == 0:
+                    return remaining
+                remaining += len(files)
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        counts = list()
+        if len(containers) > 0:
+            with ThreadPoolExecutor(min(self.list_threads,
+                                        len(containers))) as executor:
+                counts = list(executor.map(count, containers))
+
+        unverified = list()
+        for container, remaining in zip(containers, counts):
+            self.audit.container(container).remaining = remaining
+            if remaining is None:
+                unverified.append(container)
+        if len(unverified) > 0:
+            # Failed listings leave markers behind
+            self.object_store.reset_listing(unverified)
+
+        remaining = sum(count_ for count_ in counts if count_ is not None)
+        if self.verbose:
+            ThreadedDeleter.output(
+                'Verified %s containers: %s objects remain%s' % (
+                    len(containers) - len(unverified), remaining,
+                    '' if len(unverified) == 0 else
+                    '. Listing %s containers failed' % len(unverified)))
+
+        return dict(mode='full', seconds=time.time() - start,
+                    containers=len(containers),
+                    unverified_containers=unverified,
+                    remaining_objects=remaining,
+                    verified=remaining == 0 and len(unverified) == 0)
+
+    def verify_sample(self):
+        """
+        Checks whether a uniform sample of the objects we listed still exist
+        and bounds how many were left behind
+        :return: A dict describing the verification
+        """
+        start = time.time()
+        sample = list(self.audit.sample.items)
+        population = self.audit.sample.seen
+
+        def check(item):
+            try:
+                return self.object_store.object_exists(*item)
+            except Exception:
+                return None
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        results = list()
+        if len(sample) > 0:
+            with ThreadPoolExecutor(min(self.max_threads,
+                                        len(sample))) as executor:
+                results = list(executor.map(check, sample))
+
+        survivors = [dict(container=container, object=object_)
+                     for (container, object_), exists in zip(sample, results)
+                     if exists]
+        errors = sum(1 for exists in results if exists is None)
+        checked = len(results) - errors
+        estimate = len(survivors) * population // checked if checked else \
+            population
+        bound = int(math.ceil(upper_bound(len(survivors), checked) *
+                              population))
+        if self.verbose:
+            ThreadedDeleter.output(
+                'Verified %s of %s objects: %s remain. At most %s of %s'
+                ' remain with 95%% confidence.' % (
+                    checked, population, len(survivors), bound, population))
+
+        return dict(mode='sample', seconds=time.time() - start,
+                    population=population, samples=len(sample),
+                    checked=checked, errors=errors,
+                    survivors=survivors[:MAX_FAILURES_REPORTED],
+                    survivor_count=len(survivors),
+                    estimated_remaining_objects=estimate,
+                    remaining_objects_upper_bound=bound, confidence=0.95,
+                    verified=len(survivors) == 0 and errors == 0)
+
+    def audit_report(self, error=None):
+        """
+        Builds the audit report of the run
+        :param error: What failed the run, if anything
+        :return: A dict
+        """
+        def iso(seconds):
+            return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds))
+
+        end_time = time.time()
+        start_time = self.start_time or end_time
+        containers, failures = self.audit.report()
+        listed = sum(record['listed'] for record in containers.values())
+        sizes = [record['bytes'] for record in containers.values()]
+        requested = self.deleted_objects
+        deleted = max(0, requested - self.audit.failed)
+
+        return dict(started=iso(start_time), finished=iso(end_time),
+                    seconds=end_time - start_time,
+                    stopped=self.stopping, error=error,
+                    containers_total=self.containers_total,
+                    containers_listed=self.containers_listed,
+                    containers_deleted=self.containers_deleted,
+                    listed_objects=listed, requested_objects=requested,
+                    failed_objects=self.audit.failed,
+                    deleted_objects=deleted,
+                    bytes_before=None if None in sizes else sum(sizes),
+                    objects_per_second=deleted / (end_time - start_time)
+                    if end_time > start_time else None,
+                    containers=containers, failures=failures,
+                    verification=self.verification)
+
+    def write_audit(self, error=None):
+        """
+        Writes the audit report to the audit file, if one is set
+        :param error: What failed the run, if anything
+        :return: True unless writing failed
+        """
+        if len(self.audit_file) == 0:
+            return True
+
+        try:
+            with atomic_write(self.audit_file) as f:
+                json.dump(self.audit_report(error), f, indent=1,
+                          sort_keys=True)
+        except IOError as e:
+            ThreadedDeleter.output('Writing %s failed: %s' % (
+                self.audit_file, e))
+            return False
+
+        if self.verbose:
+            ThreadedDeleter.output('Audit report written to %s' %
+                                   self.audit_file)
+        return True
+
+    def progress(self):
+        """
+        Returns the progress of the run
+        :return: A dict
+        """
+        return dict(containers=self.containers_total,
+                    containers_listed=self.containers_listed,
+                    containers_deleted=self.containers_deleted,
+                    deleted_objects=self.deleted_objects,
+                    failed_objects=self.audit.failed,
+                    queued_objects=self.queue.keys,
+                    seconds=time.time() - (self.start_time or time.time()),
+                    stopped=self.stopping)
+
+    def report_progress(self):
+        """
+        Calls the progress callback, if any
+        :return: None
+        """
+        if self.on_progress is not None:
+            self.on_progress(self.progress())
+
+    def list_thread(self, schedule, index):
+        """
+        The function for each additional listing thread
+        :param schedule: The Schedule to take containers from
+        :param index: The number of the listing thread
+        :return: None
+        """
+        self.profiler.start_thread()
+        try:
+            self.list_schedule(schedule, index)
+        except Exception as e:
+            # Containers must not be deleted after an incomplete listing
+            ThreadedDeleter.output('Listing objects failed: {}'.format(e))
+            self.failed = True
+        finally:
+            self.profiler.stop_thread()
+
+    def list_schedule(self, schedule, index=0):
+        """
+        Lists containers from the schedule and queues their objects until
+        there are none left. With prefetching, a thread of our own lists
+        pages ahead while we wait for the queue to drain, so listing
+        overlaps deleting rather than alternating with it.
+        :param schedule: The Schedule to take containers from
+        :param index: The number of the listing thread
+        :return: None
+        """
+        if self.list_prefetch == 0:
+            try:
+                while self.listing():
+                    container = self.next_container(schedule)
+                    if container is None:
+                        break
+                    self.list_container(container)
+            except Exception:
+                # Stop the other listing threads too
+                self.failed = True
+                raise
+            return
+
+        pages = Queue.Queue(self.list_prefetch)
+        thread = threading.Thread(target=self.prefetch_thread,
+                                  args=[schedule, pages],
+                                  name='Prefetch-{}'.format(index))
+        thread.start()
+
+        try:
+            while True:
+                try:
+                    with self.profiler.stage('list_wait'):
+                        page = pages.get(True, POLL_INTERVAL)
+                except Queue.Empty:
+                    if not self.listing():
+                        break
+                    continue
+
+                if page is None:
+                    break
+                container, files = page
+                if files is None:
+                    self.finish_container(container)
+                else:
+                    self.queue_page(container, files)
+        except Exception:
+            # Don't leave the prefetch thread waiting for room
+            self.failed = True
+            raise
+        finally:
+            thread.join()
+
+    def prefetch_thread(self, schedule, pages):
+        """
+        Lists containers from the schedule ahead of the listing thread that
+        queues their objects. Pages go to a buffer of list_prefetch pages,
+        followed by None for every completed container and a final None.
+        :param schedule: The Schedule to take containers from
+        :param pages: The Queue to buffer (container, page) tuples in
+        :return: None
+        """
+        self.profiler.start_thread()
+        try:
+            while self.listing():
+                container = self.next_container(schedule)
+                if container is None:
+                    break
+                for files in self.list_pages(container):
+                    self.offer(pages, (container, files))
+                if self.listing():
+                    self.offer(pages, (container, None))
+        except Exception as e:
+            # Containers must not be deleted after an incomplete listing
+            ThreadedDeleter.output('Listing objects failed: {}'.format(e))
+            self.failed = True
+        finally:
+            self.offer(pages, None)
+            self.profiler.stop_thread()
+
+    def offer(self, pages, page):
+        """
+        Adds a page to a prefetch buffer, waiting for room unless we stop
+        :param pages: The Queue buffering pages
+        :param page: The page to add
+        :return: None
+        """
+        while True:
+            try:
+                pages.put(page, True, POLL_INTERVAL)
+                return
+            except Queue.Full:
+                if not self.listing():
+                    return
+
+    def listing(self):
+        """
+        Returns whether listing should go on
+        :return: True unless we finished, were stopped or failed
+        """
+        return not self.finished and not self.stopping and not self.failed
+
+    def next_container(self, schedule):
+        """
+        Takes the next container from the schedule
+        :param schedule: The Schedule to take containers from
+        :return: The name of the container or None if there are none left
+        """
+        container = schedule.next()
+        if container is not None and self.verbose:
+            size = schedule.size(container)
+            ThreadedDeleter.output('Processing %s%s...' % (
+                container, '' if size is None else ' (%s objects)' % size))
+        return container
+
+    def list_pages(self, container):
+        """
+        Lists the objects of a container a page at a time
+        :param container: The name of the container
+        :return: A generator of lists of objects
+        """
+        self.narrow_listing(container)
+
+        while self.listing():
+            # Keep trying until we run out of files for object stores
+            # that don't return everything at once.
+            with self.profiler.stage('list'):
+                files = self.object_store.list_objects(container)
+            if files is False:
+                self.failed = True
+                return
+
+            if len(files) == 0:
+                return
+            self.markers[container] = files[-1]
+            self.audit.listed(container, files)
+            yield files
+
+    def narrow_listing(self, container):
+        """
+        Narrows the listing of a container to what's new since the last run
+        for incremental runs
+        :param container: The name of the container
+        :return: None
+        """
+        if self.state is not None:
+            self.object_store.start_listing(
+                container, self.state.marker(container)
+                if self.incremental_marker else None,
+                self.state.modified_since(container))
+
+    def list_container(self, container):
+        """
+        Lists all objects of a container and queues them for deletion
+        :param container: The name of the container
+        :return: None
+        """
+        for files in self.list_pages(container):
+            self.queue_page(container, files)
+        self.finish_container(container)
+
+    def queue_page(self, container, files):
+        """
+        Queues a page of objects for deletion and waits for the threads to
+        catch up before the next page is queued
+        :param container: The name of the container
+        :param files: A list of objects
+        :return: None
+        """
+        data = []
+        for file in files:
+            data.append((container, file))
+            # continue
+            if len(data) > self.max_threads / 2:
+                # We've got enough of a buffer to get going. Lets
+                # do it!
+                with self.profiler.stage('enqueue'):
+                    self.add_to_queue(data)
+                data = []
+        with self.profiler.stage('enqueue_wait'):
+            # Let the threads catch up before we list more
+            while not self.finished and not self.stopping and \
+                    not self.queue.join(self.max_threads / 2,
+                                        POLL_INTERVAL):
+                pass
+        # Add any leftovers to the queue
+        if len(data) > 0:
+            with self.profiler.stage('enqueue'):
+                self.add_to_queue(data)
+
+    def finish_container(self, container):
+        """
+        Counts a container whose objects were all queued
+        :param container: The name of the container
+        :return: None
+        """
+        if not self.stopping and not self.failed:
+            if self.verbose:
+                ThreadedDeleter.output('Finished Processing %s...' %
+                                       container)
+            # All out of files!
+            with self.lock:
+                self.containers_listed += 1
+            self.report_progress()
 
     def finish(self):
         """
         Sets our state to finished and waits for all threads to finish up
         :return: None
         """
-        if not self.finished:
-            self.finished = True
+        self.finished = True
+
+        # Wake up any waiting threads
+        self.queue.close()
+
+        # Wait for all the threads to finish working
+        for thread in self.threads:
+            thread.join()
 
-            # Wait for all the threads to finish working
-            for thread in self.threads:
-                thread.join()
+        # Workers hand back what they had no time to flush, so the
+        # checkpoint is written once they're done
+        if self.stopping:
+            self.checkpoint()
 
 
 ThreadedDeleter.output_lock = threading.Lock()